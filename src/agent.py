@@ -1,31 +1,22 @@
-from langchain_anthropic import ChatAnthropic
-# from langchain_core.agents import ToolCallParser # Corrected import for ToolCallParser
-from langchain.agents import AgentExecutor
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.agents.format_scratchpad.tools import format_to_tool_messages
-from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser # Corrected import
-# Output parser might not be needed here if AgentExecutor handles llm_with_tools output directly
-# from langchain_core.output_parsers.json import JsonOutputToolsParser 
-# from langchain.tools.render import render_text_description_and_args # No longer rendering tools in system message
-
-from .tools import TOOLS, MODEL_NAME, TEMPERATURE, MAX_TOKENS # Import LLM config too
+# LangChain's agent classes, the tools (and with them pandas and the data modules) and the LLM client
+# are imported in _build_executor(), on the first turn or in warmup(), so importing this module is cheap.
+from .llm_clients import get_llm, MODEL_NAME, TEMPERATURE, MAX_TOKENS
+from .result_store import get_result_store
+from .agent_events import AgentEventHandler
+from .memory import ConversationMemory
+from . import tracing
+import asyncio
+import functools
 import os # Import os
+import queue
+import threading
+import time
 
-# Explicitly get API key for ChatAnthropic
-ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
-if not ANTHROPIC_API_KEY:
-    print("Warning from agent.py: ANTHROPIC_API_KEY not found. LLM calls may fail.")
-
-# Claude LLM instance (using config from tools.py)
-llm = ChatAnthropic(
-    api_key=ANTHROPIC_API_KEY,
-    model=MODEL_NAME, 
-    temperature=TEMPERATURE, 
-    max_tokens=MAX_TOKENS
-)
-
-# Bind tools to LLM. This is the recommended way for tool usage with LangChain.
-llm_with_tools = llm.bind_tools(TOOLS)
+# Tool calls of one agent step run concurrently, up to this many at once (1 runs them one by one)
+AGENT_TOOL_CONCURRENCY = int(os.environ.get("AGENT_TOOL_CONCURRENCY", 4))
+# LangChain's step logging ("> Entering new AgentExecutor chain...") to stdout. Off by default: it would
+# be printed between the tokens of streamed turns
+AGENT_VERBOSE = os.environ.get("AGENT_VERBOSE", "0").lower() in ("1", "true", "yes")
 
 # System persona - simplified, as tools are bound separately
 system_message_content = (
@@ -34,62 +25,233 @@ system_message_content = (
     "Capabilities:\n"
     "- Filter controls by ID or attributes\n"
     "- Review controls via 5W, Operational Effectiveness, Design Effectiveness (max 10 at once)\n"
+    "  Review tools return a result_id and short digests. The user is shown the full reviews directly,\n"
+    "  so reply with a brief overview from the digests and the result_id; never restate whole reviews.\n"
     "- Explain your methodologies and introspect your tools\n"
     "- Update prompt templates for analysis types (5W, OE, DE)\n"
-    "- Compare, segment, and contrast controls\n\n"
+    "- Compare, segment, and contrast controls\n"
+    "  Request independent lookups together in one step; they run in parallel.\n\n"
     "Always respond copiously but concisely, maintain a friendly yet professional tone,\n"
     "and ask follow-up questions if clarification is needed.\n"
     "You must use the provided tools for any task that they are designed for."
     # Tool descriptions removed from here, as llm.bind_tools() handles it.
 )
 
-# This prompt structure is more aligned with how tool calling agents are built with LCEL
-prompt = ChatPromptTemplate.from_messages([
-    ("system", system_message_content),
-    MessagesPlaceholder(variable_name="chat_history", optional=True),
-    ("human", "{input}"),
-    MessagesPlaceholder(variable_name="agent_scratchpad"),
-])
-
-# This runnable produces the AIMessage with potential tool calls or final response
-tool_calling_runnable = (
-    {
-        "input": lambda x: x["input"],
-        "agent_scratchpad": lambda x: format_to_tool_messages(x["intermediate_steps"]),
-        "chat_history": lambda x: x.get("chat_history", [])
-    }
-    | prompt
-    | llm_with_tools
-    | OpenAIToolsAgentOutputParser() # Using OpenAIToolsAgentOutputParser
-)
+_agent_executor = None
+_executor_lock = threading.Lock()
 
-# AgentExecutor takes this runnable and the tools
-# The runnable (tool_calling_runnable) should output an AIMessage.
-# If it contains tool_calls, AgentExecutor executes them.
-# If not, AgentExecutor considers it the final answer.
-agent_executor = AgentExecutor(
-    agent=tool_calling_runnable, 
-    tools=TOOLS, 
-    verbose=True,
-    # Optionally, define how to get the final output from the AIMessage if it's not a tool call.
-    # For many standard cases, AgentExecutor handles this if the runnable outputs an AIMessage.
-    # If direct output from AIMessage content is needed: output_key="content"
-)
+def _run_tool_calls(calls):
+    """
+    Run the tool calls of one agent step, up to AGENT_TOOL_CONCURRENCY at once, and return
+    their AgentSteps in call order, so the scratchpad is the same as if they had run in turn.
+    """
+    if len(calls) <= 1 or AGENT_TOOL_CONCURRENCY <= 1:
+        return [call() for call in calls]
+    from concurrent.futures import ThreadPoolExecutor
+    from .review_engine import in_caller_context
+
+    # Each call runs in a copy of this thread's context, so its callbacks, trace spans and
+    # prompt overrides are those of the turn
+    with ThreadPoolExecutor(max_workers=min(AGENT_TOOL_CONCURRENCY, len(calls)), thread_name_prefix="agent-tool") as pool:
+        futures = [pool.submit(in_caller_context(call)) for call in calls]
+        return [future.result() for future in futures]
+
+def _build_executor():
+    from langchain.agents import AgentExecutor
+    from langchain.agents.format_scratchpad.tools import format_to_tool_messages
+    from langchain.agents.output_parsers.openai_tools import OpenAIToolsAgentOutputParser # Corrected import
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from .tools import TOOLS
+
+    # Claude LLM instance: the same shared, rate-limited client the review tools use (see llm_clients.py)
+    llm = get_llm(MODEL_NAME, TEMPERATURE, MAX_TOKENS)
+
+    # Bind tools to LLM. This is the recommended way for tool usage with LangChain.
+    llm_with_tools = llm.bind_tools(TOOLS)
+
+    # This prompt structure is more aligned with how tool calling agents are built with LCEL
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_message_content),
+        MessagesPlaceholder(variable_name="chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder(variable_name="agent_scratchpad"),
+    ])
+
+    # This runnable produces the AIMessage with potential tool calls or final response
+    tool_calling_runnable = (
+        {
+            "input": lambda x: x["input"],
+            "agent_scratchpad": lambda x: format_to_tool_messages(x["intermediate_steps"]),
+            "chat_history": lambda x: x.get("chat_history", [])
+        }
+        | prompt
+        | llm_with_tools
+        | OpenAIToolsAgentOutputParser() # Using OpenAIToolsAgentOutputParser
+    )
+
+    class ParallelToolsAgentExecutor(AgentExecutor):
+        """AgentExecutor that runs the tool calls of one step together instead of one after another."""
+
+        def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None):
+            # Deferred, so that _iter_next_step can run all of the step's calls at once
+            return functools.partial(super()._perform_agent_action, name_to_tool_map, color_mapping,
+                                     agent_action, run_manager)
+
+        def _iter_next_step(self, *args, **kwargs):
+            # The base class yields the step's actions, then one (here deferred) tool call per action
+            calls = []
+            for item in super()._iter_next_step(*args, **kwargs):
+                if isinstance(item, functools.partial):
+                    calls.append(item)
+                else:
+                    yield item
+            yield from _run_tool_calls(calls)
+
+    # AgentExecutor takes this runnable and the tools
+    # The runnable (tool_calling_runnable) should output an AIMessage.
+    # If it contains tool_calls, AgentExecutor executes them.
+    # If not, AgentExecutor considers it the final answer.
+    return ParallelToolsAgentExecutor(
+        agent=tool_calling_runnable, 
+        tools=TOOLS, 
+        verbose=AGENT_VERBOSE,
+        # The run name tracing and callbacks know the executor by
+        name="AgentExecutor",
+        # Tool outputs are read back by AgentWrapper to find the result_ids of stored reviews
+        return_intermediate_steps=True,
+        # Optionally, define how to get the final output from the AIMessage if it's not a tool call.
+        # For many standard cases, AgentExecutor handles this if the runnable outputs an AIMessage.
+        # If direct output from AIMessage content is needed: output_key="content"
+    )
+
+def get_agent_executor():
+    """The shared AgentExecutor, built on first use."""
+    global _agent_executor
+    if _agent_executor is None:
+        with _executor_lock:
+            if _agent_executor is None:
+                _agent_executor = _build_executor()
+    return _agent_executor
+
+def __getattr__(name):
+    # agent.agent_executor and agent.llm, as before the executor was built lazily
+    if name == "agent_executor":
+        return get_agent_executor()
+    if name == "llm":
+        return get_llm(MODEL_NAME, TEMPERATURE, MAX_TOKENS)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warmup(load_library=True):
+    """
+    Do the work the first turn would otherwise pay for: imports, the LLM client, the agent
+    executor, the review chains and (with load_library) the control library and its indexes.
+    For servers that would rather start slower than answer the first request slowly.
+    Returns the seconds spent on each step.
+    """
+    timings = {}
+    start = time.perf_counter()
+    get_agent_executor()
+    timings["agent"] = time.perf_counter() - start
+    from .tools import analysis_chains
+    start = time.perf_counter()
+    analysis_chains()
+    timings["chains"] = time.perf_counter() - start
+    if load_library:
+        from .data_loader import current_library
+        start = time.perf_counter()
+        current_library()
+        timings["library"] = time.perf_counter() - start
+    return {step: round(seconds, 3) for step, seconds in timings.items()}
 
 # For compatibility with the existing agent.run() calls in sample_run.py
 # we can create a wrapper or directly use agent_executor.invoke
 
 class AgentWrapper:
-    def __init__(self, executor):
-        self.executor = executor
-        self.chat_history = [] # Basic chat history management
+    def __init__(self, executor=None, prompt_overrides=None):
+        # None means the shared executor, built on first use (see get_agent_executor)
+        self._executor = executor
+        # {prompt_key: template} used by this wrapper's turns instead of the global prompts, and
+        # updated by UpdatePromptTool (see prompts.prompt_overrides). None shares the global prompts.
+        self.prompt_overrides = prompt_overrides
+        # Recent turns verbatim plus a rolling summary, within AGENT_MEMORY_TOKEN_BUDGET
+        self.memory = ConversationMemory()
+        self.last_result_ids = [] # result_ids of reviews stored during the last run()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = get_agent_executor()
+        return self._executor
 
     def run(self, input_str):
-        response = self.executor.invoke({
-            "input": input_str,
-            "chat_history": self.chat_history 
-        })
-        
+        with self._prompts():
+            response = self.executor.invoke({
+                "input": input_str,
+                "chat_history": self.memory.prompt_history()
+            }, config={"callbacks": tracing.callbacks()})
+        return self._finish_turn(input_str, response)
+
+    def _prompts(self):
+        # prompts imports langchain_core.prompts, which a cold import of this module does without
+        from .prompts import prompt_overrides
+        return prompt_overrides(self.prompt_overrides)
+
+    def stream(self, input_str):
+        """
+        Run a turn and yield its events as they happen (see agent_events.py): tokens
+        of the answer, tool start/finish, per-review completion, and finally
+        {"type": "final", "output": ..., "result_ids": [...]}.
+        """
+        events = queue.Queue()
+        outcome = {}
+
+        def _invoke():
+            try:
+                with self._prompts():
+                    outcome["response"] = self.executor.invoke(
+                        {"input": input_str, "chat_history": self.memory.prompt_history()},
+                        config={"callbacks": [AgentEventHandler(events.put)] + tracing.callbacks()},
+                    )
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                events.put(None)
+
+        threading.Thread(target=_invoke, name="agent-turn", daemon=True).start()
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield event
+        if "error" in outcome:
+            raise outcome["error"]
+        output = self._finish_turn(input_str, outcome["response"])
+        yield {"type": "final", "output": output, "result_ids": list(self.last_result_ids)}
+
+    async def astream(self, input_str):
+        """Async iterator over the same events as stream(); the turn runs on a worker thread."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        done = object()
+
+        def _pump():
+            try:
+                for event in self.stream(input_str):
+                    loop.call_soon_threadsafe(events.put_nowait, event)
+            except BaseException as e:
+                loop.call_soon_threadsafe(events.put_nowait, e)
+            loop.call_soon_threadsafe(events.put_nowait, done)
+
+        threading.Thread(target=_pump, name="agent-astream", daemon=True).start()
+        while True:
+            event = await events.get()
+            if event is done:
+                break
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+
+    def _finish_turn(self, input_str, response):
         # Extract the final output string more robustly
         final_output = response.get('output')
         if isinstance(final_output, list) and final_output:
@@ -104,8 +266,32 @@ class AgentWrapper:
             # General fallback if 'output' is not found or is of an unexpected type
             final_output_str = str(response) 
 
-        self.chat_history.append(("human", input_str))
-        self.chat_history.append(("ai", final_output_str))
+        # Only reviews run in this turn; FetchReviewResults returns a result_id too, of an earlier turn
+        self.last_result_ids = [
+            observation["result_id"]
+            for action, observation in response.get("intermediate_steps", [])
+            if action.tool == "BatchReviewControls" and isinstance(observation, dict) and "result_id" in observation
+        ]
+        self.last_result_ids = list(dict.fromkeys(self.last_result_ids))
+
+        self.memory.add_turn(input_str, final_output_str, self.last_result_ids)
         return final_output_str
 
-agent = AgentWrapper(agent_executor) 
\ No newline at end of file
+    @property
+    def chat_history(self):
+        """The (bounded) history sent with the next turn, as ("human"|"ai", text) pairs."""
+        return self.memory.messages()
+
+    def review_results(self, result_id=None, control_ids=None, review_types=None):
+        """
+        Full review texts straight from the result store, without going through the LLM:
+        {control_id: {review_type: text}} for result_id, or for every result set of the last run().
+        """
+        store = get_result_store()
+        results = {}
+        for rid in ([result_id] if result_id else self.last_result_ids):
+            for cid, reviews in store.get(rid, control_ids, review_types).items():
+                results.setdefault(cid, {}).update(reviews)
+        return results
+
+agent = AgentWrapper() 
\ No newline at end of file
@@ -0,0 +1,107 @@
+"""
+Incremental events for a streamed agent turn.
+
+AgentExecutor.invoke only returns once the whole turn is done, which for review
+requests means tens of seconds without output. AgentWrapper.stream() instead
+runs the turn with an AgentEventHandler attached and yields plain dicts as they
+happen:
+
+    {"type": "token", "text": ...}                       assistant text as the model writes it
+    {"type": "tool_start", "tool": ..., "input": ...}
+    {"type": "review", "control_id": ..., "review_type": ..., "ok": ..., "done": n, "total": N}
+    {"type": "tool_end", "tool": ..., "seconds": ..., "error": ...}
+    {"type": "final", "output": ..., "result_ids": [...]}
+
+Token events come from the agent's own LLM calls only; the review chains that
+run inside tools do not stream. Text the model writes before deciding to call
+a tool also arrives as tokens, followed by the tool_start event.
+
+Review events are dispatched by BatchReviewControls as each (control, review
+type) pair finishes, through LangChain's custom events, so they reach any
+callback handler attached to the run.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+REVIEW_EVENT = "review_finished"
+
+AgentEvent = Dict[str, Any]
+
+
+def review_progress(total: int) -> Callable[[str, str, str, Optional[BaseException]], None]:
+    """
+    An on_result callback for the review engine that dispatches a REVIEW_EVENT per
+    finished pair. Outside an agent run (campaigns, the command line) it does nothing.
+    """
+    lock = threading.Lock()
+    done = 0
+
+    def _report(cid: str, review_type: str, text: str, error: Optional[BaseException]) -> None:
+        nonlocal done
+        with lock:
+            done += 1
+            data = {"control_id": cid, "review_type": review_type, "ok": error is None, "done": done, "total": total}
+        # Imported here: the callback manager pulls in langsmith, which is only worth loading inside a run
+        from langchain_core.callbacks import dispatch_custom_event
+
+        try:
+            dispatch_custom_event(REVIEW_EVENT, data)
+        except RuntimeError:
+            # No parent run to attach the event to
+            pass
+
+    return _report
+
+
+def _token_text(token: Any, chunk: Any) -> str:
+    # Anthropic chunks carry a list of content blocks; tool-call argument deltas have no text
+    content = getattr(getattr(chunk, "message", None), "content", token)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(b.get("text", "") if isinstance(b, dict) and b.get("type") == "text" else b if isinstance(b, str) else ""
+                       for b in content)
+    return ""
+
+
+class AgentEventHandler(BaseCallbackHandler):
+    """Callback handler that turns a run's callbacks into AgentEvent dicts passed to emit."""
+
+    def __init__(self, emit: Callable[[AgentEvent], None]):
+        self.emit = emit
+        self._tools: Dict[UUID, tuple] = {}  # run_id -> (tool name, started_at)
+        self._lock = threading.Lock()
+
+    def on_llm_new_token(self, token: str, *, chunk: Any = None, run_id: UUID,
+                         parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        with self._lock:
+            inside_tool = bool(self._tools)
+        text = _token_text(token, chunk)
+        if text and not inside_tool:
+            self.emit({"type": "token", "text": text})
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        with self._lock:
+            self._tools[run_id] = (name, time.perf_counter())
+        self.emit({"type": "tool_start", "tool": name, "input": input_str})
+
+    def _tool_finished(self, run_id: UUID, error: Optional[BaseException]) -> None:
+        with self._lock:
+            name, started = self._tools.pop(run_id, ("tool", time.perf_counter()))
+        self.emit({"type": "tool_end", "tool": name, "seconds": round(time.perf_counter() - started, 3),
+                   "error": str(error) if error is not None else None})
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tool_finished(run_id, None)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._tool_finished(run_id, error)
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if name == REVIEW_EVENT:
+            self.emit({"type": "review", **data})
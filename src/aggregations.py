@@ -0,0 +1,186 @@
+"""
+Vectorized aggregation and segmentation over the control library.
+
+Backs the AggregateControls tool: counts, rating means and distributions,
+overdue tests and cross-tabs are computed with pandas groupby/crosstab on the
+typed frame, on the library or on a FilterControls selection, and returned as
+compact tables ({"columns": [...], "rows": [[...], ...]}) rather than records.
+
+Results are memoized per (selection, grouping, metrics) and dropped as soon
+as the library is reloaded.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .data_loader import current_library, match_positions
+from .query import FIELD_ALIASES
+
+AGGREGATE_MEMO_ENTRIES = int(os.environ.get("AGGREGATE_MEMO_ENTRIES", 128))
+DEFAULT_TOP = 50
+
+RATING_FIELDS = ("design_effectiveness_rating", "operational_effectiveness_rating")
+_RATING_LABELS = {"design_effectiveness_rating": "DE", "operational_effectiveness_rating": "OE"}
+OVERDUE_FIELD = "next_test_date"
+METRICS = ("count", "mean_ratings", "rating_distribution", "overdue")
+_DATE_PERIODS = {"month": "M", "quarter": "Q", "year": "Y"}
+
+_memo: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+class AggregationError(ValueError):
+    """Raised for unknown fields or metrics in an aggregation request."""
+
+
+def _resolve_field(df: pd.DataFrame, name: str) -> str:
+    if name in df.columns:
+        return name
+    column = FIELD_ALIASES.get(name.lower(), name.lower())
+    if column not in df.columns:
+        raise AggregationError(f"Unknown field '{name}'. Available fields: {', '.join(df.columns)}.")
+    return column
+
+
+def _group_key(df: pd.DataFrame, spec: str) -> pd.Series:
+    """Grouping series for a field name, or for 'date_field:month|quarter|year'."""
+    name, _, period = spec.partition(":")
+    column = _resolve_field(df, name)
+    series = df[column]
+    if not period:
+        return series
+    if period not in _DATE_PERIODS:
+        raise AggregationError(f"Unknown date period '{period}'. Use month, quarter or year.")
+    dates = series if pd.api.types.is_datetime64_any_dtype(series.dtype) else pd.to_datetime(series, errors="coerce")
+    return dates.dt.to_period(_DATE_PERIODS[period]).astype(str).where(dates.notna()).rename(f"{column}:{period}")
+
+
+def _overdue_flags(df: pd.DataFrame, as_of: pd.Timestamp) -> pd.Series:
+    if OVERDUE_FIELD not in df.columns:
+        raise AggregationError(f"'{OVERDUE_FIELD}' is not in the library; overdue counts are unavailable.")
+    dates = df[OVERDUE_FIELD]
+    if not pd.api.types.is_datetime64_any_dtype(dates.dtype):
+        dates = pd.to_datetime(dates, errors="coerce")
+    return (dates < as_of).rename("overdue")
+
+
+def _metric_table(df: pd.DataFrame, keys: List[pd.Series], metrics: List[str], as_of: pd.Timestamp) -> pd.DataFrame:
+    # A constant key aggregates the whole selection as a single "all" row
+    keys = keys or [pd.Series("all", index=df.index, name="group")]
+    grouped = df.groupby(keys, observed=True, dropna=False, sort=False)
+    parts = []
+    if "count" in metrics:
+        parts.append(grouped.size().rename("count"))
+    for field in RATING_FIELDS:
+        if field not in df.columns:
+            continue
+        label = _RATING_LABELS[field]
+        if "mean_ratings" in metrics:
+            parts.append(grouped[field].mean().round(2).rename(f"mean_{label}"))
+        if "rating_distribution" in metrics:
+            dist = pd.crosstab(keys, df[field], dropna=False)
+            dist.columns = [f"{label}={int(v) if isinstance(v, (int, float, np.number)) and v == v else v}" for v in dist.columns]
+            parts.append(dist)
+    if "overdue" in metrics:
+        flags = _overdue_flags(df, as_of)
+        overdue = flags.groupby(keys, observed=True, dropna=False, sort=False).sum().astype(int)
+        parts.append(overdue.rename("overdue"))
+        parts.append((overdue / grouped.size() * 100).round(1).rename("overdue_pct"))
+    table = pd.concat(parts, axis=1)
+    table.columns = [str(c) for c in table.columns]
+    if "count" in table.columns:
+        table = table.sort_values("count", ascending=False, kind="stable")
+    return table
+
+
+def _pivot_table(df: pd.DataFrame, keys: List[pd.Series], pivot: pd.Series, value: str,
+                 as_of: pd.Timestamp) -> pd.DataFrame:
+    if not keys:
+        raise AggregationError("'pivot' needs at least one 'group_by' field for the rows.")
+    if value == "count":
+        return pd.crosstab(keys, pivot, margins=True, margins_name="total")
+    if value == "overdue":
+        return pd.crosstab(keys, pivot, values=_overdue_flags(df, as_of), aggfunc="sum",
+                           margins=True, margins_name="total").fillna(0).astype(int)
+    field = _resolve_field(df, value)
+    if not pd.api.types.is_numeric_dtype(df[field].dtype):
+        raise AggregationError(f"'value' must be count, overdue or a numeric field; '{field}' is not numeric.")
+    return pd.crosstab(keys, pivot, values=df[field], aggfunc="mean").round(2)
+
+
+def _cell(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _compact(table: pd.DataFrame, top: int) -> Dict[str, Any]:
+    index_names = [str(n) if n is not None else "group" for n in table.index.names]
+    flat = table.reset_index()
+    flat.columns = index_names + [str(c) for c in table.columns]
+    rows = [[_cell(v) for v in row] for row in flat.astype(object).itertuples(index=False, name=None)]
+    result = {"columns": list(flat.columns), "rows": rows[:top], "total_rows": len(rows)}
+    if len(rows) > top:
+        result["truncated"] = True
+    return result
+
+
+def aggregate(selection: Optional[Dict[str, Any]] = None, group_by: Optional[List[str]] = None,
+              metrics: Optional[List[str]] = None, pivot: Optional[str] = None, value: str = "count",
+              as_of: Optional[str] = None, top: int = DEFAULT_TOP) -> Dict[str, Any]:
+    """
+    Aggregate the controls picked by selection (match_positions() keyword arguments:
+    control_ids, filters, query) grouped by the group_by fields.
+
+    Without pivot, each row carries the requested metrics (count, mean_ratings,
+    rating_distribution, overdue). With pivot, the result is a cross-tab of
+    group_by x pivot cells holding counts, overdue counts or the mean of a
+    numeric field (value). Overdue means next_test_date before as_of (default today).
+    """
+    selection = selection or {}
+    group_by = group_by or []
+    metrics = metrics or ["count"]
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise AggregationError(f"Unknown metric(s) {unknown}. Available: {', '.join(METRICS)}.")
+    as_of_ts = pd.Timestamp(as_of).normalize() if as_of else pd.Timestamp.today().normalize()
+
+    library = current_library()
+    key = (library.version, json.dumps([selection, group_by, sorted(metrics), pivot, value, str(as_of_ts), top],
+                                         sort_keys=True, default=str))
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+
+    df = library.df
+    positions = match_positions(**selection, library=library)
+    subset = df if len(positions) == len(df) else df.iloc[positions]
+    keys = [_group_key(subset, g) for g in group_by]
+    if pivot:
+        table = _pivot_table(subset, keys, _group_key(subset, pivot), value, as_of_ts)
+    else:
+        table = _metric_table(subset, keys, metrics, as_of_ts)
+    result = {"matched_controls": int(len(positions)), **_compact(table, top)}
+    if "overdue" in metrics or value == "overdue":
+        result["as_of"] = as_of_ts.strftime("%Y-%m-%d")
+
+    with _memo_lock:
+        # Entries for an older library can never be hit again
+        for stale in [k for k in _memo if k[0] != key[0]]:
+            del _memo[stale]
+        _memo[key] = result
+        while len(_memo) > AGGREGATE_MEMO_ENTRIES:
+            _memo.popitem(last=False)
+    return result
@@ -0,0 +1,70 @@
+"""
+The Anthropic client behind llm_clients.get_llm().
+
+Kept apart from llm_clients.py because anthropic and langchain_anthropic take
+over a second to import. get_llm() imports this module when it builds the
+first real client, so startup, the fake model and tools that never call the
+API do not pay for them.
+"""
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Dict, Optional
+
+import anthropic
+import httpx
+from langchain_anthropic import ChatAnthropic
+
+from .llm_clients import (ANTHROPIC_KEEPALIVE_SECONDS, ANTHROPIC_POOL_CONNECTIONS, ANTHROPIC_TIMEOUT, Throttle,
+                          _MeteredStream, estimate_request_tokens, get_throttle)
+
+
+class PooledChatAnthropic(ChatAnthropic):
+    """ChatAnthropic whose requests share the pooled HTTP client and go through the model's Throttle."""
+
+    @cached_property
+    def _client(self) -> anthropic.Client:
+        params = self._client_params
+        return anthropic.Client(**params, http_client=_http_client(params.get("base_url"), params.get("timeout")))
+
+    @cached_property
+    def _async_client(self) -> anthropic.AsyncClient:
+        params = self._client_params
+        return anthropic.AsyncClient(**params, http_client=_async_http_client(params.get("base_url"), params.get("timeout")))
+
+    def _on_result(self, throttle: Throttle, estimate: int, payload: Dict[str, Any]):
+        def _handle(result: Any, release: Callable[[], None]) -> Any:
+            if payload.get("stream"):
+                return _MeteredStream(result, throttle, estimate, release)
+            release()
+            usage = getattr(result, "usage", None)
+            throttle.record_usage(estimate, getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None))
+            return result
+        return _handle
+
+    def _create(self, payload: dict) -> Any:
+        throttle = get_throttle(self.model)
+        estimate = estimate_request_tokens(payload)
+        return throttle.call(lambda: super(PooledChatAnthropic, self)._create(payload), estimate,
+                             self._on_result(throttle, estimate, payload))
+
+    async def _acreate(self, payload: dict) -> Any:
+        throttle = get_throttle(self.model)
+        estimate = estimate_request_tokens(payload)
+        return await throttle.acall(lambda: super(PooledChatAnthropic, self)._acreate(payload), estimate,
+                                    self._on_result(throttle, estimate, payload))
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=ANTHROPIC_POOL_CONNECTIONS, max_keepalive_connections=ANTHROPIC_POOL_CONNECTIONS,
+                        keepalive_expiry=ANTHROPIC_KEEPALIVE_SECONDS)
+
+
+@lru_cache(maxsize=None)
+def _http_client(base_url: Optional[str], timeout: Any) -> httpx.Client:
+    return anthropic.DefaultHttpxClient(base_url=base_url or "https://api.anthropic.com",
+                                        timeout=timeout or ANTHROPIC_TIMEOUT, limits=_pool_limits())
+
+
+@lru_cache(maxsize=None)
+def _async_http_client(base_url: Optional[str], timeout: Any) -> httpx.AsyncClient:
+    return anthropic.DefaultAsyncHttpxClient(base_url=base_url or "https://api.anthropic.com",
+                                             timeout=timeout or ANTHROPIC_TIMEOUT, limits=_pool_limits())
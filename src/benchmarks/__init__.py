@@ -0,0 +1 @@
+# This file makes Python treat the 'benchmarks' directory as a sub-package of 'src'.
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+batch_review_bench.py: Compare sequential vs. concurrent BatchReviewControls
+against a stubbed LLM with a fixed per-call latency.
+
+Run from the project root:
+    python -m src.benchmarks.batch_review_bench [--controls 10] [--latency 0.5] [--concurrency 1 4 8]
+"""
+import argparse
+import json
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.llms import LLM
+
+from .. import tools
+
+
+class SleepyLLM(LLM):
+    """Stub LLM that waits a fixed time and echoes a canned review."""
+    latency: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "sleepy-stub"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        time.sleep(self.latency)
+        return f"Stub review ({len(prompt)} prompt chars)."
+
+
+def make_controls(n: int, run_tag: str) -> List[dict]:
+    # The tag makes every run's controls distinct so the review cache cannot serve them
+    return [{"control_id": f"BENCH{i:04d}", "description": f"Benchmark control {i} ({run_tag})."} for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--controls", type=int, default=10)
+    parser.add_argument("--review-types", nargs="+", default=["5W", "OE", "DE"])
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per stubbed LLM call")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    stub = SleepyLLM(latency=args.latency)
+    original_llms = {key: chain.llm for key, chain in tools.ANALYSIS_CHAINS.items()}
+    for chain in tools.ANALYSIS_CHAINS.values():
+        chain.llm = stub
+
+    payload = {"review_types": args.review_types}
+    pairs = args.controls * len(args.review_types)
+    print(f"{pairs} review pairs, {args.latency:.2f}s stubbed latency per call\n")
+    print(f"{'concurrency':>11}  {'wall (s)':>9}  {'speedup':>8}")
+
+    baseline = None
+    try:
+        for concurrency in args.concurrency:
+            payload["max_concurrency"] = concurrency
+            payload["controls"] = make_controls(args.controls, f"{time.time_ns()}-{concurrency}")
+            start = time.perf_counter()
+            result = tools.batch_review_func(json.dumps(payload))
+            elapsed = time.perf_counter() - start
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            baseline = baseline or elapsed
+            print(f"{concurrency:>11}  {elapsed:>9.2f}  {baseline / elapsed:>7.1f}x")
+    finally:
+        for key, chain in tools.ANALYSIS_CHAINS.items():
+            chain.llm = original_llms[key]
+
+
+if __name__ == "__main__":
+    main()
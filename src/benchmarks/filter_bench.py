@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+filter_bench.py: Full-scan str.contains vs. indexed substring filtering.
+
+Run from the project root:
+    python -m src.benchmarks.filter_bench [--sizes 18000 1000000] [--repeat 5]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ..data_loader import _filter_positions
+from ..search_index import IdIndex, SubstringIndex
+from .synthetic import synthetic_controls_df
+
+QUERIES = [
+    {"business_unit": "finance"},
+    {"risk_domain": "aml", "status": "active"},
+    {"control_id": "CTRL00123"},
+    {"description": "process 4242 in"},
+    {"description": "ensures"},
+    {"remediation_plan": "ctrl0000"},
+    {"purpose": "process 17."},
+    {"last_test_date": "2025-03"},
+]
+
+
+def full_scan(df, filters):
+    """The pre-index implementation: copy, then stringify and regex-scan each filtered column."""
+    filtered = df.copy()
+    for attr, val in filters.items():
+        filtered = filtered[filtered[attr].astype(str).str.contains(val, case=False, na=False)]
+    return filtered.index.to_numpy()
+
+
+def scan_ids(df, ids):
+    """The pre-index control_id lookup: copy, then stringify and isin over the whole column."""
+    filtered = df.copy()
+    return filtered[filtered["control_id"].astype(str).isin(ids)].index.to_numpy()
+
+
+def best_of(repeat, fn, *args):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[18_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        df = synthetic_controls_df(size)
+        start = time.perf_counter()
+        index = SubstringIndex(df)
+        build = time.perf_counter() - start
+        print(f"\n{size:,} rows: index built in {build:.2f}s")
+        print(f"  {'filter':<44} {'matches':>8} {'scan (ms)':>10} {'index (ms)':>11} {'speedup':>8}")
+        for filters in QUERIES:
+            scan_t, expected = best_of(args.repeat, full_scan, df, filters)
+            index_t, positions = best_of(args.repeat, _filter_positions, df, index, filters)
+            if not np.array_equal(df.index.to_numpy()[positions], expected):
+                raise AssertionError(f"Indexed result differs from full scan for {filters}")
+            print(f"  {str(filters):<44} {len(expected):>8} {scan_t * 1e3:>10.1f} {index_t * 1e3:>11.2f} {scan_t / index_t:>7.0f}x")
+
+        id_index = IdIndex(df["control_id"])
+        for ids in (["CTRL0000042"], [f"CTRL{i:07d}" for i in range(1, size, max(1, size // 10))]):
+            scan_t, expected = best_of(args.repeat, scan_ids, df, ids)
+            index_t, positions = best_of(args.repeat, id_index.lookup, ids)
+            if not np.array_equal(positions, expected):
+                raise AssertionError(f"ID index result differs from full scan for {ids}")
+            label = f"control_id lookup x{len(ids)}"
+            print(f"  {label:<44} {len(expected):>8} {scan_t * 1e3:>10.1f} {index_t * 1e3:>11.2f} {scan_t / index_t:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
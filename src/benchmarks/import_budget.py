@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+import_budget.py: Cold-start budget for importing the agent, checked in fresh interpreters.
+
+`import src.agent` should only define things. LangChain's agent classes,
+anthropic, langchain_anthropic, langsmith and pandas are loaded on the first
+turn or by agent.warmup(). The check fails (exit status 1) in two cases:
+  - the median import time over --repeat runs exceeds --budget seconds
+    (IMPORT_BUDGET_SECONDS, default 0.6);
+  - any of the DEFERRED modules is loaded by the import.
+It also reports how long warmup() takes with the fake model, which is what a
+first turn would otherwise pay.
+
+Run from the project root (e.g. in CI):
+    python -m src.benchmarks.import_budget [--budget 0.6] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# config.PROJECT_ROOT, without importing anything from the package into this process
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+IMPORT_BUDGET_SECONDS = float(os.environ.get("IMPORT_BUDGET_SECONDS", 0.6))
+
+# Modules that importing the agent must not load
+DEFERRED = ("pandas", "anthropic", "langchain_anthropic", "langchain.agents", "langchain.chains", "langsmith")
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import src.agent
+t1 = time.perf_counter()
+loaded = [m for m in {deferred!r} if m in sys.modules]
+timings = src.agent.warmup() if {warmup!r} else {{}}
+print(json.dumps({{"import": t1 - t0, "loaded": loaded, "warmup": timings}}))
+"""
+
+
+def probe(warmup: bool = False, env=None) -> dict:
+    """Import (and optionally warm up) the agent in a fresh interpreter, offline with the fake model."""
+    with tempfile.TemporaryDirectory(prefix="import-budget-") as cache_dir:
+        env = dict(env or os.environ, ANTHROPIC_MODEL_NAME="fake", CONTROL_CACHE_DIR=cache_dir, TRACE_ENABLED="0")
+        code = _PROBE.format(deferred=DEFERRED, warmup=warmup)
+        out = subprocess.run([sys.executable, "-c", code], cwd=_PROJECT_ROOT, env=env,
+                             capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_SECONDS, help="Seconds allowed for `import src.agent`")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [probe() for _ in range(args.repeat)]
+    times = [r["import"] for r in runs]
+    median = statistics.median(times)
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    warm = probe(warmup=True)["warmup"]
+
+    print(f"import src.agent   median {median:.3f}s  min {min(times):.3f}s  max {max(times):.3f}s  (budget {args.budget:.3f}s)")
+    print(f"warmup()           " + "  ".join(f"{step} {seconds:.3f}s" for step, seconds in warm.items()))
+    failures = []
+    if median > args.budget:
+        failures.append(f"import took {median:.3f}s, over the {args.budget:.3f}s budget")
+    if loaded:
+        failures.append(f"import loaded deferred modules: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        print("Run `python -X importtime -c 'import src.agent'` to see what is imported.")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+loader_bench.py: Peak memory and time of json.load vs. the streaming loader.
+
+Each loader runs in a fresh interpreter; peak memory is the process's maximum
+resident set size after loading, minus the size right after the imports.
+
+Run from the project root:
+    python -m src.benchmarks.loader_bench [--sizes 200000 1000000] [--chunk-rows 50000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from ..config import PROJECT_ROOT
+from .synthetic import synthetic_controls
+
+_PROBE = """
+import json, resource, sys, time
+import pandas as pd
+from src.schema import apply_schema
+from src.streaming import load_controls_chunked
+path, mode, chunk_rows = sys.argv[1], sys.argv[2], int(sys.argv[3])
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+if mode == "json":
+    with open(path) as f:
+        df = apply_schema(pd.DataFrame(json.load(f)))
+else:
+    df = load_controls_chunked(path, chunk_rows)
+seconds = time.perf_counter() - t0
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": seconds, "peak_mb": (peak - base) / 1024, "frame_mb": df.memory_usage(deep=True).sum() / 1e6}))
+"""
+
+
+def probe(path: str, mode: str, chunk_rows: int) -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE, path, mode, str(chunk_rows)], cwd=PROJECT_ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200_000, 1_000_000])
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}  {'loader':<9} {'file (MB)':>9} {'time (s)':>9} {'peak (MB)':>10} {'frame (MB)':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            source = os.path.join(tmp, f"controls_{size}.json")
+            with open(source, "w") as f:
+                json.dump(synthetic_controls(size), f)
+            file_mb = os.path.getsize(source) / 1e6
+            results = {mode: probe(source, mode, args.chunk_rows) for mode in ("json", "streaming")}
+            for mode, r in results.items():
+                print(f"{size:>9,}  {mode:<9} {file_mb:>9,.1f} {r['seconds']:>9.2f} {r['peak_mb']:>10,.1f} {r['frame_mb']:>11,.1f}")
+            print(f"{'':>9}  peak memory reduction: {results['json']['peak_mb'] / results['streaming']['peak_mb']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
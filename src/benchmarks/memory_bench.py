@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+memory_bench.py: Memory footprint and filter speed of the untyped vs. typed control library.
+
+Run from the project root:
+    python -m src.benchmarks.memory_bench [--sizes 18000 1000000] [--repeat 5]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from ..data_loader import _filter_positions
+from ..schema import apply_schema, native_values
+from ..search_index import SubstringIndex
+from .synthetic import synthetic_controls_df
+
+QUERIES = [
+    {"business_unit": "finance"},
+    {"risk_domain": "aml", "status": "active"},
+    {"criticality": "high", "frequency": "monthly"},
+    {"last_test_date": "2025-03"},
+    {"design_effectiveness_rating": "4"},
+]
+
+
+def _mb(df) -> float:
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def _best(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[18_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        raw = synthetic_controls_df(size)
+        start = time.perf_counter()
+        typed = apply_schema(raw)
+        convert_s = time.perf_counter() - start
+        print(f"\n{size:,} controls: {_mb(raw):,.1f} MB untyped -> {_mb(typed):,.1f} MB typed "
+              f"({_mb(raw) / _mb(typed):.1f}x smaller, converted in {convert_s:.2f}s)")
+        for col in raw.columns:
+            before = raw[col].memory_usage(deep=True, index=False) / 1e6
+            after = typed[col].memory_usage(deep=True, index=False) / 1e6
+            print(f"  {col:<34} {str(typed[col].dtype)[:16]:<17} {before:>9,.1f} MB -> {after:>9,.1f} MB")
+
+        raw_index, typed_index = SubstringIndex(raw), SubstringIndex(typed)
+        print(f"  {'query':<50} {'untyped':>10} {'typed':>10}")
+        for filters in QUERIES:
+            raw_s, expected = _best(lambda: _filter_positions(raw, raw_index, filters), args.repeat)
+            typed_s, got = _best(lambda: _filter_positions(typed, typed_index, filters), args.repeat)
+            assert np.array_equal(expected, got), f"typed result differs for {filters}"
+            print(f"  {str(filters):<50} {raw_s * 1e3:>8.2f}ms {typed_s * 1e3:>8.2f}ms")
+
+        # Decoded records must be indistinguishable from the untyped ones
+        sample = np.arange(0, size, max(1, size // 1000))
+        for col in raw.columns:
+            assert native_values(typed[col], sample) == raw[col].to_numpy()[sample].tolist(), col
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+prompt_tokens_bench.py: Estimated input tokens per review with the repr() vs. the compact control layout.
+
+Renders every control of the library into the live 5W, OE and DE prompt
+templates both ways and reports tokens per review (serialization.count_tokens)
+and the reduction per review type and overall, then the calls and tokens per
+control when all three reviews are fused into one call per 1-3 controls.
+
+Run from the project root:
+    python -m src.benchmarks.prompt_tokens_bench [--limit 1000]
+"""
+import argparse
+
+import numpy as np
+
+from .. import fused_review, prompts, serialization
+from ..data_loader import filter_controls
+
+REVIEW_TYPES = ("5W", "OE", "DE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N controls")
+    args = parser.parse_args()
+
+    controls = filter_controls()[:args.limit]
+    print(f"{len(controls):,} controls")
+    print(f"  {'review':<7} {'repr() tokens':>14} {'compact tokens':>15} {'reduction':>10}")
+    totals = np.zeros(2)
+    for review_type in REVIEW_TYPES:
+        template = prompts.get_prompt(review_type).template
+        counts = np.array([
+            [serialization.count_tokens(template.replace("{control}", serialization.serialize_control(c, review_type, fmt)))
+             for fmt in ("raw", "compact")]
+            for c in controls
+        ])
+        raw, compact = counts.mean(axis=0)
+        totals += counts.sum(axis=0)
+        print(f"  {review_type:<7} {raw:>14.1f} {compact:>15.1f} {1 - compact / raw:>9.1%}")
+    print(f"  {'all':<7} {totals[0]:>14,.0f} {totals[1]:>15,.0f} {1 - totals[1] / totals[0]:>9.1%}")
+
+    # Fused calls: every review type of a group of controls in one prompt
+    templates = {rt: prompts.get_prompt(rt).template for rt in REVIEW_TYPES}
+    fused_template = prompts.get_prompt("FUSED")
+    print(f"\n  {'mode':<24} {'calls/control':>13} {'tokens/control':>15} {'vs repr()':>10}")
+    print(f"  {'separate, compact':<24} {len(REVIEW_TYPES):>13.2f} {totals[1] / len(controls):>15.1f} {1 - totals[1] / totals[0]:>9.1%}")
+    for group_size in (1, 2, 3):
+        tokens = 0
+        for start in range(0, len(controls), group_size):
+            items = [(str(c.get("control_id")), c, list(REVIEW_TYPES)) for c in controls[start:start + group_size]]
+            inputs = fused_review.fused_prompt_inputs(items, templates, serialization.serialize_control)
+            tokens += serialization.count_tokens(fused_template.format(**inputs))
+        label = f"fused, {group_size} control{'s' if group_size > 1 else ''}/call"
+        print(f"  {label:<24} {1 / group_size:>13.2f} {tokens / len(controls):>15.1f} {1 - tokens / totals[0]:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+service_bench.py: Many concurrent sessions against the HTTP service (src/service.py), offline.
+
+Starts the service in-process on a free port with the fake chat model (see
+suite.py), then plays --sessions reviewers at once over HTTP. Each reviewer
+creates a session and runs --turns scripted turns one after another. The
+bench reports turn latency and throughput, and checks that:
+  - every session's history holds only its own turns;
+  - a prompt override stays in the session that set it;
+  - a second simultaneous turn on one session is refused with 429;
+  - evicted sessions come back from the session store intact.
+
+Run from the project root:
+    python -m src.benchmarks.service_bench [--sessions 24] [--turns 3] [--store memory|sqlite]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from .suite import _offline_env, _percentiles
+
+
+async def _reviewer(client, base, index, turns, latencies):
+    response = await client.post(f"{base}/sessions")
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    for turn in range(turns):
+        start = time.perf_counter()
+        response = await client.post(f"{base}/sessions/{session_id}/turns",
+                                     json={"input": f"[reviewer {index} turn {turn}] Review three Finance controls"})
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return session_id
+
+
+async def _bench(sessions, turns, store_kind, metrics, details):
+    import httpx
+
+    from ..agent import get_agent_executor
+    from ..prompts import PROMPT_TEMPLATES
+    from ..service import AgentService
+    from ..sessions import SessionManager, make_session_store
+
+    get_agent_executor().verbose = False
+    manager = SessionManager(make_session_store(store_kind), max_sessions=max(sessions, 1))
+    service = AgentService(manager)
+    server = await service.start("127.0.0.1", 0)
+    base = f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    checks = {}
+    try:
+        async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=sessions + 4)) as client:
+            # One turn alone, for reference
+            solo = []
+            await _reviewer(client, base, -1, 1, solo)
+
+            latencies = []
+            start = time.perf_counter()
+            ids = await asyncio.gather(*(_reviewer(client, base, i, turns, latencies) for i in range(sessions)))
+            wall = time.perf_counter() - start
+
+            # Isolation: each history mentions its own reviewer only
+            leaks = 0
+            for i, sid in enumerate(ids):
+                history = " ".join(text for _, text in (await manager.get(sid)).agent.chat_history)
+                leaks += sum(f"[reviewer {j} " in history for j in range(sessions) if j != i)
+                leaks += f"[reviewer {i} " not in history
+            checks["history_isolated"] = leaks == 0
+
+            global_5w = PROMPT_TEMPLATES["5W"].template
+            response = await client.put(f"{base}/sessions/{ids[0]}/prompts/5W", json={"template": "Session-only {control}"})
+            other = (await client.get(f"{base}/sessions/{ids[-1]}")).json()
+            checks["prompt_override_isolated"] = (response.status_code == 200 and "5W" in response.json()["prompt_overrides"]
+                                                  and other["prompt_overrides"] == []
+                                                  and PROMPT_TEMPLATES["5W"].template == global_5w)
+
+            busy = await asyncio.gather(*(client.post(f"{base}/sessions/{ids[0]}/turns", json={"input": "in parallel"})
+                                          for _ in range(2)))
+            checks["busy_session_429"] = sorted(r.status_code for r in busy) == [200, 429]
+
+            manager.idle_seconds = 0
+            evicted = manager.evict_idle()
+            restored = [(await client.get(f"{base}/sessions/{sid}")).json() for sid in ids[1:]]
+            checks["restored_after_eviction"] = evicted >= sessions and all(r["turns"] == turns for r in restored)
+            stats = (await client.get(f"{base}/stats")).json()
+    finally:
+        await service.stop()
+
+    p50, p95 = _percentiles(latencies)
+    count = sessions * turns
+    metrics[f"service.s{sessions}.turn_p50_s"] = round(p50, 3)
+    metrics[f"service.s{sessions}.turn_p95_s"] = round(p95, 3)
+    metrics[f"service.s{sessions}.turns_per_s"] = round(count / wall, 2)
+    metrics["service.solo_turn_s"] = round(solo[0], 3)
+    details["service"] = {"sessions": sessions, "turns": turns, "store": store_kind, "wall_s": round(wall, 3),
+                          "checks": checks, "stats": stats}
+    print(f"  service   {sessions} sessions x {turns} turns  {wall:6.2f}s  {count / wall:6.2f} turns/s  "
+          f"turn p50 {p50:.2f}s p95 {p95:.2f}s (alone {solo[0]:.2f}s)")
+    print("            checks: " + "  ".join(f"{name} {'ok' if ok else 'FAILED'}" for name, ok in checks.items()))
+    return checks
+
+
+def bench_service(sessions, turns, store_kind, metrics, details):
+    return asyncio.run(_bench(sessions, turns, store_kind, metrics, details))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=24)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--store", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--latency", default="lognormal:0.1,0.25", help="Fake LLM latency (see fake_llm.py)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        _offline_env(cache_dir, args.latency, 0)
+        os.environ.setdefault("TRACE_ENABLED", "0")
+        checks = bench_service(args.sessions, args.turns, args.store, {}, {})
+    if not all(checks.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+similarity_bench.py: Build time, size and query latency of the SimilarControls index.
+
+Run from the project root:
+    python -m src.benchmarks.similarity_bench [--sizes 18000 1000000] [--queries 50]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from .. import similarity
+from ..schema import apply_schema
+from .synthetic import synthetic_controls_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[18_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        df = apply_schema(synthetic_controls_df(size))
+        start = time.perf_counter()
+        index = similarity.SimilarityIndex.build(df)
+        build_s = time.perf_counter() - start
+        size_mb = sum(getattr(index, name).nbytes for name in similarity.SimilarityIndex._ARRAYS) / 1e6
+        print(f"\n{size:,} controls: built in {build_s:.2f}s, {size_mb:,.1f} MB on disk")
+
+        rng = np.random.default_rng(0)
+        rows = rng.integers(0, size, args.queries)
+        texts = similarity._library_text(df.iloc[rows]).tolist()
+        timings = []
+        for row, text in zip(rows, texts):
+            start = time.perf_counter()
+            scores = index.scores(*index.vectorize(text))
+            top = np.argpartition(-scores, args.k)[:args.k]
+            timings.append(time.perf_counter() - start)
+            # Ties are possible when hashed features collide, so compare scores rather than positions
+            assert scores[row] >= scores.max() - 1e-6, "a control should be most similar to itself"
+        timings = np.array(timings) * 1e3
+        print(f"  top-{args.k} query: p50 {np.percentile(timings, 50):.2f}ms, p95 {np.percentile(timings, 95):.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+startup_bench.py: Cold-start cost of loading the control library from JSON vs. the columnar snapshot.
+
+Each measurement runs in a fresh interpreter so that nothing is shared between runs.
+
+Run from the project root:
+    python -m src.benchmarks.startup_bench [--sizes 18000 200000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from ..config import PROJECT_ROOT
+from .synthetic import synthetic_controls
+
+_PROBE = """
+import json, time
+t0 = time.perf_counter()
+from src import data_loader
+t1 = time.perf_counter()
+df = data_loader.get_controls_df()
+t2 = time.perf_counter()
+data_loader.filter_controls(control_ids=["CTRL0000001"])
+t3 = time.perf_counter()
+print(json.dumps({"import": t1 - t0, "load": t2 - t1, "first_filter": t3 - t2, "rows": len(df)}))
+"""
+
+
+def probe(env) -> dict:
+    out = subprocess.run([sys.executable, "-c", _PROBE], cwd=PROJECT_ROOT, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[18_000, 200_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>9}  {'mode':<9} {'import (s)':>10} {'load (s)':>9} {'first filter (s)':>17}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            source = os.path.join(tmp, f"controls_{size}.json")
+            with open(source, "w") as f:
+                json.dump(synthetic_controls(size), f, indent=2)
+            env = dict(os.environ, CONTROLS_PATH=source, CONTROL_CACHE_DIR=os.path.join(tmp, "cache"))
+
+            results = {
+                "json": probe(dict(env, CONTROLS_SNAPSHOT="0")),
+                "build": probe(dict(env, CONTROLS_SNAPSHOT="1")),  # first run parses JSON and writes the snapshot
+                "snapshot": probe(dict(env, CONTROLS_SNAPSHOT="1")),
+            }
+            for mode, r in results.items():
+                print(f"{size:>9,}  {mode:<9} {r['import']:>10.3f} {r['load']:>9.3f} {r['first_filter']:>17.4f}")
+            print(f"{'':>9}  load speedup (json / snapshot): {results['json']['load'] / results['snapshot']['load']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+suite.py: Offline end-to-end performance suite with JSON reports that compare across commits.
+
+Runs against the fake chat model (src/fake_llm.py), with the review cache off,
+rate limits off and every cache file in a temporary directory, so no API key or
+network is needed and runs are repeatable. Sections:
+
+    filter   match_positions latency per query (p50/p95) on synthetic libraries of several sizes
+    reviews  BatchReviewControls wall time and reviews/s per concurrency, per-pair and fused
+    agent    AgentWrapper turn latency and time to first event/token for a scripted
+             FilterControls -> BatchReviewControls -> answer turn, and a turn with four
+             tool calls in one step, run together and one by one
+    startup  `import src.agent` and agent.warmup() time in fresh interpreters (see import_budget.py)
+    service  turn latency and turns/s with many concurrent sessions over HTTP (see service_bench.py)
+    memory   peak RSS after each section and the size of each library frame
+
+The report holds a flat "metrics" map (for comparing) next to the run's settings,
+commit and platform. --compare prints the change of every metric against an
+earlier report.
+
+Run from the project root:
+    python -m src.benchmarks.suite [--sizes 18000 200000] [--out report.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SUITE_VERSION = 1
+# config.PROJECT_ROOT, without importing config before the environment is set up
+_PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+# Steps the fake model plays in every benchmarked agent turn
+AGENT_SCRIPT = [
+    {"tool": "FilterControls", "input": json.dumps({"business_unit": "Finance", "limit": 3})},
+    {"tool": "BatchReviewControls", "input": json.dumps({
+        "controls": [{"control_id": f"AGENT{i}", "description": f"Agent benchmark control {i}."} for i in range(3)],
+        "review_types": ["5W", "OE", "DE"]})},
+    {"text": "Reviewed three Finance controls; the full reviews are attached to the result id above."},
+]
+
+# One step with several independent calls, for the multi-tool turn of the agent section
+MULTI_TOOL_SCRIPT = [
+    {"tools": [{"tool": "FilterControls", "input": json.dumps({"business_unit": "Finance", "limit": 3})},
+               {"tool": "AggregateControls", "input": json.dumps({"group_by": "risk_domain"})},
+               {"tool": "ExplainMethods", "input": "5W"},
+               {"tool": "ExplainMethods", "input": "OE"}]},
+    {"text": "Here are the Finance controls, the risk domain breakdown and how 5W and OE reviews work."},
+]
+
+
+def _offline_env(cache_dir: str, latency: str, seed: int) -> None:
+    # Read by the modules below at import time, so this must run before they are imported
+    os.environ.update({
+        "ANTHROPIC_MODEL_NAME": "fake",
+        "CONTROL_CACHE_DIR": cache_dir,
+        "REVIEW_CACHE_ENABLED": "0",
+        "FAKE_LLM_SCRIPT": json.dumps(AGENT_SCRIPT),
+    })
+    for key, value in (("ANTHROPIC_RPM", "0"), ("ANTHROPIC_TPM", "0"),
+                       ("FAKE_LLM_LATENCY", latency), ("FAKE_LLM_SEED", str(seed))):
+        os.environ.setdefault(key, value)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentiles(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return statistics.median(ordered), p95
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def bench_filter(sizes, repeat, metrics, details):
+    from ..data_loader import Library, match_positions
+    from ..schema import apply_schema
+    from ..search_index import SubstringIndex
+    from .filter_bench import QUERIES
+    from .synthetic import synthetic_controls_df
+
+    for size in sizes:
+        df = apply_schema(synthetic_controls_df(size))
+        start = time.perf_counter()
+        library = Library(df, SubstringIndex(df), version=1)
+        build = time.perf_counter() - start
+        per_query, all_samples = {}, []
+        for filters in QUERIES:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                positions = match_positions(filters=filters, library=library)
+                samples.append((time.perf_counter() - start) * 1e3)
+            p50, p95 = _percentiles(samples)
+            per_query[json.dumps(filters)] = {"matches": int(len(positions)), "p50_ms": round(p50, 3), "p95_ms": round(p95, 3)}
+            all_samples += samples
+        p50, p95 = _percentiles(all_samples)
+        metrics[f"filter.{size}.index_build_s"] = round(build, 3)
+        metrics[f"filter.{size}.p50_ms"] = round(p50, 3)
+        metrics[f"filter.{size}.p95_ms"] = round(p95, 3)
+        metrics[f"memory.frame_mb.{size}"] = round(df.memory_usage(deep=True).sum() / 1e6, 1)
+        details.setdefault("filter", {})[str(size)] = per_query
+        print(f"  filter    {size:>9,} rows  index {build:6.2f}s  p50 {p50:8.3f} ms  p95 {p95:8.3f} ms")
+        del library, df
+
+
+def bench_reviews(controls, review_types, concurrencies, metrics, details):
+    from .. import tools
+
+    fake = tools.llm
+    for fused in (False, True):
+        mode = "fused" if fused else "pairs"
+        for concurrency in concurrencies:
+            batch = [{"control_id": f"BENCH{i:04d}", "description": f"Benchmark control {i} ({mode}, {concurrency})."}
+                     for i in range(controls)]
+            calls = fake.calls
+            start = time.perf_counter()
+            result = tools.batch_review_func(json.dumps({"controls": batch, "review_types": review_types,
+                                                         "max_concurrency": concurrency, "fused": fused}))
+            wall = time.perf_counter() - start
+            if "error" in result:
+                raise RuntimeError(result["error"])
+            pairs = controls * len(review_types)
+            key = f"reviews.{mode}.c{concurrency}"
+            metrics[f"{key}.wall_s"] = round(wall, 3)
+            metrics[f"{key}.reviews_per_s"] = round(pairs / wall, 2)
+            metrics[f"{key}.llm_calls"] = fake.calls - calls
+            print(f"  reviews   {mode:<6} concurrency {concurrency:>3}  {wall:6.2f}s  {pairs / wall:7.2f} reviews/s  "
+                  f"{fake.calls - calls:>3} calls")
+    details["reviews"] = {"controls": controls, "review_types": review_types}
+
+
+def bench_agent(turns, metrics, details):
+    from .. import agent as agent_module
+
+    agent_module.agent_executor.verbose = False
+    wrapper = agent_module.AgentWrapper(agent_module.agent_executor)
+    totals, first_events, first_tokens = [], [], []
+    for turn in range(turns):
+        start = time.perf_counter()
+        first_event = first_token = None
+        for event in wrapper.stream(f"Review three Finance controls (turn {turn})"):
+            now = time.perf_counter() - start
+            first_event = first_event if first_event is not None else now
+            if event["type"] == "token" and first_token is None:
+                first_token = now
+        totals.append(time.perf_counter() - start)
+        first_events.append(first_event)
+        first_tokens.append(first_token if first_token is not None else totals[-1])
+    for name, samples in (("turn", totals), ("first_event", first_events), ("first_token", first_tokens)):
+        p50, p95 = _percentiles(samples)
+        metrics[f"agent.{name}_p50_s"] = round(p50, 3)
+        metrics[f"agent.{name}_p95_s"] = round(p95, 3)
+    memory = wrapper.memory.stats()
+    metrics["agent.history_tokens"] = memory["history_tokens_now"]
+    details["agent"] = {"turns": turns, "script": [step.get("tool", "text") for step in AGENT_SCRIPT], "memory": memory}
+    print(f"  agent     {turns} turns  turn p50 {statistics.median(totals):.2f}s  "
+          f"first event p50 {statistics.median(first_events):.3f}s  first token p50 {statistics.median(first_tokens):.2f}s")
+
+    # A turn whose one step calls four tools, with the calls run together and one by one
+    llm, script = agent_module.llm, agent_module.llm.script
+    concurrency = agent_module.AGENT_TOOL_CONCURRENCY
+    llm.script = MULTI_TOOL_SCRIPT
+    try:
+        for label, limit in (("parallel", max(concurrency, 2)), ("sequential", 1)):
+            agent_module.AGENT_TOOL_CONCURRENCY = limit
+            samples = []
+            for turn in range(turns):
+                start = time.perf_counter()
+                agent_module.AgentWrapper(agent_module.agent_executor).run(f"Finance overview (turn {turn})")
+                samples.append(time.perf_counter() - start)
+            metrics[f"agent.multi_tool_turn_{label}_p50_s"] = round(statistics.median(samples), 3)
+    finally:
+        llm.script, agent_module.AGENT_TOOL_CONCURRENCY = script, concurrency
+    print(f"  agent     4 tool calls in one step  turn p50 {metrics['agent.multi_tool_turn_parallel_p50_s']:.2f}s "
+          f"(one by one {metrics['agent.multi_tool_turn_sequential_p50_s']:.2f}s)")
+
+
+def bench_startup(repeat, metrics, details):
+    from .import_budget import probe
+
+    runs = [probe() for _ in range(repeat)]
+    warm = probe(warmup=True)["warmup"]
+    imports = [r["import"] for r in runs]
+    metrics["startup.import_agent_s"] = round(statistics.median(imports), 3)
+    metrics["startup.warmup_s"] = round(sum(warm.values()), 3)
+    details["startup"] = {"imports_s": [round(t, 3) for t in imports], "warmup_s": warm,
+                          "deferred_loaded": sorted({m for r in runs for m in r["loaded"]})}
+    print(f"  startup   import src.agent p50 {statistics.median(imports):.3f}s  warmup {sum(warm.values()):.2f}s "
+          f"({', '.join(f'{k} {v:.2f}s' for k, v in warm.items())})")
+
+
+def bench_service(sessions, metrics, details):
+    from .service_bench import bench_service as run_service_bench
+
+    run_service_bench(sessions, 3, "memory", metrics, details)
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old, new = baseline.get("metrics", {}), report["metrics"]
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    print(f"  {'metric':<40} {'before':>12} {'after':>12} {'change':>8}")
+    for name in sorted(set(old) & set(new)):
+        a, b = old[name], new[name]
+        change = f"{(b - a) / a:+.1%}" if a else ""
+        print(f"  {name:<40} {a:>12} {b:>12} {change:>8}")
+    unmatched = len(set(old) ^ set(new))
+    if unmatched:
+        print(f"  ({unmatched} metrics appear in only one of the reports)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sections", nargs="+", default=["filter", "reviews", "agent", "startup", "service"],
+                        choices=["filter", "reviews", "agent", "startup", "service"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[18_000, 200_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--controls", type=int, default=10)
+    parser.add_argument("--review-types", nargs="+", default=["5W", "OE", "DE"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--sessions", type=int, default=24, help="Concurrent sessions for the service section")
+    parser.add_argument("--latency", default="lognormal:0.1,0.25", help="Fake LLM latency (see fake_llm.py)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Report path (default .cache/benchmarks/suite-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier report to compare against")
+    args = parser.parse_args()
+
+    commit, dirty = _git_commit()
+    # Resolved before CONTROL_CACHE_DIR is pointed at the throwaway directory
+    out = args.out or os.path.join(os.environ.get("CONTROL_CACHE_DIR") or os.path.join(_PROJECT_ROOT, ".cache"), "benchmarks",
+                                   f"suite-{commit or 'unknown'}{'-dirty' if dirty else ''}.json")
+    with tempfile.TemporaryDirectory(prefix="bench-cache-") as cache_dir:
+        _offline_env(cache_dir, args.latency, args.seed)
+        metrics, details = {}, {}
+        sections = {
+            "filter": lambda: bench_filter(args.sizes, args.repeat, metrics, details),
+            "reviews": lambda: bench_reviews(args.controls, args.review_types, args.concurrency, metrics, details),
+            "agent": lambda: bench_agent(args.turns, metrics, details),
+            "startup": lambda: bench_startup(args.repeat, metrics, details),
+            "service": lambda: bench_service(args.sessions, metrics, details),
+        }
+        started = time.perf_counter()
+        for name in args.sections:
+            sections[name]()
+            metrics[f"memory.peak_rss_mb.after_{name}"] = round(_peak_rss_mb(), 1)
+        from ..llm_clients import llm_stats
+        details["llm"] = llm_stats()
+
+    report = {
+        "suite_version": SUITE_VERSION,
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "duration_s": round(time.perf_counter() - started, 2),
+        "metrics": metrics,
+        "details": details,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {out}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Synthetic control libraries for benchmarks.
+
+Records are generated from the distinct attribute values found in controls.json
+so that filters behave realistically, with unique IDs and free-text fields that
+vary per row.
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from ..config import PROJECT_ROOT
+
+_TEXT_TEMPLATES = {
+    "control_name": "Control {n}",
+    "description": "Description for {cid}: ensures proper execution of process {n} in {bu}.",
+    "remediation_plan": "Follow up on issues identified in last test for {cid}.",
+    "purpose": "Ensure compliance and risk mitigation for process {n}.",
+}
+
+
+def load_seed_records(path: str = os.path.join(PROJECT_ROOT, "controls.json")) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def synthetic_controls_df(num_rows: int, seed: int = 7) -> pd.DataFrame:
+    """A DataFrame with the same columns as controls.json and num_rows rows."""
+    seed_df = pd.DataFrame(load_seed_records())
+    rng = np.random.default_rng(seed)
+    ids = np.char.add("CTRL", np.char.zfill(np.arange(1, num_rows + 1).astype(str), 7))
+    columns = {"control_id": ids}
+    for col in seed_df.columns:
+        if col == "control_id" or col in _TEXT_TEMPLATES:
+            continue
+        values = seed_df[col].unique()
+        columns[col] = values[rng.integers(0, len(values), size=num_rows)]
+    df = pd.DataFrame(columns)
+    n = np.arange(1, num_rows + 1).astype(str)
+    bu = df["business_unit"].astype(str).to_numpy()
+    for col, template in _TEXT_TEMPLATES.items():
+        if col in seed_df.columns:
+            df[col] = [template.format(n=k, cid=c, bu=b) for k, c, b in zip(n, ids, bu)]
+    return df[list(seed_df.columns)]
+
+
+def synthetic_controls(num_rows: int, seed: int = 7) -> List[Dict[str, Any]]:
+    return synthetic_controls_df(num_rows, seed).to_dict(orient="records")
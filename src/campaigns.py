@@ -0,0 +1,399 @@
+"""
+Library-wide review campaigns.
+
+BatchReviewControls is capped at 10 controls because its output goes straight
+back into the chat. A campaign instead resolves a FilterControls selection,
+reviews every (control, review type) pair in the background, and appends each
+result to a SQLite store as soon as it finishes. Completed pairs double as the
+checkpoint: restarting a campaign that crashed or was killed only runs the pairs
+that have no stored result yet.
+
+Run from the project root:
+    python -m src.campaigns start --filters '{"business_unit": "Finance"}' --review-types 5W OE
+    python -m src.campaigns resume <campaign_id>
+    python -m src.campaigns status [<campaign_id>]
+    python -m src.campaigns export <campaign_id> results.jsonl
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .config import cache_path
+from .data_loader import filter_controls
+from .review_engine import DEFAULT_MAX_CONCURRENCY, ReviewFunc, run_review_jobs
+
+CAMPAIGN_DB_PATH = os.environ.get("CAMPAIGN_DB_PATH") or cache_path("campaigns.sqlite")
+# Number of controls handed to the review engine at a time; progress is durable per pair
+CAMPAIGN_CHUNK_SIZE = int(os.environ.get("CAMPAIGN_CHUNK_SIZE", 25))
+
+
+class CampaignStore:
+    """Append-only SQLite store for campaign definitions and per-pair review results."""
+
+    def __init__(self, path: str = CAMPAIGN_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS campaigns (
+                campaign_id TEXT PRIMARY KEY,
+                selection TEXT NOT NULL,
+                review_types TEXT NOT NULL,
+                total_pairs INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                status TEXT NOT NULL,
+                finished_at REAL,
+                error TEXT
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                campaign_id TEXT NOT NULL,
+                control_id TEXT NOT NULL,
+                review_type TEXT NOT NULL,
+                text TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (campaign_id, control_id, review_type)
+            );
+            CREATE TABLE IF NOT EXISTS failures (
+                campaign_id TEXT NOT NULL,
+                control_id TEXT NOT NULL,
+                review_type TEXT NOT NULL,
+                error TEXT NOT NULL,
+                failed_at REAL NOT NULL
+            );
+            """
+        )
+
+    def create(self, campaign_id: str, selection: Dict[str, Any], review_types: List[str], total_pairs: int) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO campaigns (campaign_id, selection, review_types, total_pairs, created_at, status)"
+                " VALUES (?, ?, ?, ?, ?, 'pending')",
+                (campaign_id, json.dumps(selection), json.dumps(review_types), total_pairs, time.time()),
+            )
+
+    def get(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT campaign_id, selection, review_types, total_pairs, created_at, status, finished_at, error"
+                " FROM campaigns WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("campaign_id", "selection", "review_types", "total_pairs", "created_at", "status", "finished_at", "error")
+        record = dict(zip(keys, row))
+        record["selection"] = json.loads(record["selection"])
+        record["review_types"] = json.loads(record["review_types"])
+        return record
+
+    def list_ids(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT campaign_id FROM campaigns ORDER BY created_at")]
+
+    def set_status(self, campaign_id: str, status: str, error: Optional[str] = None) -> None:
+        finished_at = time.time() if status in ("completed", "failed", "stopped") else None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE campaigns SET status = ?, finished_at = ?, error = ? WHERE campaign_id = ?",
+                (status, finished_at, error, campaign_id),
+            )
+
+    def record_result(self, campaign_id: str, control_id: str, review_type: str, text: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO results (campaign_id, control_id, review_type, text, completed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (campaign_id, control_id, review_type, text, time.time()),
+            )
+
+    def record_failure(self, campaign_id: str, control_id: str, review_type: str, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO failures (campaign_id, control_id, review_type, error, failed_at) VALUES (?, ?, ?, ?, ?)",
+                (campaign_id, control_id, review_type, error, time.time()),
+            )
+
+    def completed_pairs(self, campaign_id: str) -> set:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT control_id, review_type FROM results WHERE campaign_id = ?", (campaign_id,)
+            ).fetchall()
+        return {(cid, rtype) for cid, rtype in rows}
+
+    def counts(self, campaign_id: str) -> Dict[str, int]:
+        with self._lock:
+            (done,) = self._conn.execute("SELECT COUNT(*) FROM results WHERE campaign_id = ?", (campaign_id,)).fetchone()
+            (failed,) = self._conn.execute(
+                "SELECT COUNT(*) FROM (SELECT DISTINCT control_id, review_type FROM failures f WHERE campaign_id = ?"
+                " AND NOT EXISTS (SELECT 1 FROM results r WHERE r.campaign_id = f.campaign_id"
+                " AND r.control_id = f.control_id AND r.review_type = f.review_type))", (campaign_id,)
+            ).fetchone()
+        return {"completed": done, "failed": failed}
+
+    def iter_results(self, campaign_id: str) -> Iterator[Dict[str, Any]]:
+        # Separate cursor so a long export does not hold the writer lock
+        conn = sqlite3.connect(self.path)
+        try:
+            for cid, rtype, text, completed_at in conn.execute(
+                "SELECT control_id, review_type, text, completed_at FROM results WHERE campaign_id = ? ORDER BY rowid",
+                (campaign_id,),
+            ):
+                yield {"control_id": cid, "review_type": rtype, "text": text, "completed_at": completed_at}
+        finally:
+            conn.close()
+
+
+class CampaignRunner:
+    """Background worker that drives one campaign to completion and tracks live throughput."""
+
+    def __init__(self, store: CampaignStore, campaign_id: str, review_func: ReviewFunc,
+                 max_concurrency: Optional[int] = None, chunk_size: int = CAMPAIGN_CHUNK_SIZE):
+        self.store = store
+        self.campaign_id = campaign_id
+        self.review_func = review_func
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self.chunk_size = max(1, chunk_size)
+        self.started_at: Optional[float] = None
+        self.done_this_run = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.run, name=f"campaign-{self.campaign_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self) -> None:
+        campaign = self.store.get(self.campaign_id)
+        self.started_at = time.time()
+        self.store.set_status(self.campaign_id, "running")
+        try:
+            controls, _ = _unique_controls(_resolve_selection(campaign["selection"]))
+            done = self.store.completed_pairs(self.campaign_id)
+            jobs = [
+                (c["control_id"], c, r)
+                for c in controls
+                for r in campaign["review_types"]
+                if (c["control_id"], r) not in done
+            ]
+
+            def _store(cid: str, review_type: str, text: str, error: Optional[BaseException]):
+                if error is None:
+                    self.store.record_result(self.campaign_id, cid, review_type, text)
+                    self.done_this_run += 1
+                else:
+                    self.store.record_failure(self.campaign_id, cid, review_type, text)
+
+            step = self.chunk_size * len(campaign["review_types"])
+            for i in range(0, len(jobs), step):
+                if self._stop.is_set():
+                    self.store.set_status(self.campaign_id, "stopped")
+                    return
+                run_review_jobs(jobs[i:i + step], self.review_func, max_concurrency=self.max_concurrency, on_result=_store)
+
+            failed = self.store.counts(self.campaign_id)["failed"]
+            self.store.set_status(self.campaign_id, "completed",
+                                  error=f"{failed} review(s) failed; resume to retry them." if failed else None)
+        except Exception as e:
+            self.store.set_status(self.campaign_id, "failed", error=f"{type(e).__name__}: {e}")
+
+
+def _resolve_selection(selection: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Turn a stored selection ({'control_ids': [...]} or {'filters': {...}}) into control records."""
+    if selection.get("control_ids"):
+        return filter_controls(control_ids=list(selection["control_ids"]))
+    return filter_controls(filters=selection.get("filters") or {})
+
+
+def _unique_controls(controls: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """
+    One record per control_id (the first one), since results are stored per (control_id, review type).
+    Controls without a control_id are left out. Returns the controls and how many were left out, and why.
+    """
+    unique: Dict[str, Dict[str, Any]] = {}
+    skipped = {"without_id": 0, "duplicate_id": 0}
+    for control in controls:
+        cid = control.get("control_id")
+        if cid is None or not str(cid).strip():
+            skipped["without_id"] += 1
+        elif str(cid) in unique:
+            skipped["duplicate_id"] += 1
+        else:
+            unique[str(cid)] = dict(control, control_id=str(cid))
+    return list(unique.values()), skipped
+
+
+_store: Optional[CampaignStore] = None
+_runners: Dict[str, CampaignRunner] = {}
+_registry_lock = threading.Lock()
+
+
+def get_campaign_store() -> CampaignStore:
+    global _store
+    with _registry_lock:
+        if _store is None:
+            _store = CampaignStore()
+        return _store
+
+
+def start_campaign(selection: Dict[str, Any], review_types: List[str], review_func: ReviewFunc,
+                   campaign_id: Optional[str] = None, max_concurrency: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Create (or resume, if campaign_id already exists) a campaign and run it in a
+    background thread. Returns the initial status.
+    """
+    if max_concurrency is not None and (isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int)
+                                        or max_concurrency < 1):
+        raise ValueError(f"max_concurrency must be a positive integer, not {max_concurrency!r}")
+    store = get_campaign_store()
+    with _registry_lock:
+        if campaign_id and campaign_id in _runners and _runners[campaign_id].is_alive():
+            return campaign_status(campaign_id)
+
+        existing = store.get(campaign_id) if campaign_id else None
+        skipped = None
+        if existing is None:
+            campaign_id = campaign_id or f"camp-{uuid.uuid4().hex[:10]}"
+            review_types = list(dict.fromkeys(review_types))
+            controls, skipped = _unique_controls(_resolve_selection(selection))
+            if not controls:
+                if skipped["without_id"]:
+                    raise ValueError(f"None of the {skipped['without_id']} matched control(s) has a control_id.")
+                raise ValueError("The selection matched no controls.")
+            store.create(campaign_id, selection, review_types, len(controls) * len(review_types))
+
+        runner = CampaignRunner(store, campaign_id, review_func, max_concurrency=max_concurrency)
+        _runners[campaign_id] = runner
+        runner.start()
+    status = campaign_status(campaign_id)
+    if skipped and any(skipped.values()):
+        status["skipped_controls"] = skipped
+        status["skipped_note"] = ("Controls without a control_id are not reviewed (results are stored by id); "
+                                  "controls sharing a control_id are reviewed once.")
+    return status
+
+
+def stop_campaign(campaign_id: str) -> Dict[str, Any]:
+    runner = _runners.get(campaign_id)
+    if runner is not None:
+        runner.stop()
+    return campaign_status(campaign_id)
+
+
+def campaign_status(campaign_id: str) -> Dict[str, Any]:
+    """Progress, throughput and ETA for a campaign."""
+    store = get_campaign_store()
+    campaign = store.get(campaign_id)
+    if campaign is None:
+        return {"error": f"Unknown campaign '{campaign_id}'."}
+
+    counts = store.counts(campaign_id)
+    total = campaign["total_pairs"]
+    status = campaign["status"]
+    runner = _runners.get(campaign_id)
+    if status in ("pending", "running") and (runner is None or not runner.is_alive()):
+        # The process that was running it went away; it can be resumed
+        status = "interrupted"
+
+    report = {
+        "campaign_id": campaign_id,
+        "status": status,
+        "review_types": campaign["review_types"],
+        "selection": campaign["selection"],
+        "total_pairs": total,
+        "completed_pairs": counts["completed"],
+        "failed_pairs": counts["failed"],
+        "percent_complete": round(100.0 * counts["completed"] / total, 1) if total else 100.0,
+    }
+    if runner is not None and runner.started_at and runner.is_alive():
+        elapsed = time.time() - runner.started_at
+        throughput = runner.done_this_run / elapsed if elapsed > 0 else 0.0
+        remaining = max(total - counts["completed"], 0)
+        report["elapsed_seconds"] = round(elapsed, 1)
+        report["throughput_per_minute"] = round(throughput * 60, 1)
+        report["eta_seconds"] = round(remaining / throughput, 1) if throughput > 0 else None
+    if campaign["error"]:
+        report["note"] = campaign["error"]
+    return report
+
+
+def list_campaigns() -> List[Dict[str, Any]]:
+    return [campaign_status(cid) for cid in get_campaign_store().list_ids()]
+
+
+def _default_review_func() -> Callable[[dict, str], str]:
+    from .tools import single_review
+    return single_review
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run and inspect library-wide review campaigns.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_start = sub.add_parser("start", help="Start a new campaign")
+    p_start.add_argument("--filters", default="{}", help="JSON dict of FilterControls attribute filters")
+    p_start.add_argument("--control-ids", nargs="*", default=None)
+    p_start.add_argument("--review-types", nargs="+", default=["5W", "OE", "DE"])
+    p_start.add_argument("--max-concurrency", type=int, default=None)
+    p_resume = sub.add_parser("resume", help="Resume an interrupted campaign")
+    p_resume.add_argument("campaign_id")
+    p_resume.add_argument("--max-concurrency", type=int, default=None)
+    p_status = sub.add_parser("status", help="Show campaign status")
+    p_status.add_argument("campaign_id", nargs="?")
+    p_export = sub.add_parser("export", help="Write a campaign's results as JSONL")
+    p_export.add_argument("campaign_id")
+    p_export.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        reports = [campaign_status(args.campaign_id)] if args.campaign_id else list_campaigns()
+        print(json.dumps(reports, indent=2))
+        return
+    if args.command == "export":
+        n = 0
+        with open(args.output, "w") as f:
+            for record in get_campaign_store().iter_results(args.campaign_id):
+                f.write(json.dumps(record) + "\n")
+                n += 1
+        print(f"Wrote {n} results to {args.output}")
+        return
+
+    if args.command == "start":
+        selection = {"control_ids": args.control_ids} if args.control_ids else {"filters": json.loads(args.filters)}
+        status = start_campaign(selection, args.review_types, _default_review_func(), max_concurrency=args.max_concurrency)
+    else:
+        existing = get_campaign_store().get(args.campaign_id)
+        if existing is None:
+            parser.error(f"Unknown campaign '{args.campaign_id}'")
+        status = start_campaign(existing["selection"], existing["review_types"], _default_review_func(),
+                                campaign_id=args.campaign_id, max_concurrency=args.max_concurrency)
+
+    campaign_id = status["campaign_id"]
+    runner = _runners[campaign_id]
+    try:
+        while runner.is_alive():
+            time.sleep(2)
+            s = campaign_status(campaign_id)
+            eta = f"{s['eta_seconds']:.0f}s" if s.get("eta_seconds") is not None else "?"
+            print(f"[{campaign_id}] {s['completed_pairs']}/{s['total_pairs']} pairs "
+                  f"({s['percent_complete']}%), {s.get('throughput_per_minute', 0)}/min, ETA {eta}")
+    except KeyboardInterrupt:
+        print("Stopping after the current chunk; resume later with:")
+        print(f"    python -m src.campaigns resume {campaign_id}")
+        runner.stop()
+        runner._thread.join()
+    print(json.dumps(campaign_status(campaign_id), indent=2))
+
+
+if __name__ == "__main__":
+    main()
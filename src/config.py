@@ -0,0 +1,18 @@
+"""
+Shared filesystem locations. Paths are resolved from the package location rather
+than the current working directory so that the agent behaves the same no matter
+where it is launched from.
+"""
+import os
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Directory for derived, rebuildable artifacts (caches, snapshots, indexes)
+CACHE_DIR = os.environ.get("CONTROL_CACHE_DIR", os.path.join(PROJECT_ROOT, ".cache"))
+
+
+def cache_path(*parts: str) -> str:
+    """Return a path inside CACHE_DIR, creating the parent directory if needed."""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
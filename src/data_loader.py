@@ -1,46 +1,317 @@
 import json
+import os
+import threading
+import time
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Optional
-
-# Load control library once
-_controls = []
-_df_controls = pd.DataFrame() # Initialize an empty DataFrame
-
-try:
-    # Adjusted path to be relative to the project root when script is run from there
-    with open("controls.json", "r") as f:
-        _controls = json.load(f)
-    _df_controls = pd.DataFrame(_controls)
-    if _df_controls.empty and _controls: # Handles case where _controls is not empty but results in empty DF (e.g. list of non-dicts)
-        print("Warning: controls.json was loaded but resulted in an empty DataFrame. Ensure it's a list of dictionaries.")
-    elif not _controls and not _df_controls.empty: # Should not happen if logic is sound, but as a safeguard
-        print("Warning: DataFrame is not empty but original control list is. Check data loading logic.")
-    elif not _controls:
-        print("Warning: controls.json is empty or not a valid list of controls. DataFrame is empty.")
-
-except FileNotFoundError:
-    print("Error: controls.json not found in the project root directory. DataFrame will be empty.")
-except json.JSONDecodeError:
-    print("Error: Could not decode controls.json. Ensure it is valid JSON. DataFrame will be empty.")
-except Exception as e:
-    print(f"An unexpected error occurred during data loading: {e}. DataFrame will be empty.")
-
-
-def filter_controls(control_ids: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+from typing import List, Dict, Any, Iterator, Optional
+
+from .config import PROJECT_ROOT
+from .query import query_mask
+from .schema import native_values
+from .search_index import IdIndex, SubstringIndex
+from . import snapshot, streaming
+
+# Location of the control library; resolved from the package, not the working directory
+CONTROLS_PATH = os.environ.get("CONTROLS_PATH", os.path.join(PROJECT_ROOT, "controls.json"))
+# Set CONTROLS_SNAPSHOT=0 to always parse the JSON source directly
+SNAPSHOT_ENABLED = os.environ.get("CONTROLS_SNAPSHOT", "1").lower() not in ("0", "false", "no")
+
+# Set CONTROLS_RELOAD_INTERVAL to a number of seconds to poll CONTROLS_PATH for changes
+RELOAD_INTERVAL_SECONDS = float(os.environ.get("CONTROLS_RELOAD_INTERVAL", 0))
+
+
+class Library:
+    """
+    One loaded version of the control library with everything derived from it.
+    Never modified after construction: a reload builds a new Library and swaps the
+    module reference, so a reader that took a reference keeps a consistent view.
+    """
+
+    def __init__(self, df: pd.DataFrame, search_index: Optional[SubstringIndex], version: int):
+        self.df = df
+        self.search_index = search_index # SubstringIndex over df
+        self.id_index = IdIndex(df['control_id']) if 'control_id' in df.columns else None # control_id -> row position
+        self.columns = {col: df[col] for col in df.columns} # results only decode the rows and columns returned
+        self.version = version # bumped on every (re)load so derived results can tell they are stale
+        self._row_hashes: Optional[np.ndarray] = None
+
+    def row_hashes(self) -> np.ndarray:
+        """Content hash of each row, used to diff this version against the next one (computed once)."""
+        if self._row_hashes is None:
+            self._row_hashes = pd.util.hash_pandas_object(self.df, index=False).to_numpy()
+        return self._row_hashes
+
+
+# The control library is loaded lazily, on the first filter call (or get_controls_df())
+_library: Optional[Library] = None
+_load_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_watcher = None
+# (size, mtime_ns) of CONTROLS_PATH when it was last read, to skip reloads of an unchanged file
+_seen_stat: Optional[tuple] = None
+
+
+def _source_stat() -> Optional[tuple]:
+    try:
+        st = os.stat(CONTROLS_PATH)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def _load_library() -> Library:
+    global _seen_stat
+    df, index = pd.DataFrame(), None
+    _seen_stat = _source_stat()
+    try:
+        if SNAPSHOT_ENABLED:
+            df, index = snapshot.load_library(CONTROLS_PATH)
+        else:
+            df = snapshot.load_json_controls(CONTROLS_PATH)
+    except FileNotFoundError:
+        print(f"Error: {CONTROLS_PATH} not found. DataFrame will be empty.")
+    except json.JSONDecodeError:
+        print(f"Error: Could not decode {CONTROLS_PATH}. Ensure it is valid JSON. DataFrame will be empty.")
+    except Exception as e:
+        print(f"An unexpected error occurred during data loading: {e}. DataFrame will be empty.")
+
+    if not df.empty and index is None:
+        index = SubstringIndex(df)
+    return Library(df, index if not df.empty else None, version=1)
+
+
+def current_library() -> Library:
+    """The current library version (loading it on first use). Use one reference per operation."""
+    global _library
+    if _library is None:
+        with _load_lock:
+            if _library is None:
+                _library = _load_library()
+                if RELOAD_INTERVAL_SECONDS > 0:
+                    start_reload_watcher(RELOAD_INTERVAL_SECONDS)
+    return _library
+
+
+def library_version() -> int:
+    """Identifier of the currently loaded library contents; changes whenever it is reloaded."""
+    return current_library().version
+
+
+def get_controls_df() -> pd.DataFrame:
+    """The loaded control library (loading it on first use)."""
+    return current_library().df
+
+
+def diff_libraries(old: pd.DataFrame, new: pd.DataFrame, old_hashes: Optional[np.ndarray] = None,
+                   new_hashes: Optional[np.ndarray] = None) -> Optional[Dict[str, Any]]:
+    """
+    Compare two versions of the library by control_id. Returns the inserted, updated
+    and deleted IDs plus remap (old row -> new row for unchanged controls, -1
+    otherwise) and changed (new rows that are inserted or updated), or None if the
+    versions cannot be matched by ID (no control_id, duplicate IDs, different columns).
+    Row hashes (see Library.row_hashes) are computed when not given.
+    """
+    if 'control_id' not in old.columns or 'control_id' not in new.columns or list(old.columns) != list(new.columns):
+        return None
+    old_ids = pd.Index(old['control_id'].astype(str))
+    new_ids = pd.Index(new['control_id'].astype(str))
+    if not old_ids.is_unique or not new_ids.is_unique:
+        return None
+    old_pos = old_ids.get_indexer(new_ids)
+    old_hash = pd.util.hash_pandas_object(old, index=False).to_numpy() if old_hashes is None else old_hashes
+    new_hash = pd.util.hash_pandas_object(new, index=False).to_numpy() if new_hashes is None else new_hashes
+    matched = old_pos >= 0
+    unchanged = matched.copy()
+    unchanged[matched] = old_hash[old_pos[matched]] == new_hash[matched]
+    remap = np.full(len(old), -1, dtype=np.int64)
+    remap[old_pos[unchanged]] = np.flatnonzero(unchanged)
+    deleted = np.ones(len(old), dtype=bool)
+    deleted[old_pos[matched]] = False
+    return {
+        "inserted": new_ids[~matched].tolist(),
+        "updated": new_ids[matched & ~unchanged].tolist(),
+        "deleted": old_ids[deleted].tolist(),
+        "remap": remap,
+        "changed": np.flatnonzero(~unchanged),
+    }
+
+
+def reload_library(force: bool = False) -> Dict[str, Any]:
+    """
+    Pick up changes to CONTROLS_PATH without restarting. The new version is diffed
+    against the current one by control_id; only inserted and updated rows are
+    re-indexed, and the result is swapped in as a whole. Calls already running keep
+    the version they started with. Returns a summary of what changed.
+    """
+    global _library, _seen_stat
+    with _reload_lock:
+        current = current_library()
+        stat = _source_stat()
+        if stat is None:
+            return {"changed": False, "error": f"{CONTROLS_PATH} not found; keeping the loaded library."}
+        if not force and stat == _seen_stat:
+            return {"changed": False, "version": current.version}
+
+        started = time.perf_counter()
+        try:
+            # Fingerprint before parsing, so a write racing the reload is picked up next time
+            fingerprint = snapshot.source_fingerprint(CONTROLS_PATH) if SNAPSHOT_ENABLED else None
+            new_df = snapshot.load_json_controls(CONTROLS_PATH)
+        except (OSError, ValueError) as e:
+            # A half-written export must not take the library down; try again on the next check
+            return {"changed": False, "error": f"Could not read {CONTROLS_PATH}: {e}. Keeping the loaded library."}
+
+        _seen_stat = stat
+        new_hashes = pd.util.hash_pandas_object(new_df, index=False).to_numpy()
+        diff = None
+        if current.search_index is not None:
+            diff = diff_libraries(current.df, new_df, current.row_hashes(), new_hashes)
+        if diff is not None and not diff["inserted"] and not diff["updated"] and not diff["deleted"]:
+            # Touched or rewritten with the same content
+            return {"changed": False, "version": current.version}
+        if new_df.empty:
+            index = None
+        elif diff is not None:
+            index = current.search_index.updated(new_df, diff["remap"], diff["changed"])
+        else:
+            index = SubstringIndex(new_df)
+        library = Library(new_df, index, version=current.version + 1)
+        library._row_hashes = new_hashes
+        _library = library
+
+        summary = {"changed": True, "version": _library.version, "controls": len(new_df),
+                   "incremental": diff is not None, "seconds": round(time.perf_counter() - started, 3)}
+        if diff is not None:
+            summary.update({k: len(diff[k]) for k in ("inserted", "updated", "deleted")})
+        if SNAPSHOT_ENABLED and not new_df.empty:
+            # Let the next process start from the new version too
+            try:
+                snapshot.write_snapshot(new_df, CONTROLS_PATH, fingerprint, index)
+            except OSError as e:
+                print(f"Warning: could not update control library snapshot ({e}).")
+        return summary
+
+
+def start_reload_watcher(interval_seconds: float) -> threading.Thread:
+    """Poll CONTROLS_PATH every interval_seconds in a daemon thread and reload when it changes."""
+    global _watcher
+    if _watcher is not None and _watcher.is_alive():
+        return _watcher
+
+    def _watch():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                summary = reload_library()
+            except Exception as e:
+                summary = {"changed": False, "error": str(e)}
+            if summary.get("changed"):
+                print(f"Reloaded control library: {summary}")
+            elif summary.get("error"):
+                print(f"Warning: {summary['error']}")
+
+    _watcher = threading.Thread(target=_watch, name="controls-reload", daemon=True)
+    _watcher.start()
+    return _watcher
+
+
+def _filter_positions(df: pd.DataFrame, index: Optional[SubstringIndex], filters: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    Row positions matching all attribute filters, or None if no filter applied.
+    Uses the search index where it can answer exactly and falls back to a
+    full-column str.contains otherwise.
+    """
+    positions = None
+    for attr, val in filters.items():
+        if attr not in df.columns:
+            print(f"Warning: Filter attribute '{attr}' not found in controls. Skipping this filter.")
+            continue
+        hits = index.search(attr, val) if index is not None else None
+        if hits is None:
+            # Ensure the column is treated as string for contains, handle NaNs
+            hits = np.flatnonzero(df[attr].astype(str).str.contains(val, case=False, na=False).to_numpy())
+        positions = hits if positions is None else np.intersect1d(positions, hits, assume_unique=True)
+        if len(positions) == 0:
+            break
+    return positions
+
+
+def _records_at(positions: Optional[np.ndarray], fields: Optional[List[str]] = None,
+                columns: Optional[Dict[str, pd.Series]] = None) -> List[Dict[str, Any]]:
+    """
+    Build record dicts for the given row positions (all rows if None) and only the
+    requested fields. Typed columns are decoded, so values match what
+    DataFrame.to_dict(orient="records") gave on the untyped JSON data.
+    columns defaults to the current library (see library_columns()).
+    """
+    columns = current_library().columns if columns is None else columns
+    if fields:
+        cols = [f for f in fields if f in columns]
+        for f in fields:
+            if f not in columns:
+                print(f"Warning: Field '{f}' not found in controls. Skipping it.")
+    else:
+        cols = list(columns)
+    if positions is not None and len(positions) == 0:
+        return []
+    values = [native_values(columns[c], positions) for c in cols]
+    return [dict(zip(cols, row)) for row in zip(*values)]
+
+
+def library_columns() -> Dict[str, pd.Series]:
+    """The current library's columns; holding on to the dict keeps row positions into it valid."""
+    return current_library().columns
+
+
+def filter_controls(control_ids: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None,
+                    fields: Optional[List[str]] = None, query: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Return list of controls matching all filters (substring, case-insensitive).
     Skips filters for attributes not present in the DataFrame.
+    If query is given (see query.py), only controls that also satisfy it are returned;
+    a malformed query raises query.QueryError.
+    If fields is given, each returned record only contains those attributes.
     """
-    global _df_controls
-    if _df_controls.empty:
+    library = current_library()
+    if library.df.empty:
         print("Warning: Filtering attempted on an empty controls DataFrame.")
         return []
+    return _records_at(match_positions(control_ids, filters, query, library=library), fields, library.columns)
+
+
+def iter_controls(filters: Optional[Dict[str, Any]] = None, query: Optional[str] = None,
+                  control_ids: Optional[List[str]] = None, fields: Optional[List[str]] = None,
+                  path: Optional[str] = None, chunk_rows: int = streaming.CONTROLS_CHUNK_ROWS) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the controls filter_controls() would return, streamed from path (default
+    CONTROLS_PATH) chunk by chunk instead of from the loaded library. Memory stays
+    bounded by chunk_rows however large the file is, which suits exports and batch
+    jobs over libraries that do not fit in memory.
+    """
+    seen: Dict[str, None] = {}
+    for chunk in streaming.iter_typed_chunks(path or CONTROLS_PATH, chunk_rows, seen):
+        library = Library(chunk, None, version=0)
+        positions = match_positions(control_ids, filters, query, library=library)
+        yield from _records_at(positions, fields or list(seen), library.columns)
+
+
+def match_positions(control_ids: Optional[List[str]] = None, filters: Optional[Dict[str, Any]] = None,
+                    query: Optional[str] = None, library: Optional[Library] = None) -> np.ndarray:
+    """
+    Sorted row positions of the controls filter_controls() would return, without
+    building any records. Positions refer to library (default: the current one).
+    """
+    library = library or current_library()
+    df = library.df
+    if df.empty:
+        return np.empty(0, dtype=np.int64)
 
     # The new wrapper in tools.py (filter_controls_tool_func) now handles various input string formats
     # and ensures that 'control_ids' is a list (if provided) and 'filters' is a dict (if provided).
     # So, the isinstance(filters, str) check is no longer needed here.
 
-    filtered_df = _df_controls.copy()
+    positions = None # None means every row
 
     if control_ids: # control_ids is now expected to be a list of strings or None
         # Ensure control_ids is a list, even if it was a single string passed to the wrapper
@@ -50,25 +321,24 @@ def filter_controls(control_ids: Optional[List[str]] = None, filters: Optional[D
             print(f"Warning: filter_controls received non-list for control_ids: {control_ids}. Wrapping in list.")
             control_ids = [str(control_ids)] # Convert to string just in case, then listify
         
-        # Filter by control_id - convert DataFrame's control_id column to string for robust comparison
-        # if it's not already, to avoid issues with mixed types (e.g. int IDs in JSON vs str here)
-        if 'control_id' in filtered_df.columns:
-            filtered_df = filtered_df[filtered_df['control_id'].astype(str).isin([str(cid) for cid in control_ids])]
+        # Look up rows by control_id in the hash index; IDs are compared as strings to avoid
+        # issues with mixed types (e.g. int IDs in JSON vs str here)
+        if library.id_index is not None:
+            positions = library.id_index.lookup(control_ids)
         else:
             print("Warning: 'control_id' column not found in DataFrame. Cannot filter by control_ids.")
-            return [] # Or return all if no control_id column?
+            return np.empty(0, dtype=np.int64) # Or return all if no control_id column?
 
     elif filters: # filters is now expected to be a dictionary or None
         if not isinstance(filters, dict):
             # This case should ideally not be hit if called via the tool wrapper
             print(f"Error: filter_controls received non-dict for filters: {filters}. Cannot apply filters.")
-            return [] # Or based on requirements, return filtered_df if only control_ids was meant to be used
+            return np.empty(0, dtype=np.int64) # Or based on requirements, return filtered_df if only control_ids was meant to be used
         
-        for attr, val in filters.items():
-            if attr in filtered_df.columns:
-                # Ensure the column is treated as string for contains, handle NaNs
-                filtered_df = filtered_df[filtered_df[attr].astype(str).str.contains(val, case=False, na=False)]
-            else:
-                print(f"Warning: Filter attribute '{attr}' not found in controls. Skipping this filter.")
-
-    return filtered_df.to_dict(orient="records") 
\ No newline at end of file
+        positions = _filter_positions(df, library.search_index, filters)
+
+    if query is not None:
+        matched = np.flatnonzero(query_mask(query, df, library.search_index))
+        positions = matched if positions is None else np.intersect1d(positions, matched, assume_unique=True)
+
+    return np.arange(len(df), dtype=np.int64) if positions is None else positions
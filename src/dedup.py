@@ -0,0 +1,356 @@
+"""
+Near-duplicate control detection with MinHash and LSH.
+
+Comparing every pair of controls does not scale (18k controls is ~160M pairs).
+Instead each control's text (name, description, purpose, remediation plan) is
+cut into overlapping word 3-grams, and a MinHash signature of DEDUP_NUM_PERM
+values is computed for the shingle set in batched NumPy. Two signatures agree in
+a given position with probability equal to the Jaccard similarity of the
+shingle sets. Locality-sensitive hashing splits the signatures into bands; only
+controls that share a band bucket become candidate pairs. Candidates are
+verified against the signature estimate and joined into clusters.
+
+Signatures are cached under .cache/dedup/, keyed by a hash of each control's
+text. When the library changes, only new or edited controls are re-signed.
+
+Run from the project root:
+    python -m src.dedup report [--threshold 0.8] [--filters '{"business_unit": "Finance"}'] [--out clusters.json]
+"""
+import argparse
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .config import cache_path
+from .data_loader import Library, current_library, match_positions
+
+DEDUP_FIELDS = ("control_name", "description", "purpose", "remediation_plan")
+DEDUP_NUM_PERM = int(os.environ.get("DEDUP_NUM_PERM", 128))
+DEDUP_SHINGLE_SIZE = 3
+DEDUP_DEFAULT_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8))
+DEDUP_SIGNATURE_PATH = os.environ.get("DEDUP_SIGNATURE_PATH") or cache_path("dedup", "signatures.npz")
+_SEED = 1729
+# Buckets with more distinct signatures than this are verified against one representative
+# instead of pairwise; find_duplicates() reports how many buckets that affected
+_PAIRWISE_BUCKET_LIMIT = 64
+_SIGN_CHUNK_SHINGLES = 200_000
+_EMPTY = np.iinfo(np.uint32).max
+
+
+def _permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Multiply-shift hash family: h(x) = ((a * x + b) mod 2^64) >> 32, with odd a
+    rng = np.random.default_rng(_SEED)
+    a = rng.integers(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def _control_text(df: pd.DataFrame) -> pd.Series:
+    fields = [f for f in DEDUP_FIELDS if f in df.columns]
+    if not fields:
+        return pd.Series([""] * len(df), index=df.index)
+    text = df[fields[0]].astype(object).fillna("").astype(str)
+    for field in fields[1:]:
+        text = text + " " + df[field].astype(object).fillna("").astype(str)
+    return text
+
+
+def content_keys(df: pd.DataFrame) -> np.ndarray:
+    """Per-control 64-bit hash of the deduplicated text; unchanged text keeps its cached signature."""
+    return pd.util.hash_pandas_object(_control_text(df), index=False).to_numpy().astype(np.uint64)
+
+
+def _shingles(text: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """(doc, shingle_hash) pairs, grouped by doc in ascending order."""
+    tokens = text.reset_index(drop=True).str.lower().str.findall(r"[a-z0-9]+").explode().dropna()
+    if tokens.empty:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    codes, uniques = pd.factorize(tokens.to_numpy())
+    token_hash = np.fromiter((zlib.crc32(u.encode("utf-8")) for u in uniques), dtype=np.uint64, count=len(uniques))[codes]
+    docs = tokens.index.to_numpy().astype(np.int64)
+    k = DEDUP_SHINGLE_SIZE
+    if len(docs) < k:
+        return docs, token_hash
+    # A k-gram starting at i is valid if all k tokens belong to the same document
+    valid = docs[:len(docs) - k + 1] == docs[k - 1:]
+    shingle = token_hash[:len(docs) - k + 1].copy()
+    for j in range(1, k):
+        shingle = shingle * np.uint64(0x9E3779B1) + token_hash[j:len(docs) - k + 1 + j]
+    shingle_docs = docs[:len(docs) - k + 1][valid]
+    shingle = shingle[valid]
+    # Documents shorter than k tokens are represented by their tokens
+    short = np.setdiff1d(np.unique(docs), shingle_docs, assume_unique=True)
+    if len(short):
+        take = np.isin(docs, short)
+        shingle_docs = np.concatenate([shingle_docs, docs[take]])
+        shingle = np.concatenate([shingle, token_hash[take]])
+        order = np.argsort(shingle_docs, kind="stable")
+        shingle_docs, shingle = shingle_docs[order], shingle[order]
+    return shingle_docs, shingle
+
+
+def minhash_signatures(text: pd.Series, num_perm: int = DEDUP_NUM_PERM) -> np.ndarray:
+    """(len(text), num_perm) uint32 MinHash signatures; rows without any token are all _EMPTY."""
+    a, b = _permutations(num_perm)
+    signatures = np.full((len(text), num_perm), _EMPTY, dtype=np.uint32)
+    docs, shingles = _shingles(text)
+    if len(docs) == 0:
+        return signatures
+    starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+    bounds = np.append(starts, len(docs))
+    # Process whole documents in chunks of about _SIGN_CHUNK_SHINGLES shingles
+    chunk_first = 0
+    while chunk_first < len(starts):
+        chunk_last = int(np.searchsorted(bounds, bounds[chunk_first] + _SIGN_CHUNK_SHINGLES, side="right")) - 1
+        chunk_last = min(max(chunk_last, chunk_first + 1), len(starts))
+        lo, hi = bounds[chunk_first], bounds[chunk_last]
+        hashed = ((a[:, None] * shingles[None, lo:hi] + b[:, None]) >> np.uint64(32)).astype(np.uint32)
+        mins = np.minimum.reduceat(hashed, starts[chunk_first:chunk_last] - lo, axis=1)
+        signatures[docs[starts[chunk_first:chunk_last]]] = mins.T
+        chunk_first = chunk_last
+    return signatures
+
+
+class SignatureCache:
+    """Signatures of every control text seen, keyed by content hash and stored as one .npz."""
+
+    def __init__(self, path: str = DEDUP_SIGNATURE_PATH, num_perm: int = DEDUP_NUM_PERM):
+        self.path = path
+        self.num_perm = num_perm
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            with np.load(self.path) as data:
+                if int(data["num_perm"]) != self.num_perm or int(data["shingle_size"]) != DEDUP_SHINGLE_SIZE:
+                    return
+                self.keys, self.signatures = data["keys"], data["signatures"]
+        except (OSError, KeyError, ValueError):
+            pass
+
+    def signatures_for(self, df: pd.DataFrame) -> Tuple[np.ndarray, int]:
+        """Signatures for every row of df and the number that had to be computed."""
+        keys = content_keys(df)
+        idx = np.searchsorted(self.keys, keys)
+        idx[idx == len(self.keys)] = 0
+        found = (self.keys[idx] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        result = np.empty((len(df), self.num_perm), dtype=np.uint32)
+        result[found] = self.signatures[idx[found]]
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            result[missing] = minhash_signatures(_control_text(df.iloc[missing]), self.num_perm)
+            # Keep exactly the current library's signatures so the file does not grow without bound
+            unique_keys, first = np.unique(keys, return_index=True)
+            self.keys, self.signatures = unique_keys, result[first]
+            self._save()
+        return result, len(missing)
+
+    def _save(self) -> None:
+        tmp = f"{self.path}.tmp-{os.getpid()}.npz"
+        try:
+            np.savez(tmp, keys=self.keys, signatures=self.signatures,
+                     num_perm=self.num_perm, shingle_size=DEDUP_SHINGLE_SIZE)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Warning: could not store dedup signatures ({e}). They will be recomputed next time.")
+
+
+_cache: Optional[SignatureCache] = None
+_library_signatures: Optional[np.ndarray] = None
+_signatures_version = None
+_lock = threading.Lock()
+
+
+def library_signatures(library: Optional[Library] = None) -> np.ndarray:
+    """MinHash signatures of the loaded library, row-aligned with get_controls_df()."""
+    global _cache, _library_signatures, _signatures_version
+    library = library or current_library()
+    version = library.version
+    with _lock:
+        if _library_signatures is None or _signatures_version != version:
+            if _cache is None:
+                _cache = SignatureCache()
+            _library_signatures, _ = _cache.signatures_for(library.df)
+            _signatures_version = version
+        return _library_signatures
+
+
+def lsh_bands(threshold: float, num_perm: int = DEDUP_NUM_PERM) -> Tuple[int, int]:
+    """
+    (bands, rows) whose S-curve threshold (1/bands)^(1/rows) is the highest not above
+    threshold, so pairs at the threshold are likely to collide in some band.
+    """
+    options = [(num_perm // r, r) for r in range(1, num_perm + 1) if num_perm % r == 0]
+    below = [(b, r) for b, r in options if (1 / b) ** (1 / r) <= threshold]
+    return max(below, key=lambda br: (1 / br[0]) ** (1 / br[1])) if below else options[-1]
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x: int, y: int) -> None:
+        rx, ry = self.find(x), self.find(y)
+        if rx != ry:
+            self.parent[max(rx, ry)] = min(rx, ry)
+
+
+def _candidate_pairs(signatures: np.ndarray, bands: int, rows: int) -> Tuple[np.ndarray, int]:
+    """
+    ((m, 2) array of row pairs sharing at least one LSH bucket, number of buckets
+    too large to pair up in full).
+    """
+    rng = np.random.default_rng(_SEED + 1)
+    coeffs = rng.integers(1, 2 ** 63, size=rows, dtype=np.uint64) | np.uint64(1)
+    pairs = []
+    truncated = 0
+    for band in range(bands):
+        block = signatures[:, band * rows:(band + 1) * rows].astype(np.uint64)
+        keys = (block * coeffs).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.append(starts, len(keys)))
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start:start + size]
+            if size > _PAIRWISE_BUCKET_LIMIT:
+                # Members with identical signatures are exact matches of their first occurrence;
+                # only the distinct signatures need pairing
+                _, first, inverse = np.unique(signatures[members], axis=0, return_index=True, return_inverse=True)
+                reps = members[first]
+                copies = reps[inverse.ravel()] != members
+                pairs.append(np.stack([reps[inverse.ravel()][copies], members[copies]], axis=1))
+                members = reps
+            if len(members) <= _PAIRWISE_BUCKET_LIMIT:
+                i, j = np.triu_indices(len(members), k=1)
+                pairs.append(np.stack([members[i], members[j]], axis=1))
+            else:
+                pairs.append(np.stack([np.full(len(members) - 1, members[0]), members[1:]], axis=1))
+                truncated += 1
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64), truncated
+    pairs = np.concatenate(pairs)
+    pairs.sort(axis=1)
+    return np.unique(pairs, axis=0), truncated
+
+
+def find_duplicates(selection: Optional[Dict[str, Any]] = None, threshold: float = DEDUP_DEFAULT_THRESHOLD,
+                    control_id: Optional[str] = None, max_clusters: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Clusters of near-duplicate controls (estimated Jaccard similarity >= threshold),
+    largest first, among the controls picked by selection (match_positions() keyword
+    arguments). With control_id, only the cluster containing that control is returned.
+    """
+    library = current_library()
+    df = library.df
+    signatures = library_signatures(library)
+    positions = match_positions(**selection, library=library) if selection else np.arange(len(df))
+    if control_id is not None:
+        target = match_positions(control_ids=[control_id], library=library)
+        if len(target) == 0:
+            return {"error": f"Control '{control_id}' not found."}
+        positions = np.union1d(positions, target)
+    sigs = signatures[positions]
+    nonempty = np.flatnonzero(sigs[:, 0] != _EMPTY)
+    bands, rows = lsh_bands(threshold, sigs.shape[1])
+    candidates, truncated = _candidate_pairs(sigs[nonempty], bands, rows) if len(nonempty) else (np.empty((0, 2), dtype=np.int64), 0)
+    candidates = nonempty[candidates]
+
+    similarities = (sigs[candidates[:, 0]] == sigs[candidates[:, 1]]).mean(axis=1) if len(candidates) else np.empty(0)
+    verified = candidates[similarities >= threshold]
+    scores = similarities[similarities >= threshold]
+    uf = _UnionFind(len(positions))
+    for i, j in verified:
+        uf.union(int(i), int(j))
+
+    groups: Dict[int, List[int]] = {}
+    for i in np.unique(verified):
+        groups.setdefault(uf.find(int(i)), []).append(int(i))
+    pair_scores: Dict[int, List[float]] = {}
+    for (i, _), score in zip(verified, scores):
+        pair_scores.setdefault(uf.find(int(i)), []).append(float(score))
+
+    ids = df["control_id"].astype(str).to_numpy() if "control_id" in df.columns else positions.astype(str)
+    target_root = None
+    if control_id is not None:
+        target_local = int(np.searchsorted(positions, target[0]))
+        target_root = uf.find(target_local)
+    clusters = []
+    for root, members in groups.items():
+        if target_root is not None and root != target_root:
+            continue
+        members = sorted(members)
+        rep = sigs[members[0]]
+        clusters.append({
+            "size": len(members),
+            "control_ids": [ids[positions[m]] for m in members],
+            # Estimated Jaccard similarity of each member to the first one
+            "similarity_to_first": [round(float((sigs[m] == rep).mean()), 3) for m in members],
+            "mean_pair_similarity": round(float(np.mean(pair_scores[root])), 3),
+        })
+    clusters.sort(key=lambda c: (-c["size"], -c["mean_pair_similarity"], c["control_ids"][0]))
+    total_clusters = len(clusters)
+    controls_in_clusters = sum(c["size"] for c in clusters)
+    if max_clusters is not None:
+        clusters = clusters[:max_clusters]
+    return {
+        "threshold": threshold,
+        "controls_compared": int(len(positions)),
+        "candidate_pairs": int(len(candidates)),
+        # LSH buckets verified against one member only; clusters may be split where this is nonzero
+        "truncated_buckets": truncated,
+        "duplicate_clusters": total_clusters,
+        "controls_in_clusters": controls_in_clusters,
+        "clusters": clusters,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report near-duplicate controls found with MinHash/LSH.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_report = sub.add_parser("report", help="Print duplicate clusters")
+    p_report.add_argument("--threshold", type=float, default=DEDUP_DEFAULT_THRESHOLD)
+    p_report.add_argument("--filters", default="{}", help="JSON dict of FilterControls attribute filters")
+    p_report.add_argument("--query", default=None, help="FilterControls query string")
+    p_report.add_argument("--max-clusters", type=int, default=None)
+    p_report.add_argument("--out", default=None, help="Also write the full report as JSON")
+    args = parser.parse_args()
+
+    selection = {}
+    if json.loads(args.filters):
+        selection["filters"] = json.loads(args.filters)
+    if args.query:
+        selection["query"] = args.query
+    report = find_duplicates(selection or None, threshold=args.threshold, max_clusters=args.max_clusters)
+    print(f"{report['controls_compared']:,} controls compared, {report['candidate_pairs']:,} LSH candidate pairs, "
+          f"{report['duplicate_clusters']:,} clusters at similarity >= {report['threshold']}")
+    if report["truncated_buckets"]:
+        print(f"Note: {report['truncated_buckets']:,} LSH buckets were too large to compare pairwise; "
+              f"some clusters may be split")
+    for n, cluster in enumerate(report["clusters"], 1):
+        print(f"\n#{n} ({cluster['size']} controls, mean similarity {cluster['mean_pair_similarity']})")
+        for cid, score in zip(cluster["control_ids"], cluster["similarity_to_first"]):
+            print(f"    {cid:<20} {score:.3f}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 from dotenv import load_dotenv
 
 # Ensure the src directory is in the Python path
@@ -18,10 +19,12 @@ load_dotenv(dotenv_path=dotenv_path, verbose=True)
 
 # --- Import Agent ---
 try:
-    from ..agent import agent # Relative import for when run as a module
+    from ..agent import agent, warmup # Relative import for when run as a module
+    from ..result_store import export_results, render_markdown
 except ImportError:
     # Fallback for direct execution if needed, though module execution is preferred
-    from agent import agent 
+    from agent import agent, warmup
+    from result_store import export_results, render_markdown
 
 # --- Sample "Real" Control Data (can be used in your prompts if desired) ---
 REAL_CONTROLS_DATA_EXAMPLES = [
@@ -47,10 +50,42 @@ REAL_CONTROLS_DATA_EXAMPLES = [
     }
 ]
 
+def render_turn(events):
+    """Print a streamed agent turn as it happens: answer tokens inline, tool and review progress on their own lines."""
+    at_line_start = False
+    answered = False  # Whether the answer since the last tool call has been streamed
+    for event in events:
+        kind = event["type"]
+        if kind == "token":
+            print(event["text"], end="", flush=True)
+            at_line_start, answered = False, True
+            continue
+        if kind == "final":
+            # Ends the streamed answer, or prints it if the model did not stream
+            print("" if answered else event["output"])
+            continue
+        if not at_line_start:
+            print()
+            at_line_start = True
+        if kind == "tool_start":
+            print(f"  [{event['tool']}] running...", flush=True)
+        elif kind == "review":
+            status = "done" if event["ok"] else "failed"
+            print(f"    {event['control_id']} {event['review_type']} {status} ({event['done']}/{event['total']})", flush=True)
+        elif kind == "tool_end":
+            outcome = f"failed: {event['error']}" if event["error"] else "finished"
+            print(f"  [{event['tool']}] {outcome} in {event['seconds']:.1f}s", flush=True)
+            print("Agent: ", end="", flush=True)
+            at_line_start, answered = False, False
+
+
 def interactive_chat():
     print("--- Control Review Agent Interactive Chat ---")
     print("Type 'exit' or 'quit' to end the session.")
+    print("Review results: '/show <result_id>' prints the full reviews, '/export <result_id> <file.md|file.jsonl>' saves them.")
     print(f"Example control data you can reference (copy/paste into your prompt if needed):\n{REAL_CONTROLS_DATA_EXAMPLES[0]}\n")
+    # Load the agent, tools and control library while the user types the first message
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
 
     while True:
         try:
@@ -62,9 +97,21 @@ def interactive_chat():
             if not user_input.strip():
                 continue
 
-            print("Agent thinking...")
-            response = agent.run(user_input)
-            print(f"\nAgent: {response}")
+            # Stored review results are read locally, not through the agent
+            command = user_input.split()
+            if command[0] == "/show" and len(command) == 2:
+                print(render_markdown(agent.review_results(command[1]), command[1]))
+                continue
+            if command[0] == "/export" and len(command) == 3:
+                n = export_results(command[1], command[2])
+                print(f"Wrote {n} reviews to {command[2]}")
+                continue
+
+            print("\nAgent: ", end="", flush=True)
+            render_turn(agent.stream(user_input))
+            # The full reviews of this turn, shown as stored rather than retold by the agent
+            for result_id in agent.last_result_ids:
+                print("\n" + render_markdown(agent.review_results(result_id), result_id))
 
         except KeyboardInterrupt:
             print("\nExiting chat due to interrupt.")
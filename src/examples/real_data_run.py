@@ -38,6 +38,7 @@ else:
 # --- Import Agent ---
 # Now that sys.path is set, we can import the agent
 import agent
+from src.result_store import render_markdown
 
 # --- Sample "Real" Control Data ---
 REAL_CONTROLS_DATA = [
@@ -95,6 +96,8 @@ def main():
                 print(f"5W for {control_to_review_single['control_id']}: \n{response1}\n")
                 f.write("--- Scenario 1: Single 5W Review ---\n")
                 f.write(f"Query:\n{query1}\n\nResponse:\n{response1}\n\n")
+                for result_id in agent.agent.last_result_ids:
+                    f.write(render_markdown(agent.agent.review_results(result_id), result_id) + "\n")
             except Exception as e:
                 print(f"Error during single 5W review (Real Data): {e}")
                 f.write(f"Error during single 5W review: {e}\n\n")
@@ -116,6 +119,8 @@ def main():
                 print(f"Batch review for {ids_for_batch}: \n{response2}\n")
                 f.write("--- Scenario 2: Batch Review (5W, OE, DE) ---\n")
                 f.write(f"Query:\n{query2}\n\nResponse:\n{response2}\n\n")
+                for result_id in agent.agent.last_result_ids:
+                    f.write(render_markdown(agent.agent.review_results(result_id), result_id) + "\n")
             except Exception as e:
                 print(f"Error during batch review (Real Data): {e}")
                 f.write(f"Error during batch review: {e}\n\n")
@@ -0,0 +1,221 @@
+"""
+Offline, deterministic stand-in for the Anthropic chat model.
+
+Set ANTHROPIC_MODEL_NAME=fake (or fake:<label>) and get_llm() returns a
+FakeChatModel instead of a Claude client, so reviews, the agent and the
+examples run without an API key, and benchmarks measure our own overhead
+rather than the provider's. Calls go through the same llm_clients.Throttle as
+real ones, so rate limits, adaptive concurrency and retries are exercised too.
+
+Behaviour is set with FAKE_LLM_* environment variables (or constructor fields):
+
+    FAKE_LLM_LATENCY        time to the first token, as a distribution:
+                            "0.3" (fixed), "uniform:0.1,0.5", "lognormal:<median>,<sigma>", "exp:<mean>"
+    FAKE_LLM_TOKEN_LATENCY  seconds per output token after the first (streaming pace), default 0
+    FAKE_LLM_OUTPUT_TOKENS  words per answer, "120" or a range "80,200"
+    FAKE_LLM_FAILURE_RATE   probability that a call fails, default 0
+    FAKE_LLM_FAILURE        how it fails: rate_limit (429), overloaded (529) or error (500)
+    FAKE_LLM_SCRIPT         tool calls for agent turns, as JSON or a path to a JSON file:
+                            [{"tool": "FilterControls", "input": "..."}, {"text": "final answer"}]
+                            A step {"tools": [{"tool": ..., "input": ...}, ...]} makes several calls at once.
+    FAKE_LLM_SEED           seed for latency draws and failures, default 0
+
+Answers are derived from a hash of the prompt, so the same prompt gives the same
+text. Fused review prompts get a well-formed JSON answer covering each control
+and review type they ask for. In an agent turn, the Nth step of the script is
+played after N tool-calling answers. Once the script is exhausted, the model answers
+in text.
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import anthropic
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field, PrivateAttr
+
+from .serialization import count_tokens
+
+FAILURE_KINDS = ("rate_limit", "overloaded", "error")
+
+_WORDS = ("control", "owner", "evidence", "frequency", "review", "risk", "design", "operating", "effective", "gap",
+          "documented", "retained", "approval", "threshold", "exception", "remediation", "testing", "sample",
+          "policy", "quarterly", "segregation", "duties", "reconciliation", "monitoring", "adequate", "partially")
+_FUSED_CONTROL_RE = re.compile(r"^--- Control (.+?) \(reviews: ([^)]*)\) ---$", re.MULTILINE)
+
+
+def parse_latency(spec: str):
+    """A function rng -> seconds for a latency spec (see module docstring)."""
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda rng: value
+    params = [float(p) for p in args.split(",")]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda rng: rng.lognormvariate(math.log(median), sigma)
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1.0 / params[0])
+    raise ValueError(f"Unknown latency distribution '{spec}'")
+
+
+def _load_script(spec: Optional[str]) -> List[Dict[str, Any]]:
+    if not spec:
+        return []
+    if os.path.exists(spec):
+        with open(spec) as f:
+            return json.load(f)
+    return json.loads(spec)
+
+
+def _failure(kind: str) -> Exception:
+    status = {"rate_limit": 429, "overloaded": 529, "error": 500}[kind]
+    response = httpx.Response(status, headers={"retry-after": "0"},
+                              request=httpx.Request("POST", "https://fake.invalid/v1/messages"))
+    message = f"Injected {kind} failure"
+    if kind == "rate_limit":
+        return anthropic.RateLimitError(message, response=response, body=None)
+    if kind == "overloaded":
+        return anthropic.OverloadedError(message, response=response, body=None)
+    return anthropic.InternalServerError(message, response=response, body=None)
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return "".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with scripted tool calls, synthetic text and configurable latency and failures."""
+
+    model: str = "fake"
+    latency: str = Field(default_factory=lambda: os.environ.get("FAKE_LLM_LATENCY", "0.2"))
+    token_latency: float = Field(default_factory=lambda: float(os.environ.get("FAKE_LLM_TOKEN_LATENCY", 0)))
+    output_tokens: str = Field(default_factory=lambda: os.environ.get("FAKE_LLM_OUTPUT_TOKENS", "120"))
+    failure_rate: float = Field(default_factory=lambda: float(os.environ.get("FAKE_LLM_FAILURE_RATE", 0)))
+    failure: str = Field(default_factory=lambda: os.environ.get("FAKE_LLM_FAILURE", "rate_limit"))
+    script: List[Dict[str, Any]] = Field(default_factory=lambda: _load_script(os.environ.get("FAKE_LLM_SCRIPT")))
+    seed: int = Field(default_factory=lambda: int(os.environ.get("FAKE_LLM_SEED", 0)))
+    max_tokens: int = 4096
+    temperature: float = 0.0
+
+    _rng: random.Random = PrivateAttr()
+    _rng_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _calls: int = PrivateAttr(default=0)
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.failure not in FAILURE_KINDS:
+            raise ValueError(f"FAKE_LLM_FAILURE must be one of {FAILURE_KINDS}")
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    # -- what to answer ---------------------------------------------------------------------------
+
+    def _words(self, prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        prompt_rng = random.Random(digest)
+        low, _, high = self.output_tokens.partition(",")
+        n = prompt_rng.randint(int(low), int(high or low))
+        words = [prompt_rng.choice(_WORDS) for _ in range(n)]
+        # Sentences of about a dozen words
+        sentences = [" ".join(words[i:i + 12]).capitalize() + "." for i in range(0, len(words), 12)]
+        return " ".join(sentences)
+
+    def _answer(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        prompt = "\n".join(_message_text(m) for m in messages)
+        if tools is not None:
+            # Agent turn: play the script step for the number of tool-calling answers since the last user message
+            last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+            step = sum(1 for m in messages[last_human + 1:] if isinstance(m, AIMessage))
+            if step < len(self.script) and "text" not in self.script[step]:
+                entries = self.script[step].get("tools") or [self.script[step]]
+                return AIMessage(content="", tool_calls=[
+                    {"name": entry["tool"], "args": entry.get("args") or {"__arg1": entry.get("input", "")},
+                     "id": f"fake-call-{step}-{i}", "type": "tool_call"} for i, entry in enumerate(entries)])
+            if step < len(self.script):
+                return AIMessage(content=self.script[step]["text"])
+        fused = _FUSED_CONTROL_RE.findall(prompt)
+        if fused and '"reviews"' in prompt:
+            reviews = [{"control_id": cid, **{rt.strip(): self._words(f"{prompt}|{cid}|{rt}") for rt in types.split(",")}}
+                       for cid, types in fused]
+            return AIMessage(content=json.dumps({"reviews": reviews}))
+        return AIMessage(content=self._words(prompt))
+
+    # -- how long it takes and whether it fails ---------------------------------------------------
+
+    def _draw(self) -> tuple:
+        with self._rng_lock:
+            self._calls += 1
+            return parse_latency(self.latency)(self._rng), self._rng.random() < self.failure_rate
+
+    def _request(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        delay, fails = self._draw()
+        time.sleep(max(0.0, delay))
+        if fails:
+            raise _failure(self.failure)
+        message = self._answer(messages, tools)
+        input_tokens = count_tokens("\n".join(_message_text(m) for m in messages))
+        output_tokens = count_tokens(_message_text(message)) + 20 * len(message.tool_calls)
+        message.usage_metadata = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                                  "total_tokens": input_tokens + output_tokens}
+        return message
+
+    def _throttled(self, messages: List[BaseMessage], tools: Optional[List[Dict[str, Any]]]) -> AIMessage:
+        from .llm_clients import get_throttle
+
+        estimate = count_tokens("\n".join(_message_text(m) for m in messages))
+
+        def _done(message: AIMessage, release) -> AIMessage:
+            release()
+            usage = message.usage_metadata or {}
+            throttle.record_usage(estimate, usage.get("input_tokens"), usage.get("output_tokens"))
+            return message
+
+        throttle = get_throttle(self.model)
+        return throttle.call(lambda: self._request(messages, tools), estimate, _done)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        message = self._throttled(messages, kwargs.get("tools"))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        message = self._throttled(messages, kwargs.get("tools"))
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content="", usage_metadata=message.usage_metadata,
+                tool_call_chunks=[{"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                                  for i, call in enumerate(message.tool_calls)]))
+            return
+        pieces = re.findall(r"\S+\s*", message.content) or [""]
+        for i, piece in enumerate(pieces):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            # BaseChatModel.stream() reports each chunk to the callbacks
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=piece, usage_metadata=message.usage_metadata if i == len(pieces) - 1 else None))
@@ -0,0 +1,212 @@
+"""
+Fused reviews: several review types, for one or a few controls, in one LLM call.
+
+Run pair by pair, reviewing a control for 5W, OE and DE is three calls, each
+resending the control and a long instruction preamble. In fused mode the
+controls of a batch are split into groups of REVIEW_FUSED_GROUP_SIZE. Each group
+is one call whose prompt (the FUSED template) carries every requested review's
+instructions once, each control once, and a JSON schema for the answer:
+{"reviews": [{"control_id": ..., "5W": "...", "OE": "...", ...}]}.
+
+Responses are parsed leniently (code fences, text around the JSON, a response
+cut off mid-array). Pairs that are still missing are asked for again in a
+smaller fused call, up to REVIEW_FUSED_RETRIES times, and then fall back to
+regular single-pair reviews. Other errors of a fused call (authentication, a
+rejected request) are not retried; they become the result of its pairs. The result has the same
+{control_id: {review_type: text}} shape as review_engine.run_reviews.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .review_engine import (DEFAULT_MAX_CONCURRENCY, ResultCallback, ReviewFunc, _ordered, in_caller_context,
+                            plan_review_pairs, review_error_text)
+
+REVIEW_FUSED_GROUP_SIZE = int(os.environ.get("REVIEW_FUSED_GROUP_SIZE", 2))
+REVIEW_FUSED_RETRIES = int(os.environ.get("REVIEW_FUSED_RETRIES", 1))
+# Every review of a group shares one response, so larger groups risk hitting the output token limit
+MAX_FUSED_GROUP_SIZE = 3
+
+# (control_id, control, review types still needed for it)
+FusedItem = Tuple[str, dict, List[str]]
+# Reviews a group of items in one call; returns {control_id: {review_type: text}} for what it got
+GroupReviewFunc = Callable[[List[FusedItem]], Dict[str, Dict[str, str]]]
+
+
+def response_schema(review_types: Sequence[str]) -> Dict[str, Any]:
+    """JSON schema the fused response must follow."""
+    return {
+        "type": "object",
+        "properties": {
+            "reviews": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"control_id": {"type": "string"},
+                                   **{rt: {"type": "string"} for rt in review_types}},
+                    "required": ["control_id"],
+                },
+            }
+        },
+        "required": ["reviews"],
+    }
+
+
+def fused_prompt_inputs(items: List[FusedItem], templates: Dict[str, str],
+                        serialize: Callable[[dict, List[str]], str]) -> Dict[str, str]:
+    """Values for the FUSED template: instructions, controls and schema."""
+    review_types = [rt for rt in templates if any(rt in types for _, _, types in items)]
+    instructions = "\n\n".join(
+        f"### {rt} review instructions\n{templates[rt].replace('{control}', '').strip()}" for rt in review_types
+    )
+    controls = "\n\n".join(
+        f"--- Control {cid} (reviews: {', '.join(types)}) ---\n{serialize(control, types)}"
+        for cid, control, types in items
+    )
+    return {"instructions": instructions, "controls": controls,
+            "schema": json.dumps(response_schema(review_types), separators=(",", ":"))}
+
+
+def _json_objects(text: str) -> List[Any]:
+    """Candidate JSON values in a model response: the whole object, else every complete array item."""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0:
+        return []
+    try:
+        return [json.loads(text[start:end + 1])]
+    except json.JSONDecodeError:
+        pass
+    # Cut off or malformed: salvage the "reviews" items that did come through complete
+    decoder = json.JSONDecoder()
+    anchor = text.find('"reviews"')
+    pos = text.find("[", anchor) + 1 if anchor >= 0 else start
+    items = []
+    while True:
+        pos = text.find("{", pos)
+        if pos < 0:
+            break
+        try:
+            item, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+    return [{"reviews": items}]
+
+
+def parse_fused_response(text: str, review_types: Sequence[str]) -> Dict[str, Dict[str, str]]:
+    """{control_id: {review_type: text}} for every non-empty review found in text."""
+    canonical = {rt.lower(): rt for rt in review_types}
+    found: Dict[str, Dict[str, str]] = {}
+    for obj in _json_objects(text):
+        if not isinstance(obj, dict):
+            continue
+        reviews = obj.get("reviews")
+        if isinstance(reviews, list):
+            entries = [(str(r.get("control_id")), r) for r in reviews if isinstance(r, dict) and r.get("control_id") is not None]
+        else:
+            # Also accept {"<control_id>": {"5W": "...", ...}}
+            entries = [(str(cid), r) for cid, r in obj.items() if isinstance(r, dict)]
+        for cid, review in entries:
+            for key, value in review.items():
+                rt = canonical.get(str(key).lower())
+                if rt is not None and isinstance(value, str) and value.strip():
+                    found.setdefault(cid, {})[rt] = value.strip()
+    return found
+
+
+def _groups(items: List[FusedItem], group_size: int) -> List[List[FusedItem]]:
+    return [items[i:i + group_size] for i in range(0, len(items), group_size)]
+
+
+def run_fused_reviews(
+    controls: List[dict],
+    review_types: List[str],
+    review_group: GroupReviewFunc,
+    fallback: ReviewFunc,
+    group_size: Optional[int] = None,
+    max_concurrency: Optional[int] = None,
+    max_retries: int = REVIEW_FUSED_RETRIES,
+    on_result: Optional[ResultCallback] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Review every (control, review type) pair with fused calls to review_group,
+    re-asking only for missing pairs and finally falling back to fallback(control,
+    review_type) per pair.
+
+    on_result, as for review_engine.run_reviews, is called from the calling thread
+    as pairs get their final text.
+    """
+    def _finish(cid: str, rt: str, text: str, error: Optional[BaseException] = None) -> None:
+        results[cid][rt] = text
+        if on_result is not None:
+            on_result(cid, rt, text, error)
+
+    results, jobs = plan_review_pairs(controls, review_types)
+    if not jobs:
+        return results
+    group_size = max(1, min(group_size or REVIEW_FUSED_GROUP_SIZE, MAX_FUSED_GROUP_SIZE))
+    workers = max(1, max_concurrency or DEFAULT_MAX_CONCURRENCY)
+
+    # One item per control_id and each review type once in it, so a prompt never asks for "5W, 5W"
+    pending: Dict[str, FusedItem] = {}
+    for cid, control, review_type in jobs:
+        types = pending.setdefault(cid, (cid, control, []))[2]
+        if review_type not in types:
+            types.append(review_type)
+
+    def _attempt(group: List[FusedItem]) -> Dict[str, Dict[str, str]]:
+        try:
+            return review_group(group)
+        except ValueError:
+            # A response that could not be parsed or validated (JSON, output parser and pydantic errors
+            # are ValueErrors): the group is retried, then falls back pair by pair
+            return {}
+
+    def _collect(future) -> Tuple[Dict[str, Dict[str, str]], Optional[BaseException]]:
+        try:
+            return future.result(), None
+        except Exception as e:
+            # Anything else (authentication, a rejected request, retries the client already gave up on)
+            # would fail again on retry or fallback, so it is the final result of the group's pairs
+            return {}, e
+
+    for attempt in range(1 + max(0, max_retries)):
+        if not pending:
+            break
+        # Retries only ask for what is missing, one control per call
+        groups = _groups(list(pending.values()), group_size if attempt == 0 else 1)
+        with ThreadPoolExecutor(max_workers=min(workers, len(groups)), thread_name_prefix="fused-review") as pool:
+            # Groups are collected in order, each as soon as it and those before it are done
+            futures = [pool.submit(in_caller_context(_attempt), group) for group in groups]
+            for group, (got, error) in zip(groups, (_collect(f) for f in futures)):
+                for cid, control, types in group:
+                    if error is not None:
+                        for rt in types:
+                            _finish(cid, rt, review_error_text(rt, error), error)
+                        pending.pop(cid, None)
+                        continue
+                    reviews = got.get(cid, {})
+                    for rt in types:
+                        if rt in reviews:
+                            _finish(cid, rt, reviews[rt])
+                    missing = [rt for rt in types if rt not in reviews]
+                    if missing:
+                        pending[cid] = (cid, control, missing)
+                    else:
+                        pending.pop(cid, None)
+
+    leftovers = [(cid, control, rt) for cid, control, types in pending.values() for rt in types]
+    if leftovers:
+        def _single(job):
+            cid, control, rt = job
+            try:
+                return fallback(control, rt), None
+            except Exception as e:
+                return review_error_text(rt, e), e
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(leftovers)), thread_name_prefix="review") as pool:
+            futures = [pool.submit(in_caller_context(_single), job) for job in leftovers]
+            for (cid, _, rt), (text, error) in zip(leftovers, (f.result() for f in futures)):
+                _finish(cid, rt, text, error)
+    return _ordered(results, review_types)
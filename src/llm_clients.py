@@ -0,0 +1,358 @@
+"""
+Shared, rate-limited Anthropic clients.
+
+tools.py and agent.py used to build a ChatAnthropic each, and nothing throttled
+them. With reviews running in parallel, provider rate limits turned into hard
+failures. get_llm() instead hands out one client per (model, temperature,
+max_tokens) from a registry. All clients share a pooled keep-alive HTTP
+connection pool and, per model, a Throttle around every API request:
+
+* token buckets for requests per minute (ANTHROPIC_RPM) and tokens per minute
+  (ANTHROPIC_TPM, input plus output). A request reserves its estimated input
+  tokens up front. Once the response reports usage, the difference and the
+  output tokens are charged, so later requests wait for the overdraft.
+* an adaptive concurrency limit (AIMD). It starts at
+  ANTHROPIC_MAX_CONCURRENCY, halves on every 429/529 response, and grows back
+  by about one slot per limit's worth of successful requests.
+* retries of rate-limit, overload, 5xx and connection errors, with jittered
+  exponential backoff (ANTHROPIC_MAX_RETRIES, ANTHROPIC_RETRY_BASE_SECONDS,
+  ANTHROPIC_RETRY_MAX_SECONDS) that honours retry-after. The SDK's own retries
+  are turned off so that every attempt goes through the limiter.
+
+Set ANTHROPIC_RPM or ANTHROPIC_TPM to 0 to disable that bucket. llm_stats()
+reports requests, retries, throttling and time spent waiting per model.
+
+The client class itself lives in anthropic_client.py and is imported when the
+first real client is built.
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from .serialization import count_tokens
+from .tracing import annotate_llm_call, callbacks as tracing_callbacks
+
+if TYPE_CHECKING:
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
+MODEL_NAME = os.environ.get("ANTHROPIC_MODEL_NAME", "claude-3-haiku-20240307")
+TEMPERATURE = float(os.environ.get("ANTHROPIC_TEMPERATURE", 0.2))
+MAX_TOKENS = int(os.environ.get("ANTHROPIC_MAX_TOKENS", 4096))
+ANTHROPIC_RPM = float(os.environ.get("ANTHROPIC_RPM", 50))
+ANTHROPIC_TPM = float(os.environ.get("ANTHROPIC_TPM", 50000))
+ANTHROPIC_MAX_CONCURRENCY = int(os.environ.get("ANTHROPIC_MAX_CONCURRENCY", 8))
+ANTHROPIC_MAX_RETRIES = int(os.environ.get("ANTHROPIC_MAX_RETRIES", 5))
+ANTHROPIC_RETRY_BASE_SECONDS = float(os.environ.get("ANTHROPIC_RETRY_BASE_SECONDS", 1.0))
+ANTHROPIC_RETRY_MAX_SECONDS = float(os.environ.get("ANTHROPIC_RETRY_MAX_SECONDS", 30.0))
+ANTHROPIC_TIMEOUT = float(os.environ.get("ANTHROPIC_TIMEOUT", 120.0))
+ANTHROPIC_POOL_CONNECTIONS = int(os.environ.get("ANTHROPIC_POOL_CONNECTIONS", 32))
+ANTHROPIC_KEEPALIVE_SECONDS = float(os.environ.get("ANTHROPIC_KEEPALIVE_SECONDS", 60.0))
+
+if not ANTHROPIC_API_KEY and not MODEL_NAME.startswith("fake"):
+    print("Warning: ANTHROPIC_API_KEY not found in environment. LLM calls will likely fail.")
+
+
+class TokenBucket:
+    """
+    Continuous-refill bucket of rate_per_minute units. The balance may go negative:
+    a reservation returns how long its caller must wait, so waiters queue up in order.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self._level = rate_per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take amount (at most a full bucket) and return the seconds to wait before using it."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level -= min(amount, self.capacity)
+            return max(0.0, -self._level / self.rate)
+
+    def charge(self, amount: float) -> None:
+        """Adjust the balance after the fact (negative amounts refund)."""
+        if self.rate <= 0 or not amount:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level - amount)
+
+
+class AdaptiveLimit:
+    """Concurrency limit that halves on throttling and creeps back up on success (AIMD)."""
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight < max(1, int(self.limit)):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def backoff(self) -> None:
+        """Throttling seen outside a held slot."""
+        with self._cond:
+            self.limit = max(1.0, self.limit / 2)
+
+
+def _is_throttled(error: BaseException) -> bool:
+    # Already imported by whoever raised the error; deferred so that importing this module stays cheap
+    import anthropic
+
+    return isinstance(error, (anthropic.RateLimitError, anthropic.OverloadedError)) or \
+        getattr(error, "status_code", None) in (429, 529)
+
+
+def _is_retryable(error: BaseException) -> bool:
+    import anthropic
+
+    if isinstance(error, anthropic.APIConnectionError):  # Includes timeouts
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def estimate_request_tokens(payload: Dict[str, Any]) -> int:
+    """Estimated input tokens of a Messages API payload (system, messages and tools)."""
+    parts = [payload.get("system"), payload.get("messages"), payload.get("tools")]
+    return sum(count_tokens(p if isinstance(p, str) else json.dumps(p, default=str)) for p in parts if p)
+
+
+class Throttle:
+    """Rate limits, adaptive concurrency and retries shared by every client of one model."""
+
+    def __init__(self, rpm: float = ANTHROPIC_RPM, tpm: float = ANTHROPIC_TPM,
+                 max_concurrency: int = ANTHROPIC_MAX_CONCURRENCY, max_retries: int = ANTHROPIC_MAX_RETRIES,
+                 base_delay: float = ANTHROPIC_RETRY_BASE_SECONDS, max_delay: float = ANTHROPIC_RETRY_MAX_SECONDS):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.concurrency = AdaptiveLimit(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0,
+                       "wait_seconds": 0.0, "input_tokens": 0, "output_tokens": 0}
+
+    def _count(self, **deltas: float) -> None:
+        with self._lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    def _admission_delay(self, estimate: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(estimate))
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, _retry_after(error) or 0.0)
+
+    def record_usage(self, estimate: int, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+        """Charge the token bucket for what a response actually used, beyond the reserved estimate."""
+        actual_in = input_tokens if input_tokens is not None else estimate
+        self.tokens.charge(actual_in - estimate + (output_tokens or 0))
+        self._count(input_tokens=actual_in, output_tokens=output_tokens or 0)
+
+    def _failed(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, or None to give up."""
+        throttled = _is_throttled(error)
+        self._count(throttled=int(throttled))
+        if attempt >= self.max_retries or not _is_retryable(error):
+            self._count(failures=1)
+            return None
+        self._count(retries=1)
+        return self._backoff(attempt, error)
+
+    def call(self, request: Callable[[], Any], estimate: int, on_result: Callable[[Any, Callable[[], None]], Any]) -> Any:
+        """
+        Run request() under the limits, retrying transient failures. on_result(result, release)
+        must call release() once the response is fully consumed (streams finish later).
+        """
+        attempt, waited = 0, 0.0
+        while True:
+            wait = self._admission_delay(estimate)
+            start = time.monotonic()
+            if wait:
+                time.sleep(wait)
+            self.concurrency.acquire()
+            waited += time.monotonic() - start
+            self._count(requests=1, wait_seconds=time.monotonic() - start)
+            try:
+                result = request()
+            except Exception as e:
+                self.concurrency.release(throttled=_is_throttled(e))
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            annotate_llm_call(retries=attempt, throttle_wait_s=round(waited, 4))
+            return on_result(result, self.concurrency.release)
+
+    async def acall(self, request: Callable[[], Any], estimate: int, on_result: Callable[[Any, Callable[[], None]], Any]) -> Any:
+        """call() for coroutine requests; waits without blocking the event loop."""
+        attempt, waited = 0, 0.0
+        while True:
+            wait = self._admission_delay(estimate)
+            start = time.monotonic()
+            if wait:
+                await asyncio.sleep(wait)
+            while not self.concurrency.try_acquire():
+                await asyncio.sleep(0.05)
+            waited += time.monotonic() - start
+            self._count(requests=1, wait_seconds=time.monotonic() - start)
+            try:
+                result = await request()
+            except Exception as e:
+                self.concurrency.release(throttled=_is_throttled(e))
+                delay = self._failed(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            annotate_llm_call(retries=attempt, throttle_wait_s=round(waited, 4))
+            return on_result(result, self.concurrency.release)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["concurrency_limit"] = round(self.concurrency.limit, 2)
+        stats["in_flight"] = self.concurrency.in_flight
+        return stats
+
+
+class _MeteredStream:
+    """Iterates a streamed response, then charges its usage and frees the concurrency slot."""
+
+    def __init__(self, stream: Any, throttle: Throttle, estimate: int, release: Callable[[], None]):
+        self._stream = stream
+        self._throttle = throttle
+        self._estimate = estimate
+        self._release = release
+        self._input_tokens: Optional[int] = None
+        self._output_tokens: Optional[int] = None
+        self._finished = False
+
+    def _observe(self, event: Any) -> None:
+        message = getattr(event, "message", None)
+        usage = getattr(message, "usage", None) or getattr(event, "usage", None)
+        if usage is not None:
+            self._input_tokens = getattr(usage, "input_tokens", None) or self._input_tokens
+            self._output_tokens = getattr(usage, "output_tokens", None) or self._output_tokens
+
+    def _finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            self._release()
+            self._throttle.record_usage(self._estimate, self._input_tokens, self._output_tokens)
+
+    def __iter__(self):
+        try:
+            for event in self._stream:
+                self._observe(event)
+                yield event
+        finally:
+            self._finish()
+
+    async def __aiter__(self):
+        try:
+            async for event in self._stream:
+                self._observe(event)
+                yield event
+        finally:
+            self._finish()
+
+
+_registry: Dict[Tuple[str, float, int], "BaseChatModel"] = {}
+_throttles: Dict[str, Throttle] = {}
+_registry_lock = threading.Lock()
+
+
+def get_throttle(model: str) -> Throttle:
+    with _registry_lock:
+        if model not in _throttles:
+            _throttles[model] = Throttle()
+        return _throttles[model]
+
+
+def get_llm(model: Optional[str] = None, temperature: Optional[float] = None,
+            max_tokens: Optional[int] = None) -> "BaseChatModel":
+    """
+    The shared client for these settings (defaults from the ANTHROPIC_* environment
+    variables). Model names starting with "fake" give the offline fake_llm.FakeChatModel.
+    """
+    key = (model or MODEL_NAME, TEMPERATURE if temperature is None else temperature, max_tokens or MAX_TOKENS)
+    with _registry_lock:
+        if key not in _registry and key[0].startswith("fake"):
+            from .fake_llm import FakeChatModel
+
+            _registry[key] = FakeChatModel(model=key[0], temperature=key[1], max_tokens=key[2],
+                                           callbacks=tracing_callbacks())
+        if key not in _registry:
+            # anthropic and langchain_anthropic are only imported once a real client is needed
+            from .anthropic_client import PooledChatAnthropic
+
+            _registry[key] = PooledChatAnthropic(
+                api_key=ANTHROPIC_API_KEY,
+                model=key[0],
+                temperature=key[1],
+                max_tokens=key[2],
+                timeout=ANTHROPIC_TIMEOUT,
+                # Retries happen in the Throttle, so every attempt is rate limited
+                max_retries=0,
+                # Every call is traced, including reviews run outside an agent turn
+                callbacks=tracing_callbacks(),
+            )
+        return _registry[key]
+
+
+def llm_stats() -> Dict[str, Dict[str, Any]]:
+    """Per-model request, retry, throttling and wait totals."""
+    with _registry_lock:
+        throttles = dict(_throttles)
+    return {model: t.stats() for model, t in throttles.items()}
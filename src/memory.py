@@ -0,0 +1,180 @@
+"""
+Token-budgeted conversation memory for AgentWrapper.
+
+The whole chat history is resent with every turn, so an unbounded history makes
+each turn of a long review session slower and more expensive than the last,
+until the context limit is hit. ConversationMemory keeps it within
+AGENT_MEMORY_TOKEN_BUDGET estimated tokens:
+
+* Messages longer than AGENT_MEMORY_MESSAGE_TOKENS (pasted control data, full
+  review texts returned with "full_text") are stored as their digest, plus a
+  note of the result_ids that hold the full text.
+* The most recent turns that fit the budget are kept verbatim.
+* Older turns are folded into a rolling summary of one line per turn. Lines
+  beyond AGENT_MEMORY_SUMMARY_TOKENS are dropped oldest first. The summary
+  costs no LLM call.
+
+stats() reports the tokens sent against what the full history would have cost.
+"""
+import os
+import threading
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .result_store import digest
+from .serialization import count_tokens
+
+AGENT_MEMORY_TOKEN_BUDGET = int(os.environ.get("AGENT_MEMORY_TOKEN_BUDGET", 3000))
+AGENT_MEMORY_MESSAGE_TOKENS = int(os.environ.get("AGENT_MEMORY_MESSAGE_TOKENS", 400))
+AGENT_MEMORY_SUMMARY_TOKENS = int(os.environ.get("AGENT_MEMORY_SUMMARY_TOKENS", 500))
+
+Message = Tuple[str, str]
+
+
+def condense(text: str, max_tokens: int = AGENT_MEMORY_MESSAGE_TOKENS, result_ids: Sequence[str] = ()) -> str:
+    """text itself if it fits in max_tokens, else its digest and a note of what was left out."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    note = f"[condensed from {len(text.split())} words"
+    if result_ids:
+        note += f"; full reviews in {', '.join(result_ids)}"
+    # About two words per token budget leaves room for the note
+    return f"{digest(text, max(10, max_tokens // 2))} {note}]"
+
+
+class _Turn:
+    __slots__ = ("human", "ai", "result_ids", "tokens", "raw_tokens")
+
+    def __init__(self, human: str, ai: str, result_ids: Sequence[str]):
+        self.result_ids = list(result_ids)
+        self.raw_tokens = count_tokens(human) + count_tokens(ai)
+        self.human = condense(human)
+        self.ai = condense(ai, result_ids=self.result_ids)
+        self.tokens = count_tokens(self.human) + count_tokens(self.ai)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "_Turn":
+        # Already condensed; restored as saved
+        turn = cls.__new__(cls)
+        for slot in cls.__slots__:
+            setattr(turn, slot, data[slot])
+        return turn
+
+    def summary_line(self) -> str:
+        line = f"- User: {digest(self.human, 20)} | Agent: {digest(self.ai, 25)}"
+        if self.result_ids:
+            line += f" [results: {', '.join(self.result_ids)}]"
+        return line
+
+
+class ConversationMemory:
+    """Recent turns verbatim plus a rolling summary of older ones, within a token budget."""
+
+    def __init__(self, token_budget: int = AGENT_MEMORY_TOKEN_BUDGET,
+                 summary_tokens: int = AGENT_MEMORY_SUMMARY_TOKENS):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self._lock = threading.Lock()
+        self._turns: List[_Turn] = []
+        self._summary: List[str] = []
+        self._summarized = 0
+        self._dropped = 0
+        self._full_tokens = 0  # What the unbounded history would cost now
+        self._stats = {"prompts": 0, "history_tokens_sent": 0, "full_history_tokens": 0}
+
+    def add_turn(self, human: str, ai: str, result_ids: Sequence[str] = ()) -> None:
+        turn = _Turn(human, ai, result_ids)
+        with self._lock:
+            self._turns.append(turn)
+            self._full_tokens += turn.raw_tokens
+            self._fold()
+
+    def _summary_text(self) -> str:
+        header = "[Summary of earlier conversation"
+        if self._dropped:
+            header += f"; {self._dropped} older turns omitted"
+        return header + "]\n" + "\n".join(self._summary)
+
+    def _fold(self) -> None:
+        # Caller holds the lock. The newest turn always stays verbatim; it is bounded by condense().
+        # The budget applies to the history as sent, i.e. with the summary merged into the first message.
+        while len(self._turns) > 1 and self._assembled_tokens() > self.token_budget:
+            self._summary.append(self._turns.pop(0).summary_line())
+            self._summarized += 1
+            while len(self._summary) > 1 and count_tokens(self._summary_text()) > self.summary_tokens:
+                self._summary.pop(0)
+                self._dropped += 1
+
+    def _assemble(self) -> List[Message]:
+        # Caller holds the lock
+        messages: List[Message] = []
+        for turn in self._turns:
+            messages += [("human", turn.human), ("ai", turn.ai)]
+        if self._summary:
+            summary = self._summary_text()
+            if messages:
+                messages[0] = ("human", f"{summary}\n\n{messages[0][1]}")
+            else:
+                messages = [("human", summary)]
+        return messages
+
+    def _assembled_tokens(self) -> int:
+        return sum(count_tokens(text) for _, text in self._assemble())
+
+    def messages(self) -> List[Message]:
+        """The history as ("human"|"ai", text) pairs; the summary leads the first kept human message."""
+        with self._lock:
+            return self._assemble()
+
+    def prompt_history(self) -> List[Message]:
+        """messages(), recorded in stats() as one prompt's worth of history."""
+        messages = self.messages()
+        with self._lock:
+            self._stats["prompts"] += 1
+            self._stats["history_tokens_sent"] += sum(count_tokens(text) for _, text in messages)
+            self._stats["full_history_tokens"] += self._full_tokens
+        return messages
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The memory as plain JSON-serializable data, for from_dict() (e.g. to persist a session)."""
+        with self._lock:
+            return {"token_budget": self.token_budget, "summary_tokens": self.summary_tokens,
+                    "turns": [t.to_dict() for t in self._turns], "summary": list(self._summary),
+                    "summarized": self._summarized, "dropped": self._dropped,
+                    "full_tokens": self._full_tokens, "stats": dict(self._stats)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationMemory":
+        memory = cls(data["token_budget"], data["summary_tokens"])
+        memory._turns = [_Turn.from_dict(t) for t in data["turns"]]
+        memory._summary = list(data["summary"])
+        memory._summarized, memory._dropped = data["summarized"], data["dropped"]
+        memory._full_tokens = data["full_tokens"]
+        memory._stats.update(data["stats"])
+        return memory
+
+    def clear(self) -> None:
+        with self._lock:
+            self._turns.clear()
+            self._summary.clear()
+            self._summarized = self._dropped = self._full_tokens = 0
+            self._stats = dict.fromkeys(self._stats, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Turn counts, current history size and the tokens saved over all prompts so far."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "turns": len(self._turns) + self._summarized,
+                "verbatim_turns": len(self._turns),
+                "summarized_turns": self._summarized - self._dropped,
+                "dropped_turns": self._dropped,
+                "full_history_tokens_now": self._full_tokens,
+            })
+        stats["history_tokens_now"] = sum(count_tokens(text) for _, text in self.messages())
+        stats["saved_tokens"] = stats["full_history_tokens"] - stats["history_tokens_sent"]
+        stats["saved_pct"] = (round(100 * stats["saved_tokens"] / stats["full_history_tokens"], 1)
+                              if stats["full_history_tokens"] else 0.0)
+        return stats
@@ -0,0 +1,180 @@
+"""
+Size-bounded, paginated FilterControls results.
+
+A broad filter can match thousands of controls; returning them all as full
+records floods the agent scratchpad. Results are therefore capped by an
+estimated token budget. When a result does not fit (or the caller asks for
+`limit`), the tool returns a summary with the total count, the first page and a
+cursor instead of the bare list.
+
+Cursors point at a stored result set: the matched row positions plus a reference
+to the library columns they index. Follow-up pages read from that snapshot, so
+they neither re-run the filter nor shift when the library is reloaded.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .data_loader import _records_at, library_columns
+
+# Estimated tokens a single FilterControls response may spend on records
+FILTER_RESULT_TOKEN_BUDGET = int(os.environ.get("FILTER_RESULT_TOKEN_BUDGET", 4000))
+FILTER_CURSOR_TTL_SECONDS = int(os.environ.get("FILTER_CURSOR_TTL_SECONDS", 30 * 60))
+FILTER_MAX_CURSORS = int(os.environ.get("FILTER_MAX_CURSORS", 128))
+# Records are decoded in chunks of this size while filling a page up to the budget
+_PAGE_CHUNK = 50
+
+RESULT_OPTIONS = ("fields", "limit", "cursor", "count_only")
+
+
+def estimate_tokens(obj: Any) -> int:
+    """Rough token count of obj as the agent will see it (about four characters per token)."""
+    return len(json.dumps(obj, default=str)) // 4 + 1
+
+
+class ResultSet:
+    """The matched rows of one filter call, frozen for paging."""
+
+    def __init__(self, positions: np.ndarray, columns: Dict[str, pd.Series], fields: Optional[List[str]]):
+        self.positions = positions
+        self.columns = columns
+        self.fields = fields
+        self.created_at = time.time()
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def records(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        return _records_at(self.positions[start:stop], self.fields, self.columns)
+
+
+class CursorStore:
+    """In-memory LRU of result sets, expiring after FILTER_CURSOR_TTL_SECONDS."""
+
+    def __init__(self, max_entries: int = FILTER_MAX_CURSORS, ttl_seconds: int = FILTER_CURSOR_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, ResultSet]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, result_set: ResultSet) -> str:
+        set_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._entries[set_id] = result_set
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return set_id
+
+    def get(self, set_id: str) -> Optional[ResultSet]:
+        with self._lock:
+            result_set = self._entries.get(set_id)
+            if result_set is None:
+                return None
+            if time.time() - result_set.created_at > self.ttl_seconds:
+                del self._entries[set_id]
+                return None
+            self._entries.move_to_end(set_id)
+            return result_set
+
+
+_cursors = CursorStore()
+
+
+def _encode_cursor(set_id: str, offset: int) -> str:
+    return f"{set_id}:{offset}"
+
+
+def _decode_cursor(cursor: str) -> Tuple[str, int]:
+    set_id, _, offset = cursor.partition(":")
+    return set_id, int(offset)
+
+
+def validate_options(options: Dict[str, Any]) -> Optional[str]:
+    """Error message for malformed result options, or None."""
+    fields = options.get("fields")
+    if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+        return "'fields' must be a list of attribute names."
+    limit = options.get("limit")
+    if limit is not None and (not isinstance(limit, int) or isinstance(limit, bool) or limit < 1):
+        return "'limit' must be a positive integer."
+    if not isinstance(options.get("count_only", False), bool):
+        return "'count_only' must be true or false."
+    cursor = options.get("cursor")
+    if cursor is not None and not isinstance(cursor, str):
+        return "'cursor' must be the string returned as 'next_cursor' by a previous call."
+    return None
+
+
+def _fill_page(result_set: ResultSet, offset: int, limit: Optional[int], token_budget: int) -> List[Dict[str, Any]]:
+    """Records from offset on, up to limit and within the token budget (always at least one)."""
+    end = len(result_set) if limit is None else min(len(result_set), offset + limit)
+    page, spent = [], 0
+    start = offset
+    while start < end:
+        for record in result_set.records(start, min(end, start + _PAGE_CHUNK)):
+            cost = estimate_tokens(record)
+            if page and spent + cost > token_budget:
+                return page
+            page.append(record)
+            spent += cost
+        start += _PAGE_CHUNK
+    return page
+
+
+def _page_response(result_set: ResultSet, set_id: Optional[str], offset: int, limit: Optional[int],
+                   token_budget: int) -> Dict[str, Any]:
+    page = _fill_page(result_set, offset, limit, token_budget)
+    next_offset = offset + len(page)
+    has_more = next_offset < len(result_set)
+    if has_more and set_id is None:
+        set_id = _cursors.put(result_set)
+    response = {
+        "total_matched": len(result_set),
+        "offset": offset,
+        "returned": len(page),
+        "controls": page,
+        "next_cursor": _encode_cursor(set_id, next_offset) if has_more else None,
+    }
+    if has_more:
+        response["note"] = ('More controls match than are shown. Pass {"cursor": "<next_cursor>"} for the next page, '
+                            'or narrow the result with "fields", a more specific filter or "count_only".')
+    return response
+
+
+def result_page(positions: np.ndarray, fields: Optional[List[str]] = None, limit: Optional[int] = None,
+                count_only: bool = False, token_budget: int = FILTER_RESULT_TOKEN_BUDGET,
+                columns: Optional[Dict[str, pd.Series]] = None):
+    """
+    FilterControls response for the matched positions: the plain list of records
+    when it fits the token budget and no limit was asked for, a count when
+    count_only is set, and otherwise a summary with the first page and a cursor.
+    columns are the library columns positions index (default: the current library).
+    """
+    if count_only:
+        return {"total_matched": int(len(positions))}
+    result_set = ResultSet(positions, library_columns() if columns is None else columns, fields)
+    response = _page_response(result_set, None, 0, limit, token_budget)
+    if limit is None and response["next_cursor"] is None:
+        return response["controls"]
+    return response
+
+
+def cursor_page(cursor: str, limit: Optional[int] = None, token_budget: int = FILTER_RESULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """The page of a stored result set that cursor points at."""
+    try:
+        set_id, offset = _decode_cursor(cursor)
+    except ValueError:
+        return {"error": f"Malformed cursor: {cursor}"}
+    result_set = _cursors.get(set_id)
+    if result_set is None:
+        return {"error": "Cursor is unknown or has expired. Re-run the filter to get a new one."}
+    if not 0 <= offset <= len(result_set):
+        return {"error": f"Cursor offset {offset} is out of range for {len(result_set)} results."}
+    return _page_response(result_set, set_id, offset, limit, token_budget)
@@ -1,4 +1,8 @@
-from langchain.prompts import PromptTemplate
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from langchain_core.prompts import PromptTemplate
 
 # Initial prompt templates
 
@@ -34,6 +38,17 @@ You are an AI specialized in control assessments. Write a comprehensive review (
 - Ensure your response is thorough, well-organized, and professional.
 
 {control}
+""",
+    "FUSED": """
+You are a control-review expert. Perform every review requested for each control below in one response. Write each review exactly as its instructions ask, as if it had been requested on its own.
+
+{instructions}
+
+Controls:
+{controls}
+
+Respond with a single JSON object and nothing else. It must match this JSON schema:
+{schema}
 """,
     "METHODS": """
 Explain your review methodologies:
@@ -55,6 +70,7 @@ PROMPT_TEMPLATES = {
 prompt_5w = PROMPT_TEMPLATES["5W"]
 prompt_oe = PROMPT_TEMPLATES["OE"]
 prompt_de = PROMPT_TEMPLATES["DE"]
+prompt_fused = PROMPT_TEMPLATES["FUSED"]
 prompt_methods = PROMPT_TEMPLATES["METHODS"]
 
 def get_prompt(prompt_key: str) -> PromptTemplate:
@@ -78,6 +94,9 @@ def update_prompt(prompt_key: str, new_template_string: str) -> bool:
             elif prompt_key == "DE":
                 global prompt_de
                 prompt_de = PROMPT_TEMPLATES[prompt_key]
+            elif prompt_key == "FUSED":
+                global prompt_fused
+                prompt_fused = PROMPT_TEMPLATES[prompt_key]
             elif prompt_key == "METHODS":
                 global prompt_methods
                 prompt_methods = PROMPT_TEMPLATES[prompt_key]
@@ -85,4 +104,37 @@ def update_prompt(prompt_key: str, new_template_string: str) -> bool:
         except Exception as e:
             print(f"Error updating prompt {prompt_key}: {e}")
             return False
-    return False 
\ No newline at end of file
+    return False
+
+# Per-session prompt templates ({prompt_key: template string}), active for the duration of a turn.
+# Sessions of service.py get their own, so one reviewer's UpdatePromptTool does not change another's reviews.
+_overrides: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("prompt_overrides", default=None)
+
+@contextmanager
+def prompt_overrides(overrides: Optional[Dict[str, str]]) -> Iterator[None]:
+    """
+    Use overrides (a dict, updated in place by UpdatePromptTool) instead of the global
+    templates in this context. None keeps the global templates.
+    """
+    token = _overrides.set(overrides)
+    try:
+        yield
+    finally:
+        _overrides.reset(token)
+
+def active_overrides() -> Optional[Dict[str, str]]:
+    """The overrides dict of the current context, or None if the global templates apply."""
+    return _overrides.get()
+
+def validate_template(prompt_key: str, new_template_string: str) -> Optional[str]:
+    """An error message if new_template_string cannot replace the prompt_key template, else None."""
+    if prompt_key not in PROMPT_TEMPLATES:
+        return f"Unknown prompt key '{prompt_key}'"
+    try:
+        variables = set(PromptTemplate.from_template(new_template_string).input_variables)
+    except Exception as e:
+        return f"Invalid template: {e}"
+    missing = set(PROMPT_TEMPLATES[prompt_key].input_variables) - variables
+    if missing:
+        return f"Template must include {', '.join('{' + v + '}' for v in sorted(missing))}"
+    return None
@@ -0,0 +1,459 @@
+"""
+Structured query language for FilterControls.
+
+A query is a boolean expression over control attributes, compiled once into a
+plan whose leaves evaluate to NumPy boolean masks over the whole library:
+
+    oe_rating <= 2 AND next_test_date < 2025-06-01 AND risk_domain IN ('AML', 'Fraud')
+    status != 'Inactive' AND NOT (criticality = low OR last_test_date > today - 90d)
+    design_effectiveness_rating BETWEEN 2 AND 3 AND description CONTAINS 'reconcil'
+
+Grammar (keywords are case-insensitive):
+
+    expr       := term (OR term)*
+    term       := factor (AND factor)*
+    factor     := NOT factor | '(' expr ')' | predicate
+    predicate  := field op value
+                | field [NOT] IN '(' value (',' value)* ')'
+                | field [NOT] BETWEEN value AND value
+                | field [NOT] CONTAINS value
+                | field IS [NOT] NULL
+    op         := = | == | != | <> | < | <= | > | >=
+    value      := 'text' | "text" | bareword | number | date
+    date       := (YYYY-MM-DD | today) ((+|-) N(d|w|m|y))*
+
+Values are compared according to their type: dates against the column parsed as
+dates, numbers numerically, and text case-insensitively. A missing value never
+satisfies a predicate other than IS NULL. CONTAINS has the same case-insensitive
+regex semantics as the dict filters and uses the same search index.
+
+Plans are cached by the normalized token stream, so the same query written with
+different spacing or keyword case compiles once. `today` is resolved when the
+plan runs, not when it is compiled.
+"""
+import operator
+import os
+import re
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .search_index import is_plain_ascii
+
+QUERY_PLAN_CACHE_SIZE = int(os.environ.get("QUERY_PLAN_CACHE_SIZE", 256))
+
+# Short names the agent is likely to use for the long column names
+FIELD_ALIASES = {
+    "id": "control_id",
+    "name": "control_name",
+    "oe": "operational_effectiveness_rating",
+    "oe_rating": "operational_effectiveness_rating",
+    "de": "design_effectiveness_rating",
+    "de_rating": "design_effectiveness_rating",
+    "owner": "control_owner",
+    "domain": "risk_domain",
+}
+
+_KEYWORDS = {"AND", "OR", "NOT", "IN", "BETWEEN", "CONTAINS", "IS", "NULL", "TODAY"}
+_OPS = {
+    "=": operator.eq, "==": operator.eq, "!=": operator.ne, "<>": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<date>\d{4}-\d{2}-\d{2}(?![\w-]))
+  | (?P<duration>\d+[dwmy](?!\w))
+  | (?P<number>\d+(?:\.\d+)?(?![\w.]))
+  | (?P<op><=|>=|!=|<>|==|=|<|>)
+  | (?P<punct>[(),+-])
+  | (?P<word>[A-Za-z_][\w.]*)
+""", re.VERBOSE)
+
+Token = Tuple[str, Any]
+
+
+class QueryError(ValueError):
+    """Raised for queries that do not parse or reference unknown fields."""
+
+
+def tokenize(query: str) -> Tuple[Token, ...]:
+    """Split a query into normalized (kind, value) tokens."""
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        m = _TOKEN_RE.match(query, pos)
+        if m is None:
+            raise QueryError(f"Unexpected character {query[pos]!r} at position {pos}.")
+        kind, text = m.lastgroup, m.group()
+        pos = m.end()
+        if kind == "ws":
+            continue
+        if kind == "string":
+            tokens.append(("string", re.sub(r"\\(.)", r"\1", text[1:-1])))
+        elif kind == "number":
+            tokens.append(("number", float(text)))
+        elif kind == "duration":
+            tokens.append(("duration", (int(text[:-1]), text[-1])))
+        elif kind == "op":
+            tokens.append(("op", "=" if text == "==" else "!=" if text == "<>" else text))
+        elif kind == "word" and text.upper() in _KEYWORDS:
+            tokens.append(("kw", text.upper()))
+        elif kind == "word":
+            # Fields are matched and bareword values compared case-insensitively anyway
+            tokens.append(("word", text.lower()))
+        else:
+            tokens.append((kind, text))
+    return tuple(tokens)
+
+
+# --- Values -----------------------------------------------------------------
+
+class _Date:
+    """A date literal or `today`, plus calendar offsets; resolved at evaluation time."""
+
+    def __init__(self, base: Optional[pd.Timestamp], offsets: List[Tuple[int, str]]):
+        self.base = base  # None means today
+        self.offsets = offsets
+
+    def resolve(self, today: pd.Timestamp) -> pd.Timestamp:
+        value = today if self.base is None else self.base
+        for amount, unit in self.offsets:
+            if unit == "d":
+                value = value + pd.Timedelta(days=amount)
+            elif unit == "w":
+                value = value + pd.Timedelta(weeks=amount)
+            elif unit == "m":
+                value = value + pd.DateOffset(months=amount)
+            else:
+                value = value + pd.DateOffset(years=amount)
+        return value
+
+
+def _resolve(value, today: pd.Timestamp):
+    return value.resolve(today) if isinstance(value, _Date) else value
+
+
+# --- Column evaluation ------------------------------------------------------
+
+def _by_value(series: pd.Series, fn: Callable[[pd.Series], np.ndarray]) -> np.ndarray:
+    """
+    Evaluate a vectorized predicate per row. Categorical columns evaluate it once
+    per category and map the result through the codes.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        hit = np.zeros(len(series.cat.categories) + 1, dtype=bool)  # last slot: code -1
+        hit[:-1] = fn(pd.Series(series.cat.categories))
+        return hit[series.cat.codes.to_numpy()]
+    return fn(series)
+
+
+def _as_kind(values: pd.Series, sample) -> pd.Series:
+    """Coerce column values to the type of the query value they are compared with."""
+    if isinstance(sample, pd.Timestamp):
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            return values
+        return pd.to_datetime(values.astype(object), errors="coerce", format="ISO8601")
+    if isinstance(sample, float):
+        if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+            return values.astype("float64")
+        return pd.to_numeric(values.astype(object), errors="coerce")
+    return values.astype(str).str.lower()
+
+
+def _normalize_value(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _comparison(series: pd.Series, op: Callable, value) -> np.ndarray:
+    def fn(values: pd.Series) -> np.ndarray:
+        coerced = _as_kind(values, value)
+        present = values.notna().to_numpy() & coerced.notna().to_numpy()
+        result = np.zeros(len(values), dtype=bool)
+        result[present] = op(coerced[present], _normalize_value(value)).to_numpy(dtype=bool)
+        return result
+    return _by_value(series, fn)
+
+
+def _membership(series: pd.Series, values: Sequence) -> np.ndarray:
+    # Group the list by value type so e.g. IN (3, '3') compares each appropriately
+    groups = {}
+    for v in values:
+        groups.setdefault(type(v), []).append(_normalize_value(v))
+
+    def fn(column: pd.Series) -> np.ndarray:
+        result = np.zeros(len(column), dtype=bool)
+        present = column.notna().to_numpy()
+        for members in groups.values():
+            coerced = _as_kind(column, members[0])
+            result |= present & coerced.isin(members).to_numpy(dtype=bool)
+        return result
+    return _by_value(series, fn)
+
+
+def _text_equality(ctx: "_Context", field: str, values: Sequence) -> Optional[np.ndarray]:
+    """
+    Case-insensitive equality on a free-text column, answered through the substring
+    index: a row equal to the value also contains it, so only the index's candidates
+    need comparing. None if the index cannot be used.
+    """
+    series = ctx.df[field]
+    if (ctx.index is None or not pd.api.types.is_string_dtype(series.dtype)
+            or not all(isinstance(v, str) and is_plain_ascii(v) for v in values)):
+        return None
+    result = np.zeros(len(series), dtype=bool)
+    for value in values:
+        hits = ctx.index.search(field, value)
+        if hits is None:
+            return None
+        if len(hits):
+            candidates = series.iloc[hits].astype(str).str.lower().to_numpy()
+            result[hits[candidates == value.lower()]] = True
+    return result
+
+
+# --- Plan nodes -------------------------------------------------------------
+
+class _Context:
+    def __init__(self, df: pd.DataFrame, index, today: pd.Timestamp):
+        self.df, self.index, self.today = df, index, today
+
+
+class _Node:
+    def mask(self, ctx: _Context) -> np.ndarray:
+        raise NotImplementedError
+
+
+class _And(_Node):
+    def __init__(self, children: List[_Node]):
+        self.children = children
+
+    def mask(self, ctx):
+        result = self.children[0].mask(ctx)
+        for child in self.children[1:]:
+            if not result.any():
+                break
+            result &= child.mask(ctx)
+        return result
+
+
+class _Or(_Node):
+    def __init__(self, children: List[_Node]):
+        self.children = children
+
+    def mask(self, ctx):
+        result = self.children[0].mask(ctx)
+        for child in self.children[1:]:
+            if result.all():
+                break
+            result |= child.mask(ctx)
+        return result
+
+
+class _Not(_Node):
+    def __init__(self, child: _Node):
+        self.child = child
+
+    def mask(self, ctx):
+        return ~self.child.mask(ctx)
+
+
+class _Compare(_Node):
+    def __init__(self, field: str, op: str, value):
+        self.field, self.op, self.value = field, op, value
+
+    def mask(self, ctx):
+        if self.op == "=" and isinstance(self.value, str):
+            result = _text_equality(ctx, self.field, [self.value])
+            if result is not None:
+                return result
+        return _comparison(ctx.df[self.field], _OPS[self.op], _resolve(self.value, ctx.today))
+
+
+class _Between(_Node):
+    def __init__(self, field: str, low, high):
+        self.field, self.low, self.high = field, low, high
+
+    def mask(self, ctx):
+        series = ctx.df[self.field]
+        return (_comparison(series, operator.ge, _resolve(self.low, ctx.today))
+                & _comparison(series, operator.le, _resolve(self.high, ctx.today)))
+
+
+class _In(_Node):
+    def __init__(self, field: str, values: list):
+        self.field, self.values = field, values
+
+    def mask(self, ctx):
+        result = _text_equality(ctx, self.field, self.values)
+        if result is not None:
+            return result
+        return _membership(ctx.df[self.field], [_resolve(v, ctx.today) for v in self.values])
+
+
+class _Contains(_Node):
+    def __init__(self, field: str, value: str):
+        self.field, self.value = field, value
+
+    def mask(self, ctx):
+        hits = ctx.index.search(self.field, self.value) if ctx.index is not None else None
+        if hits is None:
+            return ctx.df[self.field].astype(str).str.contains(self.value, case=False, na=False).to_numpy(dtype=bool)
+        result = np.zeros(len(ctx.df), dtype=bool)
+        result[hits] = True
+        return result
+
+
+class _IsNull(_Node):
+    def __init__(self, field: str):
+        self.field = field
+
+    def mask(self, ctx):
+        return ctx.df[self.field].isna().to_numpy()
+
+
+# --- Parser -----------------------------------------------------------------
+
+class _Parser:
+    def __init__(self, tokens: Sequence[Token], columns: Sequence[str]):
+        self.tokens = tokens
+        self.pos = 0
+        self.columns = {c.lower(): c for c in columns}
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else None
+
+    def next(self) -> Token:
+        token = self.peek()
+        if token is None:
+            raise QueryError("Unexpected end of query.")
+        self.pos += 1
+        return token
+
+    def accept(self, kind: str, value=None) -> bool:
+        token = self.peek()
+        if token is not None and token[0] == kind and (value is None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value=None) -> Token:
+        token = self.peek()
+        if token is None or token[0] != kind or (value is not None and token[1] != value):
+            found = "end of query" if token is None else repr(token[1])
+            raise QueryError(f"Expected {value or kind} but found {found}.")
+        self.pos += 1
+        return token
+
+    def parse(self) -> _Node:
+        if not self.tokens:
+            raise QueryError("Query is empty.")
+        node = self.expr()
+        if self.peek() is not None:
+            raise QueryError(f"Unexpected {self.peek()[1]!r} after a complete expression.")
+        return node
+
+    def expr(self) -> _Node:
+        children = [self.term()]
+        while self.accept("kw", "OR"):
+            children.append(self.term())
+        return children[0] if len(children) == 1 else _Or(children)
+
+    def term(self) -> _Node:
+        children = [self.factor()]
+        while self.accept("kw", "AND"):
+            children.append(self.factor())
+        return children[0] if len(children) == 1 else _And(children)
+
+    def factor(self) -> _Node:
+        if self.accept("kw", "NOT"):
+            return _Not(self.factor())
+        if self.accept("punct", "("):
+            node = self.expr()
+            self.expect("punct", ")")
+            return node
+        return self.predicate()
+
+    def field(self) -> str:
+        kind, name = self.next()
+        if kind != "word":
+            raise QueryError(f"Expected a field name but found {name!r}.")
+        column = self.columns.get(name.lower()) or self.columns.get(FIELD_ALIASES.get(name.lower(), ""))
+        if column is None:
+            raise QueryError(f"Unknown field '{name}'. Available fields: {', '.join(self.columns.values())}.")
+        return column
+
+    def predicate(self) -> _Node:
+        field = self.field()
+        if self.accept("kw", "IS"):
+            negate = self.accept("kw", "NOT")
+            self.expect("kw", "NULL")
+            node = _IsNull(field)
+            return _Not(node) if negate else node
+        negate = self.accept("kw", "NOT")
+        if self.accept("kw", "IN"):
+            self.expect("punct", "(")
+            values = [self.value()]
+            while self.accept("punct", ","):
+                values.append(self.value())
+            self.expect("punct", ")")
+            node = _In(field, values)
+        elif self.accept("kw", "BETWEEN"):
+            low = self.value()
+            self.expect("kw", "AND")
+            node = _Between(field, low, self.value())
+        elif self.accept("kw", "CONTAINS"):
+            value = self.value()
+            if not isinstance(value, str):
+                raise QueryError(f"CONTAINS on '{field}' needs a text value.")
+            node = _Contains(field, value)
+        elif negate:
+            raise QueryError(f"Expected IN, BETWEEN or CONTAINS after NOT for field '{field}'.")
+        else:
+            op = self.expect("op")[1]
+            node = _Compare(field, op, self.value())
+        return _Not(node) if negate else node
+
+    def value(self):
+        kind, value = self.next()
+        if kind == "punct" and value == "-":
+            kind, value = self.expect("number")
+            return -value
+        if kind == "date" or (kind == "kw" and value == "TODAY"):
+            base = None if kind == "kw" else pd.Timestamp(value)
+            offsets = []
+            while self.peek() is not None and self.peek()[0] == "punct" and self.peek()[1] in "+-":
+                sign = 1 if self.next()[1] == "+" else -1
+                amount, unit = self.expect("duration")[1]
+                offsets.append((sign * amount, unit))
+            return _Date(base, offsets)
+        if kind in ("string", "number", "word"):
+            return value
+        raise QueryError(f"Expected a value but found {value!r}.")
+
+
+@lru_cache(maxsize=QUERY_PLAN_CACHE_SIZE)
+def _compile_tokens(tokens: Tuple[Token, ...], columns: Tuple[str, ...]) -> _Node:
+    return _Parser(tokens, columns).parse()
+
+
+def compile_query(query: str, columns: Sequence[str]) -> _Node:
+    """Compile query against the given column names, reusing a cached plan when possible."""
+    if not isinstance(query, str):
+        raise QueryError("Query must be a string.")
+    return _compile_tokens(tokenize(query), tuple(columns))
+
+
+def plan_cache_info():
+    """Hit/miss statistics of the compiled-plan cache."""
+    return _compile_tokens.cache_info()
+
+
+def query_mask(query: str, df: pd.DataFrame, index=None, today: Optional[pd.Timestamp] = None) -> np.ndarray:
+    """Boolean row mask of df for query. index is the library's SubstringIndex, used for CONTAINS."""
+    plan = compile_query(query, list(df.columns))
+    today = pd.Timestamp.today().normalize() if today is None else today
+    return plan.mask(_Context(df, index, today))
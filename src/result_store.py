@@ -0,0 +1,251 @@
+"""
+Review results by reference.
+
+A batch of 5W/OE/DE reviews runs to thousands of words. Returned inline, all of
+it lands in the agent scratchpad, and the model reads it again only to write a
+summary the user could have read directly. BatchReviewControls therefore stores
+the full texts here and hands the agent a result_id with a short digest per
+review. The full text goes to the caller without passing through the model:
+AgentWrapper.review_results(), the /show and /export commands of the
+interactive chat, or the command line. The agent can still fetch a single
+review with FetchReviewResults if asked about its detail.
+
+Result sets live in a SQLite file under .cache/ and expire after
+RESULT_STORE_TTL_SECONDS.
+
+Run from the project root:
+    python -m src.result_store list
+    python -m src.result_store show <result_id> [--control-id ID] [--review-type 5W]
+    python -m src.result_store export <result_id> results.md
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from .config import cache_path
+
+RESULT_STORE_PATH = os.environ.get("RESULT_STORE_PATH") or cache_path("results.sqlite")
+RESULT_STORE_TTL_SECONDS = float(os.environ.get("RESULT_STORE_TTL_SECONDS", 7 * 24 * 3600))
+# Upper bound on the words of a digest; whole sentences are kept where they fit
+REVIEW_DIGEST_WORDS = int(os.environ.get("REVIEW_DIGEST_WORDS", 40))
+
+EXPORT_FORMATS = ("jsonl", "md")
+
+# Markdown decoration that only costs tokens in a digest: headings, bullets, emphasis, rules
+_MARKUP_RE = re.compile(r"^\s*(?:#{1,6}\s*|[-*+]\s+|\d+[.)]\s+|[-=_*]{3,}\s*$)|\*\*|__|`", re.MULTILINE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def digest(text: str, max_words: int = REVIEW_DIGEST_WORDS) -> str:
+    """The leading sentences of text that fit in max_words, else its first max_words words."""
+    plain = _WHITESPACE_RE.sub(" ", _MARKUP_RE.sub("", text)).strip()
+    taken: List[str] = []
+    count = 0
+    for sentence in _SENTENCE_END_RE.split(plain):
+        words = len(sentence.split())
+        if count + words > max_words:
+            break
+        taken.append(sentence)
+        count += words
+    if taken:
+        return " ".join(taken)
+    words = plain.split()
+    return " ".join(words[:max_words]) + (" ..." if len(words) > max_words else "")
+
+
+class ResultStore:
+    """SQLite store of review result sets, addressed by result_id."""
+
+    def __init__(self, path: str = RESULT_STORE_PATH, ttl_seconds: float = RESULT_STORE_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS result_sets (
+                result_id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                review_types TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                result_id TEXT NOT NULL,
+                control_id TEXT NOT NULL,
+                review_type TEXT NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (result_id, control_id, review_type)
+            );
+            """
+        )
+
+    def put(self, results: Dict[str, Dict[str, Any]], source: str = "BatchReviewControls") -> str:
+        """Store {control_id: {review_type: text}} and return its result_id."""
+        result_id = f"rv-{uuid.uuid4().hex[:10]}"
+        review_types = list(dict.fromkeys(rt for reviews in results.values() for rt in reviews))
+        rows = [(result_id, str(cid), rt, str(text)) for cid, reviews in results.items() for rt, text in reviews.items()]
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("INSERT INTO result_sets (result_id, source, review_types, created_at) VALUES (?, ?, ?, ?)",
+                                   (result_id, source, json.dumps(review_types), now))
+                self._conn.executemany("INSERT INTO results (result_id, control_id, review_type, text) VALUES (?, ?, ?, ?)", rows)
+            except BaseException:
+                # The connection is shared by the process; leaving the transaction open would fail every later put
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._puts_since_trim += 1
+            if self._puts_since_trim >= 50:
+                self._trim(now)
+        return result_id
+
+    def _trim(self, now: float) -> None:
+        # Caller holds the lock
+        self._puts_since_trim = 0
+        if self.ttl_seconds <= 0:
+            return
+        cutoff = now - self.ttl_seconds
+        self._conn.execute("DELETE FROM results WHERE result_id IN (SELECT result_id FROM result_sets WHERE created_at < ?)",
+                           (cutoff,))
+        self._conn.execute("DELETE FROM result_sets WHERE created_at < ?", (cutoff,))
+
+    def exists(self, result_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT created_at FROM result_sets WHERE result_id = ?", (result_id,)).fetchone()
+        return row is not None and not (self.ttl_seconds > 0 and time.time() - row[0] > self.ttl_seconds)
+
+    def iter_results(self, result_id: str, control_ids: Optional[List[str]] = None,
+                     review_types: Optional[List[str]] = None) -> Iterator[Dict[str, str]]:
+        """Stored reviews of result_id in the order they were stored, optionally narrowed."""
+        sql = "SELECT control_id, review_type, text FROM results WHERE result_id = ?"
+        params: List[Any] = [result_id]
+        for column, values in (("control_id", control_ids), ("review_type", review_types)):
+            if values:
+                sql += f" AND {column} IN ({', '.join('?' * len(values))})"
+                params.extend(str(v) for v in values)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY rowid", params).fetchall()
+        for cid, rtype, text in rows:
+            yield {"control_id": cid, "review_type": rtype, "text": text}
+
+    def get(self, result_id: str, control_ids: Optional[List[str]] = None,
+            review_types: Optional[List[str]] = None) -> Dict[str, Dict[str, str]]:
+        """{control_id: {review_type: text}}, the shape BatchReviewControls used to return."""
+        results: Dict[str, Dict[str, str]] = {}
+        for r in self.iter_results(result_id, control_ids, review_types):
+            results.setdefault(r["control_id"], {})[r["review_type"]] = r["text"]
+        return results
+
+    def list_sets(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.result_id, s.source, s.review_types, s.created_at, COUNT(r.text) FROM result_sets s"
+                " LEFT JOIN results r ON r.result_id = s.result_id GROUP BY s.result_id"
+                " ORDER BY s.created_at DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"result_id": rid, "source": source, "review_types": json.loads(types),
+                 "created_at": created_at, "reviews": n} for rid, source, types, created_at, n in rows]
+
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ResultStore()
+    return _store
+
+
+def store_results(results: Dict[str, Dict[str, Any]], source: str = "BatchReviewControls") -> Dict[str, Any]:
+    """
+    Store a {control_id: {review_type: text}} batch and return what the agent sees
+    instead: the result_id and, per review, a digest and the full text's word count.
+    """
+    result_id = get_result_store().put(results, source)
+    reviews = {
+        cid: {rt: {"digest": digest(str(text)), "words": len(str(text).split())} for rt, text in by_type.items()}
+        for cid, by_type in results.items()
+    }
+    return {
+        "result_id": result_id,
+        "reviews": reviews,
+        "note": "Digests only. The full reviews are shown to the user directly; do not restate them. "
+                "Use FetchReviewResults with this result_id only to answer a question about a specific review.",
+    }
+
+
+def render_markdown(results: Dict[str, Dict[str, str]], result_id: str = "") -> str:
+    """Full review texts as a markdown document, one section per control."""
+    lines = [f"# Review results {result_id}".rstrip(), ""]
+    for cid, by_type in results.items():
+        lines += [f"## {cid}", ""]
+        for rt, text in by_type.items():
+            lines += [f"### {rt}", "", text.strip(), ""]
+    return "\n".join(lines)
+
+
+def export_results(result_id: str, path: str, fmt: Optional[str] = None) -> int:
+    """Write a result set to path as JSON lines or markdown (by extension unless fmt is given); returns the review count."""
+    fmt = fmt or ("md" if path.endswith(".md") else "jsonl")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}'. Use one of {EXPORT_FORMATS}.")
+    store = get_result_store()
+    if not store.exists(result_id):
+        raise KeyError(f"Unknown or expired result_id '{result_id}'")
+    n = 0
+    with open(path, "w") as f:
+        if fmt == "md":
+            results = store.get(result_id)
+            f.write(render_markdown(results, result_id))
+            n = sum(len(r) for r in results.values())
+        else:
+            for record in store.iter_results(result_id):
+                f.write(json.dumps(record) + "\n")
+                n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or export stored review results.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List recent result sets")
+    show = sub.add_parser("show", help="Print the full reviews of a result set")
+    show.add_argument("result_id")
+    show.add_argument("--control-id", nargs="+", default=None)
+    show.add_argument("--review-type", nargs="+", default=None)
+    export = sub.add_parser("export", help="Write a result set to a .jsonl or .md file")
+    export.add_argument("result_id")
+    export.add_argument("output")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default=None)
+    args = parser.parse_args()
+
+    store = get_result_store()
+    if args.command == "list":
+        print(json.dumps(store.list_sets(), indent=2))
+        return
+    if not store.exists(args.result_id):
+        parser.error(f"Unknown or expired result_id '{args.result_id}'")
+    if args.command == "show":
+        print(render_markdown(store.get(args.result_id, args.control_id, args.review_type), args.result_id))
+        return
+    n = export_results(args.result_id, args.output, args.format)
+    print(f"Wrote {n} reviews to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Content-addressed cache for review results.
+
+A review is fully determined by the control data, the prompt template, and the
+model settings, so the cache key is a hash over exactly those inputs. Lookups go
+through a small in-memory LRU first and fall back to an on-disk SQLite table that
+survives restarts. Entries expire after a TTL and the disk tier is trimmed to a
+maximum size, least recently used first.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .config import cache_path
+
+CACHE_ENABLED = os.environ.get("REVIEW_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+CACHE_PATH = os.environ.get("REVIEW_CACHE_PATH") or cache_path("review_cache.sqlite")
+CACHE_TTL_SECONDS = float(os.environ.get("REVIEW_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("REVIEW_CACHE_MAX_ENTRIES", 50000))
+CACHE_MEMORY_ENTRIES = int(os.environ.get("REVIEW_CACHE_MEMORY_ENTRIES", 512))
+
+
+def canonical_json(obj: Any) -> str:
+    """Stable JSON encoding: sorted keys, no whitespace, non-JSON values stringified."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def make_review_key(control: dict, review_type: str, template: str, model: str, temperature: float, max_tokens: int,
+                    layout: Optional[str] = None) -> str:
+    """
+    Hash every input that determines a review's output. layout names the way the
+    control is rendered into the prompt, if not the control dict's repr().
+    """
+    inputs = {
+        "control": control,
+        "review_type": review_type,
+        "template": template,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    if layout is not None:
+        inputs["layout"] = layout
+    payload = canonical_json(inputs)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReviewCache:
+    """Two-tier (memory LRU over SQLite) cache of review texts keyed by content hash."""
+
+    def __init__(self, path: Optional[str] = CACHE_PATH, ttl_seconds: float = CACHE_TTL_SECONDS,
+                 max_entries: int = CACHE_MAX_ENTRIES, memory_entries: int = CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (review_type, text, created_at)
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0,
+                       "expired": 0, "evicted": 0, "invalidated": 0, "saved_output_chars": 0}
+        self._conn = None
+        if path:
+            try:
+                self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS reviews ("
+                    " key TEXT PRIMARY KEY, review_type TEXT NOT NULL, text TEXT NOT NULL,"
+                    " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+                )
+                self._conn.execute("CREATE INDEX IF NOT EXISTS reviews_type ON reviews(review_type)")
+                self._conn.execute("CREATE INDEX IF NOT EXISTS reviews_accessed ON reviews(accessed_at)")
+            except sqlite3.Error as e:
+                print(f"Warning: review cache database at {path} unavailable ({e}). Using memory tier only.")
+                self._conn = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str, record_miss: bool = True) -> Optional[str]:
+        """
+        The cached text for key, or None. record_miss=False leaves a miss out of the stats,
+        for a lookup that another key may still answer (a hit is always counted).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[2], now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    self._stats["saved_output_chars"] += len(entry[1])
+                    return entry[1]
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT review_type, text, created_at FROM reviews WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    review_type, text, created_at = row
+                    if not self._expired(created_at, now):
+                        self._conn.execute("UPDATE reviews SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._remember(key, review_type, text, created_at)
+                        self._stats["disk_hits"] += 1
+                        self._stats["saved_output_chars"] += len(text)
+                        return text
+                    self._conn.execute("DELETE FROM reviews WHERE key = ?", (key,))
+                    self._stats["expired"] += 1
+
+            if record_miss:
+                self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, review_type: str, text: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._remember(key, review_type, text, now)
+            self._stats["writes"] += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO reviews (key, review_type, text, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                    (key, review_type, text, now, now),
+                )
+                self._puts_since_trim += 1
+                if self._puts_since_trim >= 100:
+                    self._trim_disk(now)
+
+    def _remember(self, key: str, review_type: str, text: str, created_at: float) -> None:
+        # Caller holds the lock
+        self._memory[key] = (review_type, text, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _trim_disk(self, now: float) -> None:
+        # Caller holds the lock
+        self._puts_since_trim = 0
+        if self.ttl_seconds > 0:
+            cur = self._conn.execute("DELETE FROM reviews WHERE created_at < ?", (now - self.ttl_seconds,))
+            self._stats["expired"] += max(cur.rowcount, 0)
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM reviews").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            cur = self._conn.execute(
+                "DELETE FROM reviews WHERE key IN (SELECT key FROM reviews ORDER BY accessed_at LIMIT ?)", (excess,)
+            )
+            self._stats["evicted"] += max(cur.rowcount, 0)
+
+    def invalidate(self, review_type: Optional[str] = None) -> int:
+        """Drop entries for one review type (or everything). Returns the number of disk rows removed."""
+        with self._lock:
+            stale = [k for k, entry in self._memory.items() if review_type is None or entry[0] == review_type]
+            for k in stale:
+                del self._memory[k]
+            removed = len(stale)
+            if self._conn is not None:
+                if review_type is None:
+                    cur = self._conn.execute("DELETE FROM reviews")
+                else:
+                    cur = self._conn.execute("DELETE FROM reviews WHERE review_type = ?", (review_type,))
+                removed = max(cur.rowcount, 0)
+            self._stats["invalidated"] += removed
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters. Every hit is one LLM call that was not made."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            if self._conn is not None:
+                stats["disk_entries"] = self._conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hits"] = hits
+        stats["llm_calls_saved"] = hits
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        # Rough output-token estimate (~4 characters per token) for spend reporting
+        stats["saved_output_tokens_estimate"] = stats["saved_output_chars"] // 4
+        return stats
+
+
+_default_cache: Optional[ReviewCache] = None
+_default_lock = threading.Lock()
+
+
+def get_review_cache() -> Optional[ReviewCache]:
+    """Process-wide cache instance, or None when caching is disabled."""
+    global _default_cache
+    if not CACHE_ENABLED:
+        return None
+    if _default_cache is None:
+        with _default_lock:
+            if _default_cache is None:
+                _default_cache = ReviewCache()
+    return _default_cache
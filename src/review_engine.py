@@ -0,0 +1,134 @@
+"""
+Concurrent execution engine for control reviews.
+
+Every (control x review type) pair is an independent LLM round-trip, so a batch
+can be fanned out over a bounded thread pool instead of running one call after
+another. Results come back in the same {control_id: {review_type: text}} shape
+that BatchReviewControls has always returned, and a failure in one pair is
+recorded in place of that pair's text instead of aborting the whole batch.
+"""
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Upper bound on simultaneous LLM calls for a single batch. Configurable so that
+# it can be tuned to the provider's rate limits.
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("REVIEW_MAX_CONCURRENCY", 4))
+
+ReviewFunc = Callable[[dict, str], str]
+ResultCallback = Callable[[str, str, str, Optional[BaseException]], None]
+
+
+def review_error_text(review_type: str, error: BaseException) -> str:
+    """Text stored in place of a review that raised, so the batch shape is preserved."""
+    return f"Error during {review_type} review: {error}"
+
+
+def in_caller_context(func: Callable) -> Callable:
+    """
+    func bound to a copy of the calling thread's context, for one job on a worker
+    thread. LangChain run callbacks (streamed events, tracing spans) then nest the
+    job under the tool call that started it. Use one per job: a context can only
+    be entered by one thread at a time.
+    """
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+def plan_review_pairs(controls: List[dict], review_types: List[str]) -> Tuple[Dict[str, Dict[str, Any]], List[Tuple[str, dict, str]]]:
+    """
+    Validate the controls and expand them into (control_id, control, review_type) jobs.
+    Returns the results dict pre-populated with per-control errors and the job list.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    jobs = []
+    for c in controls:
+        if not isinstance(c, dict):
+            results[str(c)] = {"error": "Each item in 'controls' must be a dictionary."}
+            continue
+        cid = c.get("control_id", "<no-id>")
+        # Pre-create the slot so the output keeps the caller's control order
+        results.setdefault(cid, {})
+        for r in review_types:
+            jobs.append((cid, c, r))
+    return results, jobs
+
+
+def run_reviews(
+    controls: List[dict],
+    review_types: List[str],
+    review_func: ReviewFunc,
+    max_concurrency: Optional[int] = None,
+    on_result: Optional[ResultCallback] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Run review_func for every (control, review type) pair using at most
+    max_concurrency worker threads.
+
+    on_result, if given, is called from the calling thread as each pair finishes
+    with (control_id, review_type, text, error).
+    """
+    results, jobs = plan_review_pairs(controls, review_types)
+    if not jobs:
+        return results
+
+    def _collect(cid: str, review_type: str, text: str, error: Optional[BaseException]):
+        results[cid][review_type] = text
+        if on_result is not None:
+            on_result(cid, review_type, text, error)
+
+    run_review_jobs(jobs, review_func, max_concurrency=max_concurrency, on_result=_collect)
+    return _ordered(results, review_types)
+
+
+def run_review_jobs(
+    jobs: List[Tuple[str, dict, str]],
+    review_func: ReviewFunc,
+    max_concurrency: Optional[int] = None,
+    on_result: Optional[ResultCallback] = None,
+) -> None:
+    """
+    Lower-level entry point: run an explicit list of (control_id, control, review_type)
+    jobs and report each outcome through on_result (called from the calling thread).
+    """
+    if not jobs:
+        return
+
+    workers = max(1, min(max_concurrency or DEFAULT_MAX_CONCURRENCY, len(jobs)))
+
+    def _finish(cid: str, review_type: str, text: str, error: Optional[BaseException]):
+        if on_result is not None:
+            on_result(cid, review_type, text, error)
+
+    if workers == 1:
+        # No point paying for a pool when there is nothing to overlap
+        for cid, control, review_type in jobs:
+            try:
+                text, error = review_func(control, review_type), None
+            except Exception as e:
+                text, error = review_error_text(review_type, e), e
+            _finish(cid, review_type, text, error)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="review") as pool:
+        futures = {
+            pool.submit(in_caller_context(review_func), control, review_type): (cid, review_type)
+            for cid, control, review_type in jobs
+        }
+        for future in as_completed(futures):
+            cid, review_type = futures[future]
+            try:
+                text, error = future.result(), None
+            except Exception as e:
+                text, error = review_error_text(review_type, e), e
+            _finish(cid, review_type, text, error)
+
+
+def _ordered(results: Dict[str, Dict[str, Any]], review_types: List[str]) -> Dict[str, Dict[str, Any]]:
+    # Completion order is nondeterministic; present review types in the requested order
+    for cid, per_type in results.items():
+        if "error" in per_type and len(per_type) == 1:
+            continue
+        results[cid] = {r: per_type[r] for r in review_types if r in per_type}
+    return results
@@ -0,0 +1,110 @@
+"""
+Typed schema for the control library.
+
+Left to its own devices pandas stores every attribute as a generic object (or
+string) column, so a value like "Compliance" is kept once per row. The schema
+maps each known attribute to a compact representation:
+
+* category - low-cardinality labels (business_unit, status, ...) as pandas
+  categoricals: one small integer code per row plus a table of distinct values.
+* rating   - 1-5 ratings as int8 (nullable Int8 only when values are missing).
+* date     - test dates as datetime64.
+* text     - free text and identifiers, left as strings.
+
+Attributes not in the schema are left as loaded. Records handed back to callers
+are decoded to plain Python values (str, int, 'YYYY-MM-DD' strings) so the
+typing never leaks into tool output.
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+CONTROL_SCHEMA: Dict[str, str] = {
+    "control_id": "text",
+    "control_name": "text",
+    "description": "text",
+    "business_unit": "category",
+    "risk_domain": "category",
+    "control_owner": "category",
+    "frequency": "category",
+    "control_type": "category",
+    "design_effectiveness_rating": "rating",
+    "operational_effectiveness_rating": "rating",
+    "last_test_date": "date",
+    "next_test_date": "date",
+    "status": "category",
+    "remediation_plan": "text",
+    "purpose": "text",
+    "location": "category",
+    "regulatory_reference": "category",
+    "criticality": "category",
+}
+
+DATE_FORMAT = "%Y-%m-%d"
+
+# Ratings and dates are only converted if every non-missing value survives the
+# conversion; otherwise the column is left as loaded.
+
+
+def _to_rating(series: pd.Series) -> Optional[pd.Series]:
+    numeric = pd.to_numeric(series, errors="coerce")
+    if numeric.notna().sum() != series.notna().sum():
+        return None
+    if numeric.isna().any():
+        return numeric.astype("Int8")
+    if (numeric % 1 != 0).any() or numeric.min() < -128 or numeric.max() > 127:
+        return None
+    return numeric.astype(np.int8)
+
+
+def _to_date(series: pd.Series) -> Optional[pd.Series]:
+    parsed = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce")
+    if parsed.notna().sum() != series.notna().sum():
+        # Values that are not plain dates would be lost; keep the column as text
+        return None
+    return parsed
+
+
+def apply_schema(df: pd.DataFrame, schema: Dict[str, str] = CONTROL_SCHEMA) -> pd.DataFrame:
+    """Return df with schema columns converted to their compact dtypes."""
+    typed = {}
+    for col in df.columns:
+        series = df[col]
+        kind = schema.get(col)
+        converted = None
+        if kind == "category" and not isinstance(series.dtype, pd.CategoricalDtype):
+            converted = series.astype("category")
+        elif kind == "rating" and str(series.dtype) not in ("int8", "Int8"):
+            converted = _to_rating(series)
+        elif kind == "date" and not pd.api.types.is_datetime64_any_dtype(series.dtype):
+            converted = _to_date(series)
+        typed[col] = series if converted is None else converted
+    return pd.DataFrame(typed, copy=False)
+
+
+def native_values(series: pd.Series, positions: Optional[np.ndarray] = None) -> List[Any]:
+    """
+    Plain Python values for the given rows of a (possibly typed) column, matching
+    what DataFrame.to_dict(orient="records") produced on the untyped JSON data.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        if positions is not None:
+            codes = codes[positions]
+        table = np.empty(len(series.cat.categories) + 1, dtype=object)
+        table[:-1] = series.cat.categories.to_numpy(dtype=object)
+        table[-1] = np.nan
+        return table[codes].tolist()
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        values = series.to_numpy()
+        if positions is not None:
+            values = values[positions]
+        strings = np.datetime_as_string(values, unit="D").astype(object)
+        strings[np.isnat(values)] = np.nan
+        return strings.tolist()
+    if pd.api.types.is_extension_array_dtype(series.dtype) and pd.api.types.is_integer_dtype(series.dtype):
+        values = series.to_numpy(dtype=object, na_value=np.nan)
+        return (values if positions is None else values[positions]).tolist()
+    values = series.to_numpy()
+    return (values if positions is None else values[positions]).tolist()
@@ -0,0 +1,337 @@
+"""
+Search index for case-insensitive substring filters over the control library.
+
+FilterControls semantics are those of
+    df[attr].astype(str).str.contains(value, case=False, na=False)
+i.e. a case-insensitive regular-expression search on the stringified column. The
+index answers the same question without re-stringifying and scanning the whole
+column on every call:
+
+* Low-cardinality columns (business_unit, status, ratings, dates, ...) are
+  factorized once. A query is matched against the few distinct values and the
+  matching codes are mapped back to rows. Categorical and date columns of the
+  typed library (see schema.py) reuse their codes instead of being re-factorized.
+* High-cardinality text columns (descriptions, IDs, ...) get a trigram inverted
+  index over their lower-cased ASCII text. A plain (metacharacter-free) query is
+  answered by intersecting the posting lists of its trigrams, rarest first, and
+  then verifying the surviving candidates with the exact regex.
+
+Anything the index cannot answer exactly (non-string values, regex queries on
+text columns, non-ASCII queries) returns None so the caller can fall back to
+the original full-scan expression.
+"""
+import json
+import os
+import re
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# Columns with at most this many distinct values (or at most half as many as rows)
+# are matched via their distinct values instead of a trigram index.
+CATEGORICAL_MAX_UNIQUE = 4096
+_REGEX_METACHARS = set(".^$*+?{}[]\\|()")
+# Stop intersecting posting lists once this few candidates remain; verifying is cheaper
+_VERIFY_THRESHOLD = 256
+_BUILD_CHUNK_ROWS = 50_000
+
+
+def is_plain_ascii(value: str) -> bool:
+    """True if value is ASCII with no regex metacharacters, i.e. a literal substring query."""
+    return value.isascii() and "\x00" not in value and not any(ch in _REGEX_METACHARS for ch in value)
+
+
+def _trigram_codes(codepoints: np.ndarray) -> np.ndarray:
+    """Pack (..., L) ASCII code points into (..., L-2) 21-bit trigram codes."""
+    return (codepoints[..., :-2] << 14) | (codepoints[..., 1:-1] << 7) | codepoints[..., 2:]
+
+
+class _CategoricalColumn:
+    """Distinct stringified values plus the per-row code into them."""
+
+    def __init__(self, strings: pd.Series):
+        codes, uniques = pd.factorize(strings, sort=False)
+        self.codes = codes.astype(np.int32, copy=False)
+        self.uniques = [str(u) for u in uniques]
+
+    @classmethod
+    def from_typed(cls, series: pd.Series) -> "_CategoricalColumn":
+        """Reuse the codes of a categorical (or factorize a datetime) column without stringifying every row."""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Keep the categorical's own (int8 for small vocabularies) codes
+            codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            codes, uniques = pd.factorize(series, sort=False)
+            codes = codes.astype(np.int32, copy=False)
+        # Code -1 (missing) stringifies to NaN, which never matches, so it needs no entry
+        return cls.from_arrays(codes, [str(u) for u in pd.Series(uniques).astype(str)])
+
+    @classmethod
+    def from_arrays(cls, codes: np.ndarray, uniques: list) -> "_CategoricalColumn":
+        column = cls.__new__(cls)
+        column.codes = codes
+        column.uniques = uniques
+        return column
+
+    def search(self, pattern: "re.Pattern") -> np.ndarray:
+        matched = [i for i, u in enumerate(self.uniques) if pattern.search(u)]
+        if not matched:
+            return np.empty(0, dtype=np.int64)
+        # Lookup table over the codes; the extra last slot is what code -1 (missing) indexes
+        hit = np.zeros(len(self.uniques) + 1, dtype=bool)
+        hit[matched] = True
+        return np.flatnonzero(hit[self.codes])
+
+
+def _packed_postings(strings: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Sorted, de-duplicated (trigram << 32 | row) postings for the given ASCII rows."""
+    all_codes, all_rows = [], []
+    for start in range(0, len(rows), _BUILD_CHUNK_ROWS):
+        chunk = rows[start:start + _BUILD_CHUNK_ROWS]
+        lowered = np.array([strings[i].lower() for i in chunk], dtype=str)
+        width = lowered.dtype.itemsize // 4
+        if width < 3:
+            continue
+        cps = lowered.view(np.uint32).reshape(len(chunk), width).astype(np.int32)
+        codes = _trigram_codes(cps)
+        # Zero code points are padding past the end of shorter strings
+        valid = cps[:, 2:] != 0
+        all_codes.append(codes[valid])
+        all_rows.append(np.broadcast_to(chunk[:, None].astype(np.int32), codes.shape)[valid])
+    if not all_codes:
+        return np.empty(0, dtype=np.int64)
+    # One sort over (code, row) packed into int64 orders the postings and
+    # makes duplicate trigrams within a row adjacent
+    packed = np.concatenate(all_codes).astype(np.int64) << 32
+    packed |= np.concatenate(all_rows)
+    packed.sort()
+    keep = np.ones(len(packed), dtype=bool)
+    keep[1:] = packed[1:] != packed[:-1]
+    return packed[keep]
+
+
+class _TrigramColumn:
+    """Trigram posting lists over the lower-cased ASCII rows of a text column."""
+
+    def __init__(self, strings: pd.Series):
+        self.strings = strings.to_numpy(dtype=object)
+        ascii_rows, self.always_check = self._split_rows(self.strings, np.arange(len(self.strings)))
+        self._set_postings(_packed_postings(self.strings, ascii_rows))
+
+    @staticmethod
+    def _split_rows(strings: np.ndarray, rows: np.ndarray):
+        """
+        (ASCII rows, non-ASCII rows) among rows. Rows with non-ASCII text are always
+        verified with the regex, since lower() and re.IGNORECASE disagree on a handful
+        of Unicode characters. Missing values (NaN) are in neither and never match.
+        """
+        kind = np.fromiter((s.isascii() if isinstance(s, str) else -1 for s in strings[rows]), dtype=np.int8, count=len(rows))
+        return rows[kind == 1], rows[kind == 0].astype(np.int64)
+
+    def _set_postings(self, packed: np.ndarray) -> None:
+        if len(packed):
+            codes = (packed >> 32).astype(np.int32)
+            self.rows = (packed & 0xFFFFFFFF).astype(np.int32)
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            self.keys = codes[starts]
+            self.offsets = np.append(starts, len(codes)).astype(np.int64)
+        else:
+            self.keys = np.empty(0, dtype=np.int32)
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.rows = np.empty(0, dtype=np.int32)
+
+    def updated(self, strings: pd.Series, remap: np.ndarray, changed: np.ndarray) -> "_TrigramColumn":
+        """
+        A new column for an edited version of the text. remap maps each old row to
+        its new position (-1 if deleted or changed); changed lists the new rows
+        whose text is new. Unchanged rows keep their postings, only renumbered.
+        """
+        column = _TrigramColumn.__new__(_TrigramColumn)
+        column.strings = strings.to_numpy(dtype=object)
+        codes = np.repeat(np.asarray(self.keys, dtype=np.int64), np.diff(self.offsets))
+        rows = remap[self.rows]
+        kept = rows >= 0
+        old = (codes[kept] << 32) | rows[kept]
+        changed_ascii, changed_other = self._split_rows(column.strings, changed)
+        new = _packed_postings(column.strings, changed_ascii)
+        # Both runs are sorted when the file keeps its order, which a stable sort merges in linear time
+        packed = np.concatenate([old, new])
+        packed.sort(kind="stable")
+        column._set_postings(packed)
+        carried = remap[self.always_check]
+        column.always_check = np.union1d(carried[carried >= 0], changed_other).astype(np.int64)
+        return column
+
+    @classmethod
+    def from_arrays(cls, strings: pd.Series, keys: np.ndarray, offsets: np.ndarray,
+                    rows: np.ndarray, always_check: np.ndarray) -> "_TrigramColumn":
+        column = cls.__new__(cls)
+        column.strings = strings.to_numpy(dtype=object)
+        column.keys, column.offsets, column.rows, column.always_check = keys, offsets, rows, always_check
+        return column
+
+    def _posting(self, key: int) -> Optional[np.ndarray]:
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+    def candidates(self, value: str) -> Optional[np.ndarray]:
+        """Sorted candidate rows for a plain ASCII query of 3+ characters."""
+        cps = np.frombuffer(value.lower().encode("ascii"), dtype=np.uint8).astype(np.int32)
+        keys = np.unique(_trigram_codes(cps))
+        postings = []
+        for key in keys:
+            posting = self._posting(int(key))
+            if posting is None:
+                return np.empty(0, dtype=np.int64)
+            postings.append(posting)
+        postings.sort(key=len)
+        result = postings[0]
+        for posting in postings[1:]:
+            if len(result) <= _VERIFY_THRESHOLD:
+                break
+            idx = np.searchsorted(posting, result)
+            idx[idx == len(posting)] = 0
+            result = result[posting[idx] == result]
+        return result.astype(np.int64)
+
+    def search(self, value: str, pattern: "re.Pattern") -> np.ndarray:
+        if len(value) >= 3 and is_plain_ascii(value):
+            rows = self.candidates(value)
+            if len(self.always_check):
+                rows = np.union1d(rows, self.always_check)
+            strings = self.strings
+            return np.fromiter((i for i in rows if pattern.search(strings[i])), dtype=np.int64)
+        # Full scan; missing values never match, as with str.contains(na=False)
+        return np.fromiter((i for i, s in enumerate(self.strings) if isinstance(s, str) and pattern.search(s)),
+                           dtype=np.int64)
+
+
+class SubstringIndex:
+    """Per-column search structures for a controls DataFrame, built once at load time."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.num_rows = len(df)
+        self.columns: Dict[str, object] = {}
+        for col in df.columns:
+            self.columns[col] = self._build_column(df[col])
+
+    @staticmethod
+    def _build_column(series: pd.Series):
+        if isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(series.dtype):
+            return _CategoricalColumn.from_typed(series)
+        strings = series.astype(str)
+        n_unique = strings.nunique(dropna=False)
+        if n_unique <= CATEGORICAL_MAX_UNIQUE or n_unique * 2 <= len(strings):
+            return _CategoricalColumn(strings)
+        return _TrigramColumn(strings)
+
+    def updated(self, df: pd.DataFrame, remap: np.ndarray, changed: np.ndarray) -> "SubstringIndex":
+        """
+        Index for df, an edited version of the indexed frame (see _TrigramColumn.updated
+        for remap and changed). Trigram columns are patched; the cheap per-value
+        columns are rebuilt. self is left untouched for readers still using it.
+        """
+        index = SubstringIndex.__new__(SubstringIndex)
+        index.num_rows = len(df)
+        index.columns = {}
+        for col in df.columns:
+            entry = self.columns.get(col)
+            if isinstance(entry, _TrigramColumn) and pd.api.types.is_string_dtype(df[col].dtype):
+                index.columns[col] = entry.updated(df[col].astype(str), remap, changed)
+            else:
+                index.columns[col] = self._build_column(df[col])
+        return index
+
+    def save(self, directory: str) -> None:
+        """Persist the index as .npy arrays plus a JSON manifest (used by the library snapshot)."""
+        os.makedirs(directory, exist_ok=True)
+        manifest = {"num_rows": self.num_rows, "columns": []}
+        for i, (col, entry) in enumerate(self.columns.items()):
+            base = os.path.join(directory, f"i{i:03d}")
+            if isinstance(entry, _CategoricalColumn):
+                np.save(f"{base}.codes.npy", entry.codes)
+                with open(f"{base}.uniques.json", "w") as f:
+                    json.dump(entry.uniques, f)
+                manifest["columns"].append({"name": col, "kind": "categorical", "base": os.path.basename(base)})
+            else:
+                for part in ("keys", "offsets", "rows", "always_check"):
+                    np.save(f"{base}.{part}.npy", getattr(entry, part))
+                manifest["columns"].append({"name": col, "kind": "trigram", "base": os.path.basename(base)})
+        with open(os.path.join(directory, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def load(cls, directory: str, df: pd.DataFrame) -> "SubstringIndex":
+        """Open an index written by save() for the same DataFrame; posting lists are memory-mapped."""
+        with open(os.path.join(directory, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        if manifest["num_rows"] != len(df):
+            raise ValueError("Saved search index does not match the loaded controls.")
+        index = cls.__new__(cls)
+        index.num_rows = manifest["num_rows"]
+        index.columns = {}
+        for col in manifest["columns"]:
+            base = os.path.join(directory, col["base"])
+            if col["kind"] == "categorical":
+                with open(f"{base}.uniques.json", "r") as f:
+                    uniques = json.load(f)
+                index.columns[col["name"]] = _CategoricalColumn.from_arrays(np.load(f"{base}.codes.npy", mmap_mode="r"), uniques)
+            else:
+                parts = {part: np.load(f"{base}.{part}.npy", mmap_mode="r") for part in ("keys", "offsets", "rows", "always_check")}
+                index.columns[col["name"]] = _TrigramColumn.from_arrays(df[col["name"]].astype(str), **parts)
+        return index
+
+    def search(self, column: str, value) -> Optional[np.ndarray]:
+        """
+        Sorted row positions where the stringified column contains value
+        (case-insensitive regex search), or None if the index cannot answer exactly.
+        """
+        entry = self.columns.get(column)
+        if entry is None or not isinstance(value, str):
+            return None
+        # Same compilation pandas uses for str.contains(value, case=False)
+        pattern = re.compile(value, flags=re.IGNORECASE)
+        if isinstance(entry, _CategoricalColumn):
+            return entry.search(pattern)
+        return entry.search(value, pattern)
+
+
+class IdIndex:
+    """Hash index from stringified control_id to row position(s)."""
+
+    def __init__(self, ids: pd.Series):
+        keys = ids.astype(str).tolist()
+        self._positions: Dict[str, object] = dict(zip(keys, range(len(keys))))
+        if len(self._positions) != len(keys):
+            # Duplicate IDs map to every row that carries them
+            dup_mask = pd.Series(keys).duplicated(keep=False).to_numpy()
+            for pos in np.flatnonzero(dup_mask):
+                key = keys[pos]
+                existing = self._positions[key]
+                if isinstance(existing, list):
+                    existing.append(int(pos))
+                else:
+                    self._positions[key] = [int(pos)]
+            for key, value in self._positions.items():
+                if isinstance(value, list):
+                    value.sort()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def lookup(self, control_ids) -> np.ndarray:
+        """Sorted row positions for the given IDs; unknown IDs are ignored."""
+        found = []
+        for cid in {str(c) for c in control_ids}:
+            pos = self._positions.get(cid)
+            if pos is None:
+                continue
+            if isinstance(pos, list):
+                found.extend(pos)
+            else:
+                found.append(pos)
+        found.sort()
+        return np.asarray(found, dtype=np.int64)
@@ -0,0 +1,176 @@
+"""
+Compact, per-review-type rendering of controls for review prompts.
+
+Passing the control dict straight into {control} embeds its repr(): quotes,
+braces, snake_case keys and every one of the 18 attributes, even those a review
+type never looks at (next_test_date for a 5W review, the OE rating for a DE
+review). Here each review type declares the attributes it needs, and the
+control is rendered as short "Label: value" lines in a fixed order with empty
+values left out. Attributes outside the known schema are kept, since their
+relevance cannot be judged.
+
+count_tokens() estimates the tokens of a prompt locally, and token_meter keeps
+per-review-type totals of the tokens sent against what the repr() layout would
+have cost. Set REVIEW_CONTROL_FORMAT=raw to go back to the repr() layout.
+"""
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from . import tracing
+
+
+# "compact" (default) or "raw" (the control dict's repr(), as before)
+CONTROL_FORMAT = os.environ.get("REVIEW_CONTROL_FORMAT", "compact").lower()
+# Changes whenever the compact layout does, so cached reviews of an older layout are not reused
+COMPACT_LAYOUT_VERSION = 1
+
+FIELD_LABELS = {
+    "control_id": "ID",
+    "control_name": "Name",
+    "description": "Description",
+    "purpose": "Purpose",
+    "business_unit": "Business unit",
+    "risk_domain": "Risk domain",
+    "control_owner": "Owner",
+    "location": "Location",
+    "frequency": "Frequency",
+    "control_type": "Type",
+    "criticality": "Criticality",
+    "regulatory_reference": "Regulation",
+    "status": "Status",
+    "design_effectiveness_rating": "DE rating (1-5)",
+    "operational_effectiveness_rating": "OE rating (1-5)",
+    "last_test_date": "Last tested",
+    "next_test_date": "Next test due",
+    "remediation_plan": "Remediation plan",
+}
+
+# Attributes each review type needs, in the order they are rendered
+REVIEW_FIELDS: Dict[str, List[str]] = {
+    # Who, what, where, when and why the control operates
+    "5W": ["control_id", "control_name", "description", "purpose", "control_owner", "business_unit", "location",
+           "frequency", "control_type", "risk_domain", "regulatory_reference", "criticality"],
+    # How it runs in practice and how testing went
+    "OE": ["control_id", "control_name", "description", "control_owner", "business_unit", "frequency", "control_type",
+           "criticality", "status", "operational_effectiveness_rating", "last_test_date", "next_test_date",
+           "remediation_plan"],
+    # Whether it is designed to cover the risk and the regulation
+    "DE": ["control_id", "control_name", "description", "purpose", "control_type", "frequency", "risk_domain",
+           "regulatory_reference", "criticality", "design_effectiveness_rating", "remediation_plan"],
+}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# Word pieces as a BPE tokenizer tends to split them: letter runs, short digit groups, symbol runs
+_TOKEN_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]+")
+# Letters per token for long words; common short words are a single token
+_LETTERS_PER_TOKEN = 6
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def _format_value(value: Any) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return _WHITESPACE_RE.sub(" ", str(value)).strip()
+
+
+def review_fields(control: Dict[str, Any], review_type: Union[str, Sequence[str]]) -> List[str]:
+    """
+    The attributes of control rendered for review_type (or for several review types
+    at once): the declared fields, then any unknown ones.
+    """
+    declared: Dict[str, None] = {}
+    for rt in ([review_type] if isinstance(review_type, str) else review_type):
+        if rt not in REVIEW_FIELDS:
+            return list(control)
+        declared.update(dict.fromkeys(REVIEW_FIELDS[rt]))
+    # Fields of several review types are rendered in FIELD_LABELS order
+    ordered = sorted(declared, key=list(FIELD_LABELS).index) if not isinstance(review_type, str) else list(declared)
+    # schema imports pandas; token counting (memory, llm_clients) does not need it
+    from .schema import CONTROL_SCHEMA
+
+    return [f for f in ordered if f in control] + [f for f in control if f not in CONTROL_SCHEMA]
+
+
+def project_control(control: Dict[str, Any], review_type: Union[str, Sequence[str]]) -> Dict[str, Any]:
+    """The non-empty attributes of control that a review of review_type sees."""
+    return {f: control[f] for f in review_fields(control, review_type) if not _is_empty(control[f])}
+
+
+def serialize_control(control: Dict[str, Any], review_type: Union[str, Sequence[str]],
+                      control_format: Optional[str] = None) -> str:
+    """The text substituted for {control} in a review_type prompt."""
+    if (control_format or CONTROL_FORMAT) == "raw":
+        return str(control)
+    return "\n".join(f"{FIELD_LABELS.get(f, f)}: {_format_value(v)}"
+                     for f, v in project_control(control, review_type).items())
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimated tokens of text. Approximates a BPE tokenizer without needing one:
+    words count one token per started six letters, digits one per group of three,
+    and runs of symbols one per started pair; newlines count, other whitespace is free.
+    """
+    count = text.count("\n")
+    for piece in _TOKEN_RE.findall(text):
+        if piece[0].isalpha():
+            count += -(-len(piece) // _LETTERS_PER_TOKEN)
+        elif piece[0].isdigit():
+            count += 1
+        else:
+            count += -(-len(piece) // 2)
+    return count
+
+
+class TokenMeter:
+    """Per-review-type totals of estimated prompt tokens, against the repr() layout as baseline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, int]] = {}
+
+    def record(self, review_type: str, prompt_tokens: int, baseline_tokens: int) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(review_type, {"reviews": 0, "input_tokens": 0, "baseline_tokens": 0})
+            totals["reviews"] += 1
+            totals["input_tokens"] += prompt_tokens
+            totals["baseline_tokens"] += baseline_tokens
+        # Also in the Prometheus metrics (/metrics, TRACE_METRICS_PORT), so savings show without code
+        tracing.record_prompt_tokens(review_type, prompt_tokens, baseline_tokens)
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """{review_type: {reviews, input_tokens, tokens_per_review, baseline_tokens, saved_pct}}"""
+        with self._lock:
+            report = {}
+            for review_type, t in self._totals.items():
+                report[review_type] = {
+                    **t,
+                    "tokens_per_review": round(t["input_tokens"] / t["reviews"], 1),
+                    "saved_pct": round(100 * (1 - t["input_tokens"] / t["baseline_tokens"]), 1) if t["baseline_tokens"] else 0.0,
+                }
+            return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+token_meter = TokenMeter()
+
+
+def measure_prompt(template: str, control: Dict[str, Any], review_type: str) -> str:
+    """
+    Render control into template for review_type, record its estimated tokens in
+    token_meter and return the text for {control}.
+    """
+    text = serialize_control(control, review_type)
+    base = template.replace("{control}", "")
+    baseline = text if CONTROL_FORMAT == "raw" else str(control)
+    token_meter.record(review_type, count_tokens(base + text), count_tokens(base + baseline))
+    return text
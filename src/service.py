@@ -0,0 +1,357 @@
+"""
+Asyncio HTTP service hosting many concurrent agent sessions in one process.
+
+Each session (sessions.py) has its own history and prompt overrides. The
+control data, indexes, LLM client pool, review cache and result store are
+shared. Turns run on worker threads through AgentWrapper.astream(), so the
+event loop keeps serving other sessions while one waits for the model. At
+most SERVICE_MAX_CONCURRENT_TURNS turns run at once in the process; further
+ones wait for a slot.
+
+HTTP/1.1 with keep-alive on the standard library only (asyncio streams), JSON
+in and out:
+
+    POST   /sessions                       {"prompt_overrides": {"5W": "..."}}  -> 201 session info
+    GET    /sessions/<id>                  history size, turns, overrides, last result_ids
+    DELETE /sessions/<id>
+    POST   /sessions/<id>/turns            {"input": "...", "stream": false}
+                                           -> {"output": ..., "result_ids": [...]}
+                                           With "stream": true the turn's events (agent_events.py) are sent
+                                           as they happen, one JSON object per line (application/x-ndjson).
+    PUT    /sessions/<id>/prompts/<key>    {"template": "..."}, for this session only
+    DELETE /sessions/<id>/prompts/<key>    back to the global template
+    GET    /results/<result_id>            ?control_ids=a,b&review_types=5W,OE
+    GET    /health, /stats, /metrics       (Prometheus text, see tracing.py)
+
+Errors are {"error": message} with a 4xx/5xx status. A second turn on a session
+that is already at SERVICE_SESSION_CONCURRENCY turns gets a 429.
+
+Run from the project root:
+    python -m src.service [--host 127.0.0.1] [--port 8080] [--store memory|sqlite] [--no-warmup]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .agent import warmup
+from .sessions import SessionError, SessionManager, make_session_store
+from . import tracing
+
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", 8080))
+SERVICE_MAX_CONCURRENT_TURNS = int(os.environ.get("SERVICE_MAX_CONCURRENT_TURNS", 32))
+SERVICE_MAX_BODY_BYTES = int(os.environ.get("SERVICE_MAX_BODY_BYTES", 1024 * 1024))
+SERVICE_EVICT_INTERVAL_SECONDS = float(os.environ.get("SERVICE_EVICT_INTERVAL_SECONDS", 30))
+
+_REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large", 429: "Too Many Requests",
+            500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class _Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = [unquote(p) for p in parts.path.strip("/").split("/") if p]
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> Dict[str, Any]:
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError as e:
+            raise SessionError(400, f"Invalid JSON body: {e}")
+        if not isinstance(data, dict):
+            raise SessionError(400, "The JSON body must be an object")
+        return data
+
+    @property
+    def keep_alive(self) -> bool:
+        return self.headers.get("connection", "").lower() != "close"
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[_Request]:
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError:
+        raise SessionError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > SERVICE_MAX_BODY_BYTES:
+        raise SessionError(413, f"Request body over {SERVICE_MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return _Request(method.upper(), target, headers, body)
+
+
+def _head(status: int, content_type: str, keep_alive: bool, length: Optional[int]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", f"Content-Type: {content_type}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _respond(writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+    if status == 204:
+        body, content_type = b"", "application/json"
+    elif isinstance(payload, str):
+        body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+    else:
+        body, content_type = json.dumps(payload, default=str).encode("utf-8"), "application/json"
+    writer.write(_head(status, content_type, keep_alive, len(body)) + body)
+    await writer.drain()
+
+
+class AgentService:
+    """Routes HTTP requests to sessions and runs their turns; serve() listens on a TCP port."""
+
+    def __init__(self, manager: Optional[SessionManager] = None,
+                 max_concurrent_turns: int = SERVICE_MAX_CONCURRENT_TURNS):
+        self.manager = manager if manager is not None else SessionManager()
+        self.max_concurrent_turns = max_concurrent_turns
+        self._turn_slots = asyncio.Semaphore(max_concurrent_turns)
+        self._started = time.time()
+        self._stats = {"requests": 0, "turns": 0, "turn_errors": 0, "turn_seconds": 0.0}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._evictor: Optional[asyncio.Task] = None
+
+    # -- turns -----------------------------------------------------------------------------------
+
+    async def _events(self, session, text: str) -> AsyncIterator[Dict[str, Any]]:
+        """The events of one turn; the session's history is updated even if the consumer stops early."""
+        self.manager.begin_turn(session)
+        completed = False
+        start = time.perf_counter()
+        try:
+            async with self._turn_slots:
+                async for event in session.agent.astream(text):
+                    completed = completed or event["type"] == "final"
+                    yield event
+        except Exception:
+            self._stats["turn_errors"] += 1
+            raise
+        finally:
+            self._stats["turns"] += 1
+            self._stats["turn_seconds"] += time.perf_counter() - start
+            await self.manager.end_turn(session, completed)
+
+    async def _turn(self, session, request: _Request, writer: asyncio.StreamWriter) -> Optional[Tuple[int, Any]]:
+        data = request.json()
+        text = data.get("input")
+        if not isinstance(text, str) or not text.strip():
+            raise SessionError(400, '"input" must be a non-empty string')
+        events = self._events(session, text)
+        if not data.get("stream"):
+            final = None
+            async for event in events:
+                if event["type"] == "final":
+                    final = event
+            return 200, {"session_id": session.id, "output": final["output"], "result_ids": final["result_ids"]}
+
+        first = await events.__anext__()  # Errors before the first event still get a proper status
+        writer.write(_head(200, "application/x-ndjson", request.keep_alive, None))
+        connected = True
+        event = first
+        while True:
+            if connected:
+                chunk = (json.dumps(event, default=str) + "\n").encode("utf-8")
+                try:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                    await writer.drain()
+                except ConnectionError:
+                    # The turn still runs to the end so the session's history stays consistent
+                    connected = False
+            try:
+                event = await events.__anext__()
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                event = {"type": "error", "error": f"{type(e).__name__}: {e}"}
+                if connected:
+                    chunk = (json.dumps(event) + "\n").encode("utf-8")
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                break
+        if connected:
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        return None
+
+    # -- routing ---------------------------------------------------------------------------------
+
+    async def handle(self, request: _Request, writer: asyncio.StreamWriter) -> Optional[Tuple[int, Any]]:
+        """(status, payload) for request, or None if the response was already streamed."""
+        method, path = request.method, request.path
+        if path == ["health"] and method == "GET":
+            return 200, {"status": "ok", "uptime_seconds": round(time.time() - self._started, 1),
+                         "live_sessions": len(self.manager)}
+        if path == ["metrics"] and method == "GET":
+            return 200, tracing.metrics_text()
+        if path == ["stats"] and method == "GET":
+            from .llm_clients import llm_stats
+
+            stats = dict(self._stats, turn_seconds=round(self._stats["turn_seconds"], 3),
+                         max_concurrent_turns=self.max_concurrent_turns)
+            from .serialization import token_meter
+
+            return 200, {"service": stats, "sessions": self.manager.stats(), "llm": llm_stats(),
+                         "prompt_tokens": token_meter.report()}
+        if path == ["sessions"] and method == "POST":
+            overrides = request.json().get("prompt_overrides") or {}
+            self._check_overrides(overrides)
+            session = await self.manager.create(overrides)
+            return 201, session.info()
+        if len(path) >= 2 and path[0] == "sessions":
+            return await self._session_route(request, path[1], path[2:], writer)
+        if len(path) == 2 and path[0] == "results" and method == "GET":
+            return 200, await asyncio.to_thread(self._results, path[1], request.query)
+        raise SessionError(404 if method in ("GET", "POST", "PUT", "DELETE") else 405,
+                           f"No route for {method} /{'/'.join(path)}")
+
+    async def _session_route(self, request: _Request, session_id: str, rest: list,
+                             writer: asyncio.StreamWriter) -> Optional[Tuple[int, Any]]:
+        method = request.method
+        if not rest and method == "DELETE":
+            if not await self.manager.delete(session_id):
+                raise SessionError(404, f"Unknown session '{session_id}'")
+            return 204, None
+        session = await self.manager.get(session_id)
+        if not rest and method == "GET":
+            return 200, session.info()
+        if rest == ["turns"] and method == "POST":
+            return await self._turn(session, request, writer)
+        if len(rest) == 2 and rest[0] == "prompts" and method in ("PUT", "DELETE"):
+            key = rest[1]
+            if method == "PUT":
+                template = request.json().get("template")
+                self._check_overrides({key: template})
+                session.prompt_overrides[key] = template
+            else:
+                session.prompt_overrides.pop(key, None)
+            await self.manager.save(session)
+            return 200, session.info()
+        raise SessionError(404, f"No route for {method} /sessions/{session_id}/{'/'.join(rest)}")
+
+    @staticmethod
+    def _check_overrides(overrides: Any) -> None:
+        from .prompts import validate_template
+
+        if not isinstance(overrides, dict):
+            raise SessionError(400, '"prompt_overrides" must be an object of {prompt_key: template}')
+        for key, template in overrides.items():
+            if not isinstance(template, str):
+                raise SessionError(400, f"The template for '{key}' must be a string")
+            error = validate_template(key, template)
+            if error:
+                raise SessionError(400, f"Prompt '{key}': {error}")
+
+    @staticmethod
+    def _results(result_id: str, query: Dict[str, str]) -> Dict[str, Any]:
+        from .result_store import get_result_store
+
+        store = get_result_store()
+        if not store.exists(result_id):
+            raise SessionError(404, f"Unknown or expired result_id '{result_id}'")
+        split = lambda value: [v for v in value.split(",") if v] if value else None
+        return {"result_id": result_id,
+                "reviews": store.get(result_id, split(query.get("control_ids")), split(query.get("review_types")))}
+
+    # -- connections -----------------------------------------------------------------------------
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    self._stats["requests"] += 1
+                    keep_alive = request.keep_alive
+                    response = await self.handle(request, writer)
+                except SessionError as e:
+                    response = e.status, {"error": str(e)}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    response = 500, {"error": f"{type(e).__name__}: {e}"}
+                if response is not None:
+                    await _respond(writer, *response, keep_alive=keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _evict_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.manager.evict_idle()
+
+    async def start(self, host: str = SERVICE_HOST, port: int = SERVICE_PORT) -> asyncio.AbstractServer:
+        """Listen on host:port (0 picks a free port) and evict idle sessions in the background."""
+        self._server = await asyncio.start_server(self._connection, host, port)
+        self._evictor = asyncio.create_task(self._evict_loop(SERVICE_EVICT_INTERVAL_SECONDS))
+        return self._server
+
+    async def stop(self) -> None:
+        self._evictor.cancel()
+        self._server.close()
+        await self._server.wait_closed()
+
+
+async def serve(host: str = SERVICE_HOST, port: int = SERVICE_PORT, store: Optional[str] = None,
+                eager: bool = True) -> None:
+    if eager:
+        timings = await asyncio.to_thread(warmup)
+        print(f"Warmed up in {sum(timings.values()):.2f}s ({', '.join(f'{k} {v:.2f}s' for k, v in timings.items())})")
+    manager = SessionManager(make_session_store(store) if store else None)
+    service = AgentService(manager)
+    server = await service.start(host, port)
+    address = server.sockets[0].getsockname()
+    print(f"Serving on http://{address[0]}:{address[1]} ({service.max_concurrent_turns} concurrent turns, "
+          f"up to {manager.max_sessions} live sessions, {type(manager.store).__name__})")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--store", choices=["memory", "sqlite"], default=None, help="Session store (default SERVICE_SESSION_STORE)")
+    parser.add_argument("--no-warmup", action="store_true", help="Load the agent and data on the first request instead")
+    args = parser.parse_args()
+    try:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+    except ImportError:
+        pass
+    try:
+        asyncio.run(serve(args.host, args.port, args.store, eager=not args.no_warmup))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
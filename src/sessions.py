@@ -0,0 +1,292 @@
+"""
+Agent sessions for the HTTP service (service.py).
+
+A Session is one reviewer's conversation. It has its own AgentWrapper, so its
+own ConversationMemory, prompt overrides and last result_ids. Everything
+else is shared by all sessions of the process and only read by them:
+  - the AgentExecutor and tools;
+  - the control library and its indexes;
+  - the LLM clients with their connection pool and rate limits;
+  - the review cache and the result store.
+
+SessionManager keeps live sessions in memory. Their state is written to a
+pluggable SessionStore after every change:
+  - MemorySessionStore: the default, lost on restart;
+  - SqliteSessionStore: SERVICE_SESSION_STORE=sqlite, under .cache/;
+  - any other SessionStore subclass implementing load/save/delete/count.
+A session idle for SERVICE_SESSION_IDLE_SECONDS, or the least recently used one
+beyond SERVICE_MAX_SESSIONS, is dropped from memory. It is restored from the
+store on its next request. Each session runs at most SERVICE_SESSION_CONCURRENCY
+turns at a time.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .agent import AgentWrapper
+from .config import cache_path
+from .memory import ConversationMemory
+
+SERVICE_SESSION_STORE = os.environ.get("SERVICE_SESSION_STORE", "memory").lower()
+SERVICE_SESSION_STORE_PATH = os.environ.get("SERVICE_SESSION_STORE_PATH") or cache_path("sessions.sqlite")
+# Stored sessions not used for this long are deleted (sqlite store); 0 keeps them
+SERVICE_SESSION_TTL_SECONDS = float(os.environ.get("SERVICE_SESSION_TTL_SECONDS", 7 * 24 * 3600))
+SERVICE_MAX_STORED_SESSIONS = int(os.environ.get("SERVICE_MAX_STORED_SESSIONS", 10000))
+SERVICE_MAX_SESSIONS = int(os.environ.get("SERVICE_MAX_SESSIONS", 200))
+SERVICE_SESSION_IDLE_SECONDS = float(os.environ.get("SERVICE_SESSION_IDLE_SECONDS", 900))
+SERVICE_SESSION_CONCURRENCY = int(os.environ.get("SERVICE_SESSION_CONCURRENCY", 1))
+
+
+class SessionError(Exception):
+    """A session request that cannot be served; status is the HTTP status to answer with."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class SessionStore(ABC):
+    """Where session state (plain JSON-serializable dicts) is kept between requests and restarts."""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The saved state of session_id, or None if there is none (or it expired)."""
+
+    @abstractmethod
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        """Store state as the latest state of session_id."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Forget session_id; True if it was stored."""
+
+    @abstractmethod
+    def count(self) -> int:
+        """How many sessions are stored."""
+
+
+class MemorySessionStore(SessionStore):
+    """Session state in a dict, least recently saved dropped beyond max_entries. Lost on restart."""
+
+    def __init__(self, max_entries: int = SERVICE_MAX_STORED_SESSIONS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._states: "OrderedDict[str, str]" = OrderedDict()
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            raw = self._states.get(session_id)
+        # Stored as JSON so that a restored session never shares objects with a live one
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        raw = json.dumps(state)
+        with self._lock:
+            self._states[session_id] = raw
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._states.pop(session_id, None) is not None
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._states)
+
+
+class SqliteSessionStore(SessionStore):
+    """Session state in SQLite, so sessions survive restarts and can be shared by processes on one host."""
+
+    def __init__(self, path: str = SERVICE_SESSION_STORE_PATH, ttl_seconds: float = SERVICE_SESSION_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._saves_since_trim = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None or (self.ttl_seconds > 0 and time.time() - row[1] > self.ttl_seconds):
+            return None
+        return json.loads(row[0])
+
+    def save(self, session_id: str, state: Dict[str, Any]) -> None:
+        raw = json.dumps(state)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                               (session_id, raw, now))
+            self._saves_since_trim += 1
+            if self._saves_since_trim >= 100 and self.ttl_seconds > 0:
+                self._saves_since_trim = 0
+                self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_seconds,))
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount > 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def make_session_store(kind: str = SERVICE_SESSION_STORE) -> SessionStore:
+    """The SessionStore for SERVICE_SESSION_STORE: "memory" or "sqlite"."""
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SqliteSessionStore()
+    raise ValueError(f"Unknown session store '{kind}' (expected 'memory' or 'sqlite')")
+
+
+class Session:
+    """One reviewer's conversation: an AgentWrapper with its own memory and prompt overrides."""
+
+    def __init__(self, session_id: str, prompt_overrides: Optional[Dict[str, str]] = None,
+                 memory: Optional[ConversationMemory] = None, created_at: Optional[float] = None,
+                 turns: int = 0, last_result_ids: Optional[List[str]] = None):
+        self.id = session_id
+        # The shared executor; only the memory and prompt overrides are per session
+        self.agent = AgentWrapper(prompt_overrides=dict(prompt_overrides or {}))
+        if memory is not None:
+            self.agent.memory = memory
+        self.agent.last_result_ids = list(last_result_ids or [])
+        self.created_at = created_at or time.time()
+        self.last_used = time.monotonic()
+        self.turns = turns
+        self.active = 0  # Turns in progress
+        self.deleted = False  # Set by SessionManager.delete; a turn still running must not save it back
+
+    @property
+    def prompt_overrides(self) -> Dict[str, str]:
+        return self.agent.prompt_overrides
+
+    def state(self) -> Dict[str, Any]:
+        return {"session_id": self.id, "created_at": self.created_at, "turns": self.turns,
+                "prompt_overrides": dict(self.prompt_overrides), "last_result_ids": list(self.agent.last_result_ids),
+                "memory": self.agent.memory.to_dict()}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "Session":
+        return cls(state["session_id"], state.get("prompt_overrides"), ConversationMemory.from_dict(state["memory"]),
+                   state.get("created_at"), state.get("turns", 0), state.get("last_result_ids"))
+
+    def info(self) -> Dict[str, Any]:
+        return {"session_id": self.id, "created_at": self.created_at, "turns": self.turns, "active_turns": self.active,
+                "idle_seconds": round(time.monotonic() - self.last_used, 1),
+                "prompt_overrides": sorted(self.prompt_overrides), "last_result_ids": list(self.agent.last_result_ids),
+                "memory": self.agent.memory.stats()}
+
+
+class SessionManager:
+    """Live sessions by id, backed by a SessionStore, with idle eviction and per-session turn limits."""
+
+    def __init__(self, store: Optional[SessionStore] = None, max_sessions: int = SERVICE_MAX_SESSIONS,
+                 idle_seconds: float = SERVICE_SESSION_IDLE_SECONDS,
+                 session_concurrency: int = SERVICE_SESSION_CONCURRENCY):
+        self.store = store if store is not None else make_session_store()
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.session_concurrency = session_concurrency
+        self._live: "OrderedDict[str, Session]" = OrderedDict()  # Least recently used first
+        self._restore_lock = asyncio.Lock()
+        self._stats = {"created": 0, "restored": 0, "evicted": 0, "deleted": 0, "rejected_turns": 0}
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    async def save(self, session: Session) -> None:
+        if session.deleted:
+            return
+        await asyncio.to_thread(self.store.save, session.id, session.state())
+
+    def _admit(self, session: Session) -> None:
+        self._live[session.id] = session
+        self._live.move_to_end(session.id)
+        # Make room by dropping the least recently used idle sessions; their state is in the store
+        for sid in [sid for sid, s in self._live.items() if s.active == 0 and sid != session.id]:
+            if len(self._live) <= self.max_sessions:
+                break
+            del self._live[sid]
+            self._stats["evicted"] += 1
+        if len(self._live) > self.max_sessions:
+            del self._live[session.id]
+            raise SessionError(503, f"All {self.max_sessions} sessions are busy; try again shortly")
+
+    async def create(self, prompt_overrides: Optional[Dict[str, str]] = None) -> Session:
+        session = Session(f"s-{uuid.uuid4().hex[:12]}", prompt_overrides)
+        self._admit(session)
+        self._stats["created"] += 1
+        await self.save(session)
+        return session
+
+    async def get(self, session_id: str) -> Session:
+        session = self._live.get(session_id)
+        if session is None:
+            async with self._restore_lock:
+                session = self._live.get(session_id)
+                if session is None:
+                    state = await asyncio.to_thread(self.store.load, session_id)
+                    if state is None:
+                        raise SessionError(404, f"Unknown session '{session_id}'")
+                    session = Session.from_state(state)
+                    self._stats["restored"] += 1
+                    self._admit(session)
+        self._live.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    async def delete(self, session_id: str) -> bool:
+        live = self._live.pop(session_id, None)
+        if live is not None:
+            live.deleted = True
+        stored = await asyncio.to_thread(self.store.delete, session_id)
+        if live is not None or stored:
+            self._stats["deleted"] += 1
+            return True
+        return False
+
+    def begin_turn(self, session: Session) -> None:
+        """Count a turn in progress, or raise SessionError(429) if the session is at its limit."""
+        if session.active >= self.session_concurrency:
+            self._stats["rejected_turns"] += 1
+            raise SessionError(429, f"Session '{session.id}' already has {session.active} turn(s) in progress")
+        session.active += 1
+
+    async def end_turn(self, session: Session, completed: bool) -> None:
+        session.active -= 1
+        session.last_used = time.monotonic()
+        if completed:
+            session.turns += 1
+        await self.save(session)
+
+    def evict_idle(self) -> int:
+        """Drop sessions idle for longer than idle_seconds from memory; returns how many."""
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [sid for sid, s in self._live.items() if s.active == 0 and s.last_used < cutoff]
+        for sid in idle:
+            del self._live[sid]
+        self._stats["evicted"] += len(idle)
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats.update({"live": len(self._live), "stored": self.store.count(),
+                      "active_turns": sum(s.active for s in self._live.values()),
+                      "max_sessions": self.max_sessions, "idle_seconds": self.idle_seconds,
+                      "session_concurrency": self.session_concurrency})
+        return stats
@@ -0,0 +1,251 @@
+"""
+Local similarity search over control text.
+
+Backs the SimilarControls tool. Each control's description, purpose and
+remediation plan are tokenized, hashed into a fixed number of features (so
+there is no vocabulary to store) and weighted with sublinear TF-IDF, giving one
+L2-normalized sparse vector per control.
+
+The vectors are stored column-wise (feature -> rows, weights), the same layout as
+an inverted index, as .npy files under .cache/similarity/ that are
+memory-mapped on load. Cosine scores for a query vector are then a single
+np.bincount over the postings of its features. On large libraries (from
+SIMILARITY_PRUNE_MIN_ROWS controls) features that appear in more than
+SIMILARITY_MAX_DF of all controls are skipped at query time: they carry little
+weight but would touch nearly every row.
+
+Everything runs locally; the index is rebuilt automatically when the text of the
+library changes.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .config import cache_path
+from .data_loader import Library, _records_at, current_library, match_positions
+
+SIMILARITY_FIELDS = ("description", "purpose", "remediation_plan")
+# Number of hashed features (a power of two); collisions are rare at this size
+SIMILARITY_FEATURES = 1 << int(os.environ.get("SIMILARITY_FEATURE_BITS", 20))
+SIMILARITY_MAX_DF = float(os.environ.get("SIMILARITY_MAX_DF", 0.5))
+# Below this many controls scoring every feature is already fast, so cosines are exact
+SIMILARITY_PRUNE_MIN_ROWS = int(os.environ.get("SIMILARITY_PRUNE_MIN_ROWS", 100_000))
+SIMILARITY_FORMAT_VERSION = 1
+_BUILD_CHUNK_ROWS = 100_000
+_TOKEN_PATTERN = r"[a-z0-9]+"
+_TOKEN_RE = re.compile(_TOKEN_PATTERN)
+_INDEX_DIR_RE = re.compile(r"[0-9a-f]{20}(\.tmp-\d+)?")  # _library_key() names, and save()'s temporaries
+# Fields included with each similar control besides its score
+RESULT_FIELDS = ["control_id", "control_name", "business_unit", "risk_domain"]
+
+
+def _hash_tokens(tokens) -> np.ndarray:
+    # crc32 is stable across processes, unlike hash()
+    return np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.int64, count=len(tokens)) % SIMILARITY_FEATURES
+
+
+def _library_text(df: pd.DataFrame) -> pd.Series:
+    fields = [f for f in SIMILARITY_FIELDS if f in df.columns]
+    if not fields:
+        return pd.Series([""] * len(df), index=df.index)
+    text = df[fields[0]].astype(object).fillna("").astype(str)
+    for field in fields[1:]:
+        text = text + " " + df[field].astype(object).fillna("").astype(str)
+    return text
+
+
+def _library_key(df: pd.DataFrame) -> str:
+    """Content hash of the indexed text, so the stored index is reused only for the same library."""
+    fields = [f for f in ("control_id",) + SIMILARITY_FIELDS if f in df.columns]
+    h = hashlib.sha1(json.dumps([SIMILARITY_FORMAT_VERSION, SIMILARITY_FEATURES, len(df), fields]).encode("utf-8"))
+    if fields and len(df):
+        h.update(pd.util.hash_pandas_object(df[fields].astype(object), index=False).to_numpy().tobytes())
+    return h.hexdigest()[:20]
+
+
+def _term_counts(text: pd.Series, row_offset: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(rows, features, counts) for one chunk of documents, one entry per distinct (row, feature)."""
+    tokens = text.str.lower().str.findall(_TOKEN_PATTERN).explode().dropna()
+    if tokens.empty:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    codes, uniques = pd.factorize(tokens.to_numpy())
+    features = _hash_tokens(uniques)[codes]
+    rows = tokens.index.to_numpy().astype(np.int64) + row_offset
+    packed, counts = np.unique(rows * SIMILARITY_FEATURES + features, return_counts=True)
+    return packed // SIMILARITY_FEATURES, packed % SIMILARITY_FEATURES, counts
+
+
+class SimilarityIndex:
+    """Hashed TF-IDF vectors of a library, stored feature-major for cosine scoring."""
+
+    def __init__(self, num_rows: int, idf: np.ndarray, doc_freq: np.ndarray, offsets: np.ndarray,
+                 rows: np.ndarray, weights: np.ndarray):
+        self.num_rows = num_rows
+        self.idf, self.doc_freq = idf, doc_freq
+        self.offsets, self.rows, self.weights = offsets, rows, weights
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> "SimilarityIndex":
+        n = len(df)
+        text = _library_text(df).reset_index(drop=True)
+        parts = [_term_counts(text.iloc[start:start + _BUILD_CHUNK_ROWS].reset_index(drop=True), start)
+                 for start in range(0, n, _BUILD_CHUNK_ROWS)]
+        rows = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+        features = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+        counts = np.concatenate([p[2] for p in parts]) if parts else np.empty(0, dtype=np.int64)
+
+        doc_freq = np.bincount(features, minlength=SIMILARITY_FEATURES).astype(np.int32)
+        idf = (np.log((1 + n) / (1 + doc_freq)) + 1).astype(np.float32)
+        weights = (1 + np.log(counts)).astype(np.float32) * idf[features]
+        norms = np.sqrt(np.bincount(rows, weights=weights.astype(np.float64) ** 2, minlength=n))
+        norms[norms == 0] = 1
+        weights /= norms[rows].astype(np.float32)
+
+        # Feature-major order: postings of each feature are contiguous and sorted by row
+        order = np.lexsort((rows, features))
+        offsets = np.zeros(SIMILARITY_FEATURES + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=offsets[1:])
+        return cls(n, idf, doc_freq, offsets, rows[order].astype(np.int32), weights[order])
+
+    _ARRAYS = ("idf", "doc_freq", "offsets", "rows", "weights")
+
+    def save(self, directory: str) -> None:
+        tmp = f"{directory}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in self._ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"format_version": SIMILARITY_FORMAT_VERSION, "num_rows": self.num_rows,
+                       "features": SIMILARITY_FEATURES}, f)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp, directory)
+
+    @classmethod
+    def load(cls, directory: str) -> "SimilarityIndex":
+        with open(os.path.join(directory, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        if manifest["format_version"] != SIMILARITY_FORMAT_VERSION or manifest["features"] != SIMILARITY_FEATURES:
+            raise ValueError("Stored similarity index was built with different settings.")
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in cls._ARRAYS}
+        return cls(manifest["num_rows"], **arrays)
+
+    def vectorize(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(features, weights) of text, weighted and normalized like the stored vectors."""
+        tokens = _TOKEN_RE.findall(text.lower())
+        if not tokens:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        features, counts = np.unique(_hash_tokens(tokens), return_counts=True)
+        weights = (1 + np.log(counts)).astype(np.float32) * self.idf[features]
+        norm = np.sqrt(float(np.dot(weights, weights)))
+        return features, weights / norm if norm else weights
+
+    def scores(self, features: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query vector against every control."""
+        if self.num_rows >= SIMILARITY_PRUNE_MIN_ROWS:
+            keep = self.doc_freq[features] <= SIMILARITY_MAX_DF * self.num_rows
+            if keep.any():
+                features, weights = features[keep], weights[keep]
+        starts, ends = self.offsets[features], self.offsets[features + 1]
+        rows = np.concatenate([self.rows[s:e] for s, e in zip(starts, ends)]) if len(features) else np.empty(0, dtype=np.int32)
+        contrib = np.concatenate([self.weights[s:e] * w for s, e, w in zip(starts, ends, weights)]) if len(features) else np.empty(0)
+        return np.bincount(rows, weights=contrib, minlength=self.num_rows)
+
+
+def _remove_stale_indexes(current: str) -> None:
+    """Remove indexes of earlier library versions: entries named like ours and older than current."""
+    parent, name = os.path.split(current)
+    newest = os.stat(current).st_mtime
+    for entry in os.listdir(parent):
+        path = os.path.join(parent, entry)
+        if entry == name or not _INDEX_DIR_RE.fullmatch(entry) or not os.path.isdir(path):
+            continue
+        try:
+            if os.stat(path).st_mtime < newest:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass  # Removed by another process meanwhile
+
+
+_index: Optional[SimilarityIndex] = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index(library: Optional[Library] = None) -> SimilarityIndex:
+    """The index for the loaded library: opened from .cache/similarity/ or built and stored there."""
+    global _index, _index_version
+    library = library or current_library()
+    version = library.version
+    if _index is not None and _index_version == version:
+        return _index
+    with _index_lock:
+        if _index is not None and _index_version == version:
+            return _index
+        df = library.df
+        directory = cache_path("similarity", _library_key(df))
+        index = None
+        if os.path.exists(os.path.join(directory, "manifest.json")):
+            try:
+                index = SimilarityIndex.load(directory)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: could not open similarity index ({e}). Rebuilding it.")
+        if index is None or index.num_rows != len(df):
+            index = SimilarityIndex.build(df)
+            try:
+                index.save(directory)
+                _remove_stale_indexes(directory)
+            except OSError as e:
+                print(f"Warning: could not store similarity index ({e}). It will be rebuilt next time.")
+        _index, _index_version = index, version
+        return index
+
+
+def similar_controls(control_id: Optional[str] = None, text: Optional[str] = None, k: int = 10,
+                     selection: Optional[Dict[str, Any]] = None,
+                     fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    The k controls most similar to control_id (or to free text), optionally only
+    among the controls picked by selection (match_positions() keyword arguments).
+    """
+    library = current_library()
+    index = get_similarity_index(library)
+    df = library.df
+    exclude = None
+    if control_id is not None:
+        positions = match_positions(control_ids=[control_id], library=library)
+        if len(positions) == 0:
+            return {"error": f"Control '{control_id}' not found."}
+        exclude = positions
+        text = _library_text(df.iloc[positions[:1]]).iloc[0]
+    if not text or not text.strip():
+        return {"error": "Provide a 'control_id' or a non-empty 'text' to compare against."}
+
+    features, weights = index.vectorize(text)
+    scores = index.scores(features, weights)
+    candidates = match_positions(**selection, library=library) if selection else np.arange(index.num_rows)
+    if exclude is not None:
+        candidates = np.setdiff1d(candidates, exclude, assume_unique=True)
+    compared = len(candidates)
+    candidate_scores = scores[candidates]
+    # Controls sharing no term with the query are not similar, whatever k asks for
+    related = candidate_scores > 0
+    candidates, candidate_scores = candidates[related], candidate_scores[related]
+    k = min(k, len(candidates))
+    if k == 0:
+        return {"query": control_id or text, "candidates": int(compared), "similar": []}
+    top = np.argpartition(-candidate_scores, k - 1)[:k]
+    top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+    records = _records_at(candidates[top], fields or RESULT_FIELDS, library.columns)
+    for record, score in zip(records, candidate_scores[top]):
+        record["score"] = round(float(score), 3)
+    return {"query": control_id or text, "candidates": int(compared), "similar": records}
@@ -0,0 +1,259 @@
+"""
+Columnar binary snapshot of the control library.
+
+Parsing controls.json with json.load and building a DataFrame is the dominant
+startup cost. The snapshot stores each column of the typed library (schema.py)
+as a NumPy array that can be memory-mapped: numeric and date columns as-is,
+categoricals as their codes plus the category list, and text columns as int32
+codes into a per-column string table. Opening it is a handful of np.load calls
+plus one vectorized take per text column. The FilterControls search index is saved
+alongside, so it does not have to be rebuilt either.
+
+A pointer file records the source file's size, mtime and SHA-256. Size and
+mtime are checked first; if they differ, the content hash decides whether the
+snapshot is still valid or needs to be rebuilt.
+
+Build or refresh explicitly from the project root:
+    python -m src.snapshot build [path/to/controls.json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .config import cache_path
+from .search_index import SubstringIndex
+from .streaming import load_controls_chunked
+
+SNAPSHOT_FORMAT_VERSION = 2
+
+
+def _snapshot_root() -> str:
+    return os.path.dirname(cache_path("snapshots", "_"))
+
+
+def _pointer_path(source_path: str) -> str:
+    # One pointer per source file so several libraries can be snapshotted side by side
+    key = hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(_snapshot_root(), f"{key}.json")
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_fingerprint(path: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": sha256 or file_sha256(path)}
+
+
+def _read_pointer(source_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_pointer_path(source_path), "r") as f:
+            pointer = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if pointer.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return pointer
+
+
+def _write_json_atomic(path: str, payload: Dict[str, Any]) -> None:
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def write_snapshot(df: pd.DataFrame, source_path: str, fingerprint: Dict[str, Any],
+                   index: Optional[SubstringIndex] = None) -> str:
+    """Write df (and its search index) as a columnar snapshot for source_path and point the source at it."""
+    data_dir = os.path.join(_snapshot_root(), f"{os.path.basename(_pointer_path(source_path))[:-5]}-{fingerprint['sha256'][:16]}")
+    tmp_dir = f"{data_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        base = f"c{i:03d}"
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, f"{base}.npy"), series.cat.codes.to_numpy())
+            with open(os.path.join(tmp_dir, f"{base}.strings.json"), "w") as f:
+                json.dump([_jsonable(u) for u in series.cat.categories.tolist()], f)
+            columns.append({"name": col, "kind": "categorical", "file": f"{base}.npy", "strings": f"{base}.strings.json"})
+        elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+            # NaT is stored as its int64 sentinel and survives the round trip
+            np.save(os.path.join(tmp_dir, f"{base}.npy"), series.to_numpy().view(np.int64))
+            columns.append({"name": col, "kind": "datetime", "file": f"{base}.npy", "dtype": str(series.dtype)})
+        elif pd.api.types.is_extension_array_dtype(series.dtype) and pd.api.types.is_integer_dtype(series.dtype):
+            np.save(os.path.join(tmp_dir, f"{base}.npy"), series.to_numpy(dtype=series.dtype.numpy_dtype, na_value=0))
+            np.save(os.path.join(tmp_dir, f"{base}.mask.npy"), series.isna().to_numpy())
+            columns.append({"name": col, "kind": "nullable_int", "file": f"{base}.npy", "mask": f"{base}.mask.npy",
+                            "dtype": str(series.dtype)})
+        elif pd.api.types.is_bool_dtype(series.dtype) or (pd.api.types.is_numeric_dtype(series.dtype)
+                                                       and not isinstance(series.dtype, pd.CategoricalDtype)
+                                                       and not pd.api.types.is_extension_array_dtype(series.dtype)):
+            np.save(os.path.join(tmp_dir, f"{base}.npy"), series.to_numpy())
+            columns.append({"name": col, "kind": "numeric", "file": f"{base}.npy"})
+        else:
+            # Dictionary-encode everything else; -1 marks missing values
+            codes, uniques = pd.factorize(series)
+            np.save(os.path.join(tmp_dir, f"{base}.codes.npy"), codes.astype(np.int32, copy=False))
+            with open(os.path.join(tmp_dir, f"{base}.strings.json"), "w") as f:
+                json.dump([_jsonable(u) for u in uniques.tolist()], f)
+            columns.append({"name": col, "kind": "dictionary", "file": f"{base}.codes.npy",
+                            "strings": f"{base}.strings.json", "has_missing": bool((codes < 0).any())})
+
+    if index is not None:
+        index.save(os.path.join(tmp_dir, "index"))
+
+    manifest = {"format_version": SNAPSHOT_FORMAT_VERSION, "num_rows": len(df), "columns": columns}
+    with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+    shutil.rmtree(data_dir, ignore_errors=True)
+    os.replace(tmp_dir, data_dir)
+
+    previous = _read_pointer(source_path)
+    _write_json_atomic(_pointer_path(source_path), {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "source": os.path.abspath(source_path),
+        "fingerprint": fingerprint,
+        "data_dir": os.path.basename(data_dir),
+        "built_at": time.time(),
+    })
+    if previous and previous.get("data_dir") != os.path.basename(data_dir):
+        shutil.rmtree(os.path.join(_snapshot_root(), previous["data_dir"]), ignore_errors=True)
+    return data_dir
+
+
+def _jsonable(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def read_snapshot(data_dir: str) -> pd.DataFrame:
+    """Open a snapshot directory as a DataFrame. Numeric columns stay memory-mapped."""
+    with open(os.path.join(data_dir, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    data = {}
+    for col in manifest["columns"]:
+        values = np.load(os.path.join(data_dir, col["file"]), mmap_mode="r")
+        if col["kind"] == "categorical":
+            with open(os.path.join(data_dir, col["strings"]), "r") as f:
+                categories = json.load(f)
+            values = pd.Categorical.from_codes(np.asarray(values), categories=categories)
+        elif col["kind"] == "datetime":
+            values = np.asarray(values).view(col["dtype"])
+        elif col["kind"] == "nullable_int":
+            mask = np.load(os.path.join(data_dir, col["mask"]))
+            values = pd.arrays.IntegerArray(np.array(values), mask)
+        elif col["kind"] == "dictionary":
+            with open(os.path.join(data_dir, col["strings"]), "r") as f:
+                strings = json.load(f)
+            table = np.empty(len(strings) + 1, dtype=object)
+            table[:-1] = strings
+            table[-1] = np.nan  # code -1 indexes the last slot
+            values = table[values]
+        data[col["name"]] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def snapshot_is_current(source_path: str) -> Optional[str]:
+    """Return the snapshot data dir if it matches source_path's current contents, else None."""
+    pointer = _read_pointer(source_path)
+    if pointer is None:
+        return None
+    data_dir = os.path.join(_snapshot_root(), pointer["data_dir"])
+    if not os.path.exists(os.path.join(data_dir, "manifest.json")):
+        return None
+    st = os.stat(source_path)
+    recorded = pointer["fingerprint"]
+    if st.st_size == recorded["size"] and st.st_mtime_ns == recorded["mtime_ns"]:
+        return data_dir
+    if st.st_size != recorded["size"]:
+        return None
+    # Same size, different mtime (e.g. touched or re-copied): let the content decide
+    if file_sha256(source_path) != recorded["sha256"]:
+        return None
+    pointer["fingerprint"] = source_fingerprint(source_path, sha256=recorded["sha256"])
+    _write_json_atomic(_pointer_path(source_path), pointer)
+    return data_dir
+
+
+def load_json_controls(source_path: str) -> pd.DataFrame:
+    """The typed library in source_path (a JSON array or JSON Lines), parsed incrementally."""
+    df = load_controls_chunked(source_path)
+    if df.empty:
+        print(f"Warning: {source_path} is empty or not a valid list of controls. DataFrame is empty.")
+    return df
+
+
+def build_snapshot(source_path: str) -> Tuple[pd.DataFrame, Optional[SubstringIndex]]:
+    """Parse source_path, build its search index, (re)write the snapshot and return both."""
+    fingerprint = source_fingerprint(source_path)
+    df = load_json_controls(source_path)
+    if df.empty:
+        return df, None
+    index = SubstringIndex(df)
+    write_snapshot(df, source_path, fingerprint, index)
+    return df, index
+
+
+def load_library(source_path: str) -> Tuple[pd.DataFrame, Optional[SubstringIndex]]:
+    """
+    Load the library and its search index, from the snapshot when it is current and
+    otherwise from JSON (rebuilding the snapshot on the way). The index is None
+    if it could not be restored; the caller builds it then.
+    """
+    try:
+        data_dir = snapshot_is_current(source_path)
+        if data_dir is not None:
+            df = read_snapshot(data_dir)
+            index = None
+            if os.path.exists(os.path.join(data_dir, "index", "manifest.json")):
+                index = SubstringIndex.load(os.path.join(data_dir, "index"), df)
+            return df, index
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: could not open control library snapshot ({e}). Rebuilding from {source_path}.")
+    try:
+        return build_snapshot(source_path)
+    except OSError as e:
+        # Read-only cache directory and the like: still serve the data
+        print(f"Warning: could not write control library snapshot ({e}). Loading JSON directly.")
+        return load_json_controls(source_path), None
+
+
+def main():
+    from .data_loader import CONTROLS_PATH
+
+    parser = argparse.ArgumentParser(description="Build the columnar snapshot of the control library.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Rebuild the snapshot unconditionally")
+    p_build.add_argument("source", nargs="?", default=CONTROLS_PATH)
+    p_check = sub.add_parser("check", help="Report whether the snapshot matches the source")
+    p_check.add_argument("source", nargs="?", default=CONTROLS_PATH)
+    args = parser.parse_args()
+
+    if args.command == "check":
+        data_dir = snapshot_is_current(args.source)
+        print(f"Snapshot current: {data_dir}" if data_dir else "Snapshot missing or stale.")
+        return
+    start = time.perf_counter()
+    df, _ = build_snapshot(args.source)
+    print(f"Snapshot of {len(df):,} controls built in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Incremental parsing of control library exports.
+
+json.load needs the whole file as text and then the full graph of Python dicts
+in memory before pandas sees a single row, which roughly triples peak memory.
+Here the top-level JSON array is decoded one record at a time from a buffered
+read (JSON Lines files, one control per line, are accepted as well). Records
+are gathered into chunks of CONTROLS_CHUNK_ROWS, each chunk is turned into a
+typed frame (schema.py), and the typed chunks are combined column by column. At
+any point only one chunk of Python dicts is alive.
+"""
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .schema import CONTROL_SCHEMA, apply_schema, native_values
+
+# Records per typed chunk; bounds the number of Python dicts alive while loading
+CONTROLS_CHUNK_ROWS = int(os.environ.get("CONTROLS_CHUNK_ROWS", 50_000))
+_READ_CHARS = 1 << 20
+_WHITESPACE = " \t\n\r"
+_DELIMITER = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+
+def _is_json_lines(path: str) -> bool:
+    """A file is read as JSON Lines unless its first non-blank character opens an array."""
+    with open(path, "r", encoding="utf-8") as f:
+        while True:
+            block = f.read(4096)
+            if not block:
+                return False
+            stripped = block.lstrip(_WHITESPACE + "\ufeff")
+            if stripped:
+                return not stripped.startswith("[")
+
+
+def _iter_json_lines(path: str) -> Iterator[Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _iter_json_array(path: str, read_chars: int = _READ_CHARS) -> Iterator[Any]:
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, eof = "", 0, False
+
+        def skip_whitespace():
+            # Returns the next significant character, reading more input as needed
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos] in _WHITESPACE:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos] if pos < len(buf) else ""
+                more = f.read(read_chars)
+                buf, pos, eof = buf[pos:] + more, 0, not more
+
+        char = skip_whitespace()
+        if char == "\ufeff":
+            pos += 1
+            char = skip_whitespace()
+        if char != "[":
+            raise json.JSONDecodeError("Expecting '['", buf, pos)
+        pos += 1
+        if skip_whitespace() == "]":
+            return
+        while True:
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # The value may continue past the buffer: read more and decode again
+                more = f.read(read_chars)
+                buf, pos, eof = buf[pos:] + more, 0, not more
+            yield value
+            # Fast path: the delimiter and the start of the next value are already buffered
+            match = _DELIMITER.match(buf, end)
+            if match and match.group(1) == "," and match.end() < len(buf):
+                pos = match.end()
+                continue
+            pos = end
+            char = skip_whitespace()
+            if char == "]":
+                return
+            if char != ",":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, pos)
+            pos += 1
+            skip_whitespace()
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the controls in path one at a time (JSON array or JSON Lines)."""
+    records = _iter_json_lines(path) if _is_json_lines(path) else _iter_json_array(path)
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError(f"Control #{i} in {path} is not a JSON object.")
+        yield record
+
+
+def iter_typed_chunks(path: str, chunk_rows: int = CONTROLS_CHUNK_ROWS,
+                      seen: Optional[Dict[str, None]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield the controls in path as typed frames of up to chunk_rows rows. Every chunk
+    has the schema columns and all columns seen in earlier chunks, so filters and
+    queries behave the same in every chunk. If given, seen is filled with the
+    columns that actually occur in the records, in order of first appearance.
+    """
+    seen = {} if seen is None else seen
+    chunk: List[Dict[str, Any]] = []
+
+    def frame():
+        df = pd.DataFrame(chunk)
+        seen.update(dict.fromkeys(df.columns))
+        columns = list(seen) + [c for c in CONTROL_SCHEMA if c not in seen]
+        return apply_schema(df.reindex(columns=columns))
+
+    for record in iter_records(path):
+        chunk.append(record)
+        if len(chunk) >= chunk_rows:
+            yield frame()
+            chunk = []
+    if chunk:
+        yield frame()
+
+
+def _combine_column(parts: List[Optional[pd.Series]], lengths: List[int]) -> pd.Series:
+    """One column from its per-chunk parts (None where a chunk did not have the column)."""
+    present = [p for p in parts if p is not None]
+    if all(isinstance(p.dtype, pd.CategoricalDtype) for p in present):
+        categories = pd.Index(np.concatenate([p.cat.categories.to_numpy(dtype=object) for p in present])).unique()
+        try:
+            categories = categories.sort_values()
+        except TypeError:
+            pass # mixed types keep order of appearance
+        codes = np.concatenate([p.cat.set_categories(categories).cat.codes.to_numpy() if p is not None
+                                else np.full(n, -1, dtype=np.int8) for p, n in zip(parts, lengths)])
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=pd.CategoricalDtype(categories)))
+    if all(pd.api.types.is_datetime64_any_dtype(p.dtype) for p in present):
+        values = [p.to_numpy() if p is not None else np.full(n, np.datetime64("NaT"), dtype=present[0].dtype)
+                  for p, n in zip(parts, lengths)]
+        return pd.Series(np.concatenate(values))
+    if all(str(p.dtype) in ("int8", "Int8") for p in present):
+        values = pd.array(np.concatenate([p.to_numpy(dtype="float64", na_value=np.nan) if p is not None else np.full(n, np.nan)
+                                          for p, n in zip(parts, lengths)]), dtype="Int8")
+        return pd.Series(values).astype(np.int8) if not values.isna().any() else pd.Series(values)
+    # Typed in some chunks only: decode those back to plain values and let pandas
+    # infer the dtype, as pd.DataFrame(records) would
+    values = np.empty(sum(lengths), dtype=object)
+    start = 0
+    for p, n in zip(parts, lengths):
+        values[start:start + n] = native_values(p) if p is not None else np.nan
+        start += n
+    return pd.Series(values)
+
+
+def load_controls_chunked(path: str, chunk_rows: int = CONTROLS_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    The typed library in path, parsed incrementally. Equal to
+    apply_schema(pd.DataFrame(json.load(f))) but without materializing every record.
+    A schema column is only typed if it could be typed in every chunk.
+    """
+    seen: Dict[str, None] = {}
+    chunks = list(iter_typed_chunks(path, chunk_rows, seen))
+    if not chunks:
+        return pd.DataFrame()
+    columns = list(seen)
+    lengths = [len(ch) for ch in chunks]
+    combined = {}
+    for col in columns:
+        parts = [ch[col] if col in ch.columns else None for ch in chunks]
+        combined[col] = _combine_column(parts, lengths)
+        for ch in chunks:
+            # Release each chunk's copy as soon as the column is assembled
+            ch.drop(columns=col, inplace=True, errors="ignore")
+    return apply_schema(pd.DataFrame(combined, copy=False))
@@ -1,93 +1,407 @@
-from langchain.tools import Tool, tool
-from langchain.chains import LLMChain
-from langchain_anthropic import ChatAnthropic
-from .data_loader import filter_controls as actual_filter_controls
+from langchain_core.tools import Tool, tool
+from .data_loader import current_library, match_positions
+from . import paging
+from . import aggregations
+from . import similarity
+from . import dedup
+from .query import QueryError
 from . import prompts
+from . import serialization
+from .review_engine import run_reviews, DEFAULT_MAX_CONCURRENCY
+from . import fused_review
+from .review_cache import get_review_cache, make_review_key
+from . import campaigns
+from . import result_store
+from .agent_events import review_progress
+from . import tracing
 import os
 import json
+import threading
+from functools import lru_cache
 
-# Claude client setup - now configurable via environment variables
-ANTHROPIC_API_KEY = os.environ.get("ANTHROPIC_API_KEY")
-MODEL_NAME = os.environ.get("ANTHROPIC_MODEL_NAME", "claude-3-haiku-20240307")
-TEMPERATURE = float(os.environ.get("ANTHROPIC_TEMPERATURE", 0.2))
-MAX_TOKENS = int(os.environ.get("ANTHROPIC_MAX_TOKENS", 4096))
+# Claude client: shared with the agent through the registry in llm_clients.py (ANTHROPIC_* settings,
+# rate limits, retries). The settings are re-exported here for existing imports.
+from .llm_clients import ANTHROPIC_API_KEY, MODEL_NAME, TEMPERATURE, MAX_TOKENS, get_llm
+# Set REVIEW_FUSED=1 to make fused calls the default for BatchReviewControls
+REVIEW_FUSED_DEFAULT = os.environ.get("REVIEW_FUSED", "0").lower() in ("1", "true", "yes")
+# Estimated tokens a FetchReviewResults response may spend on review text
+FETCH_RESULT_TOKEN_BUDGET = int(os.environ.get("FETCH_RESULT_TOKEN_BUDGET", 3000))
 
-if not ANTHROPIC_API_KEY:
-    print("Warning: ANTHROPIC_API_KEY not found in environment. LLM calls will likely fail.")
+# Review chains by key, with their prompt attribute and span name. They are built on first use by
+# analysis_chains(), so loading the tools needs neither langchain.chains nor an LLM client.
+_CHAIN_PROMPTS = {
+    "5W": ("prompt_5w", "review_5W"),
+    "OE": ("prompt_oe", "review_OE"),
+    "DE": ("prompt_de", "review_DE"),
+    "METHODS": ("prompt_methods", "review_methods"), # Though unlikely to be updated often
+    "FUSED": ("prompt_fused", "review_fused"),
+}
+_chains = None
+_chains_lock = threading.Lock()
 
-llm = ChatAnthropic(
-    api_key=ANTHROPIC_API_KEY, 
-    model=MODEL_NAME, 
-    temperature=TEMPERATURE, 
-    max_tokens=MAX_TOKENS
-)
+def analysis_chains() -> dict:
+    """
+    The LLMChains for analyses, keyed like prompts.INITIAL_PROMPTS, built on first use with
+    the shared client. Their .prompt attribute is updated by the UpdatePromptTool.
+    """
+    global _chains
+    if _chains is None:
+        with _chains_lock:
+            if _chains is None:
+                from langchain.chains import LLMChain
+
+                llm = get_llm()
+                _chains = {key: LLMChain(llm=llm, prompt=getattr(prompts, attr), name=name)
+                           for key, (attr, name) in _CHAIN_PROMPTS.items()}
+    return _chains
+
+def _chain(key: str):
+    """The chain for key, using the current session's prompt override if it has one (see prompts.prompt_overrides)."""
+    overrides = prompts.active_overrides()
+    template = overrides.get(key) if overrides else None
+    if template is None:
+        return analysis_chains()[key]
+    return _override_chain(key, template)
 
-# Chains for analyses - using prompts from the prompts module
-# These chains will have their .prompt attribute updated by the UpdatePromptTool
-chain_5w = LLMChain(llm=llm, prompt=prompts.prompt_5w)
-chain_oe = LLMChain(llm=llm, prompt=prompts.prompt_oe)
-chain_de = LLMChain(llm=llm, prompt=prompts.prompt_de)
-chain_methods = LLMChain(llm=llm, prompt=prompts.prompt_methods)
-
-# Store chains in a dictionary to easily access them by key in the update tool
-ANALYSIS_CHAINS = {
-    "5W": chain_5w,
-    "OE": chain_oe,
-    "DE": chain_de,
-    "METHODS": chain_methods # Though unlikely to be updated often
+@lru_cache(maxsize=256)
+def _override_chain(key: str, template: str):
+    from langchain.chains import LLMChain
+
+    shared = analysis_chains()[key]
+    return LLMChain(llm=shared.llm, prompt=prompts.PromptTemplate.from_template(template), name=shared.name)
+
+# Module attributes from before the chains were built lazily: tools.llm, tools.chain_5w, tools.ANALYSIS_CHAINS, ...
+_LAZY_ATTRIBUTES = {
+    "llm": get_llm,
+    "ANALYSIS_CHAINS": analysis_chains,
+    **{f"chain_{key.lower()}": (lambda key=key: analysis_chains()[key]) for key in _CHAIN_PROMPTS},
 }
 
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 # Wrapper function for the FilterControls tool
 def filter_controls_tool_func(input_str: str) -> list[dict[str, any]]:
     try:
         # Attempt to parse the input as JSON
         data = json.loads(input_str)
+        options = {}
+        if isinstance(data, dict):
+            # Result-shaping options (fields, limit, cursor, count_only) sit next to the filters
+            data = dict(data)
+            options = {key: data.pop(key) for key in paging.RESULT_OPTIONS if key in data}
+            error = paging.validate_options(options)
+            if error:
+                return [{"error": error}]
+            if options.get("cursor"):
+                page = paging.cursor_page(options["cursor"], limit=options.get("limit"))
+                return [page] if "error" in page else page
+        if isinstance(data, dict) and 'query' in data:
+            # Structured query, optionally narrowed further by control_id or attribute filters
+            query = data.pop('query')
+            if not isinstance(query, str):
+                return [{"error": "'query' must be a string, e.g. \"oe_rating <= 2 AND risk_domain IN ('AML', 'Fraud')\"."}]
+            raw_ids = data.pop('control_id', None)
+            if isinstance(raw_ids, str):
+                raw_ids = [raw_ids]
+            if raw_ids is not None and not (isinstance(raw_ids, list) and all(isinstance(item, str) for item in raw_ids)):
+                return [{"error": "Invalid format for 'control_id' value in JSON input. Must be a string or list of strings."}]
+            try:
+                return _filter_result(options, control_ids=raw_ids, filters=data or None, query=query)
+            except QueryError as e:
+                return [{"error": f"Invalid query: {e}"}]
         if isinstance(data, dict):
             if 'control_id' in data:
                 raw_ids = data['control_id']
                 if isinstance(raw_ids, str):
-                    return actual_filter_controls(control_ids=[raw_ids])
+                    return _filter_result(options, control_ids=[raw_ids])
                 elif isinstance(raw_ids, list):
                     # Ensure all items in the list are strings
                     if all(isinstance(item, str) for item in raw_ids):
-                        return actual_filter_controls(control_ids=raw_ids)
+                        return _filter_result(options, control_ids=raw_ids)
                     else:
                         return [{"error": "Invalid item type in control_id list. All IDs must be strings."}]
                 else:
                     return [{"error": "Invalid format for 'control_id' value in JSON input. Must be a string or list of strings."}]
             else:
                 # Assume it's a filters dictionary
-                return actual_filter_controls(filters=data)
+                return _filter_result(options, filters=data)
         # If LLM provides a list of strings directly (e.g. ["ID1", "ID2"])
         elif isinstance(data, list) and all(isinstance(item, str) for item in data):
-             return actual_filter_controls(control_ids=data)
+             return _filter_result(options, control_ids=data)
         else:
             return [{"error": f"Parsed JSON input is not a dictionary of filters, a dictionary with 'control_id', or a list of ID strings: {input_str}"}]
     except json.JSONDecodeError:
         # Not a JSON string, assume it's a single control_id string directly
-        return actual_filter_controls(control_ids=[input_str])
+        return _filter_result({}, control_ids=[input_str])
     except Exception as e:
         # Catch any other unexpected errors during parsing or filtering
         return [{"error": f"Error processing filter input: {str(e)}"}]
 
+def _filter_result(options: dict, control_ids=None, filters=None, query=None):
+    # Large results come back as a summary with a cursor instead of every record
+    library = current_library()
+    positions = match_positions(control_ids=control_ids, filters=filters, query=query, library=library)
+    return paging.result_page(positions, fields=options.get("fields"), limit=options.get("limit"),
+                              count_only=options.get("count_only", False), columns=library.columns)
+
 # Tool: Filter controls
 filter_tool = Tool(
     name="FilterControls",
     func=filter_controls_tool_func, # Use the new wrapper function
-    description='Filter controls by any attribute (e.g. {"category": "Access Control"}) or by control_id (e.g. "ACC-001" or {"control_id": "ACC-001"} or {"control_id": ["ACC-001", "ACC-002"]}). Returns a list of matching control objects.'
+    description='Filter controls by any attribute (e.g. {"category": "Access Control"}) or by control_id (e.g. "ACC-001" or {"control_id": "ACC-001"} or {"control_id": ["ACC-001", "ACC-002"]}). Returns a list of matching control objects. '
+                'For comparisons, ranges and boolean logic pass a structured query instead, e.g. '
+                '{"query": "oe_rating <= 2 AND next_test_date < 2025-06-01 AND risk_domain IN (\'AML\', \'Fraud\')"}. '
+                'Queries support =, !=, <, <=, >, >=, IN (...), BETWEEN x AND y, CONTAINS, IS [NOT] NULL, NOT, AND, OR, '
+                'parentheses and dates like 2025-06-01 or today - 30d (units d, w, m, y). Text comparisons are case-insensitive. '
+                'Add "fields": [...] to return only some attributes, "count_only": true to get just the number of matches, '
+                'or "limit": N for a page of N. Large results are returned as a summary with total_matched, the first page '
+                'and a next_cursor; pass {"cursor": "<next_cursor>"} to get the following page.'
+)
+
+# Aggregation tool: counts, rating statistics and cross-tabs computed on the library itself
+def aggregate_controls_tool_func(input_str: str) -> dict:
+    try:
+        tool_input = json.loads(input_str) if input_str and input_str.strip() else {}
+    except json.JSONDecodeError:
+        return {"error": f"Invalid JSON input to AggregateControls: {input_str}"}
+    if not isinstance(tool_input, dict):
+        return {"error": "Input must be a JSON object."}
+
+    selection = {}
+    raw_ids = tool_input.get('control_ids', tool_input.get('control_id'))
+    if isinstance(raw_ids, str):
+        raw_ids = [raw_ids]
+    if raw_ids:
+        selection["control_ids"] = [str(cid) for cid in raw_ids]
+    if isinstance(tool_input.get('filters'), dict) and tool_input['filters']:
+        selection["filters"] = tool_input['filters']
+    if tool_input.get('query'):
+        selection["query"] = tool_input['query']
+
+    group_by = tool_input.get('group_by') or []
+    metrics = tool_input.get('metrics') or ["count"]
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    if isinstance(metrics, str):
+        metrics = [metrics]
+    top = tool_input.get('top', aggregations.DEFAULT_TOP)
+    if isinstance(top, bool) or not isinstance(top, int) or top < 1:
+        return {"error": "'top' must be a positive integer."}
+    try:
+        return aggregations.aggregate(selection, group_by=group_by, metrics=metrics, pivot=tool_input.get('pivot'),
+                                      value=tool_input.get('value', "count"), as_of=tool_input.get('as_of'), top=top)
+    except (aggregations.AggregationError, QueryError) as e:
+        return {"error": str(e)}
+    except Exception as e:
+        return {"error": f"Error aggregating controls: {e}"}
+
+aggregate_tool = Tool(
+    name="AggregateControls",
+    func=aggregate_controls_tool_func,
+    description=(
+        "Compute statistics over the control library instead of pulling records: counts, mean DE/OE ratings, "
+        "rating distributions, overdue tests (next_test_date before 'as_of', default today) and cross-tabs. "
+        "Args: JSON with optional 'group_by' (field or list; date fields accept ':month', ':quarter' or ':year', "
+        "e.g. 'next_test_date:quarter'), 'metrics' (any of count, mean_ratings, rating_distribution, overdue; default count), "
+        "'pivot' (field for cross-tab columns, with 'value' = count, overdue or a numeric field to average), "
+        "a selection via 'filters' (FilterControls-style dict), 'query' (FilterControls query string) or 'control_ids', "
+        "'as_of' (YYYY-MM-DD) and 'top' (max rows, default 50). "
+        'Example: {"group_by": "business_unit", "metrics": ["count", "mean_ratings", "overdue"], "query": "status = active"}. '
+        "Returns a compact table: columns, rows, total_rows and matched_controls."
+    )
+)
+
+# Similarity tool: nearest controls by description/purpose/remediation text
+def similar_controls_tool_func(input_str: str) -> dict:
+    try:
+        tool_input = json.loads(input_str)
+    except json.JSONDecodeError:
+        # A bare control ID
+        tool_input = {"control_id": input_str.strip().strip('"')}
+    if isinstance(tool_input, str):
+        tool_input = {"control_id": tool_input}
+    if not isinstance(tool_input, dict):
+        return {"error": "Input must be a control_id string or a JSON object."}
+
+    k = tool_input.get('k', 10)
+    if isinstance(k, bool) or not isinstance(k, int) or k < 1:
+        return {"error": "'k' must be a positive integer."}
+    fields = tool_input.get('fields')
+    if fields is not None and not (isinstance(fields, list) and all(isinstance(f, str) for f in fields)):
+        return {"error": "'fields' must be a list of attribute names."}
+    selection = {}
+    if isinstance(tool_input.get('filters'), dict) and tool_input['filters']:
+        selection["filters"] = tool_input['filters']
+    if tool_input.get('query'):
+        selection["query"] = tool_input['query']
+    try:
+        return similarity.similar_controls(control_id=tool_input.get('control_id'), text=tool_input.get('text'),
+                                           k=min(k, 100), selection=selection or None, fields=fields)
+    except QueryError as e:
+        return {"error": f"Invalid query: {e}"}
+    except Exception as e:
+        return {"error": f"Error finding similar controls: {e}"}
+
+similar_tool = Tool(
+    name="SimilarControls",
+    func=similar_controls_tool_func,
+    description=(
+        "Find the controls whose description, purpose and remediation plan are most similar (TF-IDF cosine) "
+        "to a given control or to free text. Args: a control_id string, or JSON with 'control_id' or 'text', "
+        "optional 'k' (default 10, max 100), optional pre-filters 'filters' (FilterControls-style dict) or "
+        "'query' (FilterControls query string), and optional 'fields' to return. "
+        "Returns the similar controls with a 'score' between 0 and 1."
+    )
+)
+
+# Near-duplicate detection tool (MinHash/LSH over the control text)
+def find_duplicates_tool_func(input_str: str) -> dict:
+    try:
+        tool_input = json.loads(input_str) if input_str and input_str.strip() else {}
+    except json.JSONDecodeError:
+        return {"error": f"Invalid JSON input to FindDuplicateControls: {input_str}"}
+    if not isinstance(tool_input, dict):
+        return {"error": "Input must be a JSON object."}
+
+    threshold = tool_input.get('threshold', dedup.DEDUP_DEFAULT_THRESHOLD)
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 < threshold <= 1:
+        return {"error": "'threshold' must be a number between 0 and 1."}
+    max_clusters = tool_input.get('max_clusters', 20)
+    if isinstance(max_clusters, bool) or not isinstance(max_clusters, int) or max_clusters < 1:
+        return {"error": "'max_clusters' must be a positive integer."}
+    selection = {}
+    if isinstance(tool_input.get('filters'), dict) and tool_input['filters']:
+        selection["filters"] = tool_input['filters']
+    if tool_input.get('query'):
+        selection["query"] = tool_input['query']
+    try:
+        return dedup.find_duplicates(selection or None, threshold=float(threshold),
+                                     control_id=tool_input.get('control_id'), max_clusters=max_clusters)
+    except QueryError as e:
+        return {"error": f"Invalid query: {e}"}
+    except Exception as e:
+        return {"error": f"Error finding duplicate controls: {e}"}
+
+duplicates_tool = Tool(
+    name="FindDuplicateControls",
+    func=find_duplicates_tool_func,
+    description=(
+        "Find clusters of near-duplicate controls (similar name, description, purpose and remediation text) "
+        "using MinHash/LSH. Args: JSON with optional 'threshold' (estimated Jaccard similarity, default 0.8), "
+        "'control_id' (only the cluster containing that control), 'filters' (FilterControls-style dict) or "
+        "'query' (FilterControls query string) to restrict the controls compared, and 'max_clusters' (default 20). "
+        "Returns clusters largest first, each with control_ids and similarity scores."
+    )
 )
 
 # Single-review helper
-def single_review(control: dict, review_type: str) -> str:
+def _run_review_chain(control_text: str, review_type: str) -> str:
     if review_type == "5W":
-        # The chain_5w.prompt is now updated by UpdatePromptTool
-        return chain_5w.run(control=control)
+        # The 5W chain's prompt is updated by UpdatePromptTool
+        return _chain("5W").run(control=control_text)
     if review_type == "OE":
-        return chain_oe.run(control=control)
+        return _chain("OE").run(control=control_text)
     if review_type == "DE":
-        return chain_de.run(control=control)
+        return _chain("DE").run(control=control_text)
     raise ValueError(f"Unknown review type: {review_type}")
 
+def _review_key(control: dict, review_type: str) -> str:
+    # Key on everything that determines the output, including the live prompt template. With the
+    # compact layout that is only the projected control, so edits to unused attributes keep their hits.
+    template = _chain(review_type).prompt.template
+    if serialization.CONTROL_FORMAT == "raw":
+        return make_review_key(control, review_type, template, MODEL_NAME, TEMPERATURE, MAX_TOKENS)
+    return make_review_key(serialization.project_control(control, review_type), review_type, template,
+                           MODEL_NAME, TEMPERATURE, MAX_TOKENS, layout=f"compact-v{serialization.COMPACT_LAYOUT_VERSION}")
+
+def _fused_review_key(control_id: str, review_type: str, prompt_text: str) -> str:
+    # A fused review depends on the whole prompt it came from: every review's instructions, the union
+    # of fields rendered for the control and the other controls of the group
+    return make_review_key({"control_id": control_id, "prompt": prompt_text}, review_type, "FUSED",
+                           MODEL_NAME, TEMPERATURE, MAX_TOKENS, layout="fused-prompt-v1")
+
+def single_review(control: dict, review_type: str) -> str:
+    if review_type not in ("5W", "OE", "DE"):
+        raise ValueError(f"Unknown review type: {review_type}")
+    template = _chain(review_type).prompt.template
+    cache = get_review_cache()
+    if cache is None:
+        return _run_review_chain(serialization.measure_prompt(template, control, review_type), review_type)
+
+    key = _review_key(control, review_type)
+    cached = cache.get(key)
+    tracing.record_cache_lookup(cached is not None)
+    if cached is not None:
+        return cached
+    # Only the attributes this review type uses go into the prompt, in a compact layout
+    text = _run_review_chain(serialization.measure_prompt(template, control, review_type), review_type)
+    cache.put(key, review_type, text)
+    return text
+
+def fused_review_group(items: list) -> dict:
+    """
+    Review a group of (control_id, control, review_types) items in one LLM call (see
+    fused_review.py). Pairs already in the review cache, from a single review or from
+    a fused call with the same prompt, are answered from it and left out of the call.
+    """
+    cache = get_review_cache()
+    templates = {rt: _chain(rt).prompt.template for rt in ("5W", "OE", "DE")}
+
+    def _prompt(group):
+        inputs = fused_review.fused_prompt_inputs(group, templates, serialization.serialize_control)
+        return inputs, _chain("FUSED").prompt.format(**inputs)
+
+    def _without(group, found):
+        # The items of group with the reviews in found taken out
+        rest = [(cid, control, [rt for rt in types if rt not in found.get(cid, {})]) for cid, control, types in group]
+        return [item for item in rest if item[2]]
+
+    results, remaining = {}, items
+    if cache is not None:
+        # Single reviews first; the fused prompt is then built from what is left, as it would be sent.
+        # Each pair counts as one cache lookup, whichever key answers it.
+        for cid, control, types in items:
+            for rt in types:
+                cached = cache.get(_review_key(control, rt), record_miss=False)
+                if cached is not None:
+                    results.setdefault(cid, {})[rt] = cached
+                    tracing.record_cache_lookup(True)
+        remaining = _without(items, results)
+        if remaining:
+            _, prompt_text = _prompt(remaining)
+            fused_hits = {}
+            for cid, _, types in remaining:
+                for rt in types:
+                    cached = cache.get(_fused_review_key(cid, rt, prompt_text))
+                    tracing.record_cache_lookup(cached is not None)
+                    if cached is not None:
+                        fused_hits.setdefault(cid, {})[rt] = cached
+            for cid, reviews in fused_hits.items():
+                results.setdefault(cid, {}).update(reviews)
+            remaining = _without(remaining, fused_hits)
+    if not remaining:
+        return results
+
+    inputs, prompt_text = _prompt(remaining)
+    baseline = sum(serialization.count_tokens(templates[rt].replace("{control}", str(control)))
+                   for _, control, types in remaining for rt in types)
+    serialization.token_meter.record("FUSED", serialization.count_tokens(prompt_text), baseline)
+    response = _chain("FUSED").run(**inputs)
+
+    parsed = fused_review.parse_fused_response(response, list(templates))
+    for cid, control, types in remaining:
+        for rt in types:
+            text = parsed.get(cid, {}).get(rt)
+            if text is None:
+                continue
+            results.setdefault(cid, {})[rt] = text
+            if cache is not None:
+                cache.put(_fused_review_key(cid, rt, prompt_text), rt, text)
+    return results
+
 # Batch-review tool with 10-control cap
 def batch_review_func(tool_input_str: str) -> dict[str, dict[str, str]]:
     try:
@@ -109,29 +423,176 @@ def batch_review_func(tool_input_str: str) -> dict[str, dict[str, str]]:
     if len(controls) > 10:
         # Returning a dict that can be JSON serialized, instead of raising ValueError directly
         # The agent should be able to handle this error response.
-        return {"error": "Can only review up to 10 controls at a time."}
+        return {"error": "Can only review up to 10 controls at a time. Use StartReviewCampaign for larger selections."}
+    # Results are keyed and stored by str(control_id), so 1 and "1" would be the same control
+    seen_ids = [str(c.get("control_id", "<no-id>")) for c in controls if isinstance(c, dict)]
+    repeated = sorted({cid for cid in seen_ids if seen_ids.count(cid) > 1})
+    if repeated:
+        return {"error": f"Each control must have a distinct control_id; repeated: {repeated}."}
     
-    results = {}
-    for c in controls:
-        if not isinstance(c, dict):
-            results[str(c)] = {"error": "Each item in 'controls' must be a dictionary."}
-            continue
-        cid = c.get("control_id", "<no-id>")
-        results[cid] = {r: single_review(c, r) for r in review_types}
-    return results
+    max_concurrency = tool_input.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)
+    # bool is an int subclass; JSON true/false is not a concurrency
+    if isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int) or max_concurrency < 1:
+        return {"error": "'max_concurrency' must be a positive integer."}
+
+    fused = tool_input.get('fused', REVIEW_FUSED_DEFAULT)
+    if not isinstance(fused, bool):
+        return {"error": "'fused' must be true or false."}
+    full_text = tool_input.get('full_text', False)
+    if not isinstance(full_text, bool):
+        return {"error": "'full_text' must be true or false."}
+    # Per-pair completion events for streamed agent turns
+    on_result = review_progress(sum(isinstance(c, dict) for c in controls) * len(review_types))
+    if fused:
+        group_size = tool_input.get('fuse_controls', fused_review.REVIEW_FUSED_GROUP_SIZE)
+        if isinstance(group_size, bool) or not isinstance(group_size, int) or not 1 <= group_size <= fused_review.MAX_FUSED_GROUP_SIZE:
+            return {"error": f"'fuse_controls' must be an integer from 1 to {fused_review.MAX_FUSED_GROUP_SIZE}."}
+        # All requested review types of a control (or a few controls) in one call; missing parts are re-asked
+        results = fused_review.run_fused_reviews(controls, review_types, fused_review_group, single_review,
+                                                 group_size=group_size, max_concurrency=max_concurrency,
+                                                 on_result=on_result)
+    else:
+        # Pairs run concurrently; a failing review is reported in its own slot
+        results = run_reviews(controls, review_types, single_review, max_concurrency=max_concurrency,
+                              on_result=on_result)
+    if full_text:
+        return results
+    # The agent gets a result_id and digests; the full texts go to the user from the result store
+    return result_store.store_results(results)
 
 review_tool = Tool(
     name="BatchReviewControls",
     func=batch_review_func, # Renamed internal function to avoid conflict with tool name
     description=(
         "Run 5W, OE, DE reviews on up to 10 controls. "
-        "Args: Expects a single JSON string or dictionary with two keys: 'controls' (list of control objects) and 'review_types' (list of strings, e.g. ['5W','OE','DE'])."
+        "Args: Expects a single JSON string or dictionary with two keys: 'controls' (list of control objects) and 'review_types' (list of strings, e.g. ['5W','OE','DE']). "
+        "Optional 'max_concurrency' (int) limits how many reviews run in parallel. "
+        "Optional 'fused': true asks for all review types of a control in a single call (fewer calls and tokens), "
+        "and 'fuse_controls' (1-3, default 2) reviews that many controls per call. "
+        "Returns a 'result_id' and a short digest per review; the full reviews are shown to the user directly, "
+        "so summarize from the digests instead of restating them. 'full_text': true returns the full reviews inline."
+    )
+)
+
+def fetch_review_results_func(tool_input_str: str) -> dict:
+    try:
+        tool_input = json.loads(tool_input_str)
+    except json.JSONDecodeError:
+        # A bare result_id
+        tool_input = {"result_id": tool_input_str.strip().strip('"')}
+    if not isinstance(tool_input, dict) or not tool_input.get('result_id'):
+        return {"error": "Provide 'result_id' (from BatchReviewControls)."}
+
+    result_id = str(tool_input['result_id'])
+    selectors = {}
+    for key, single in (('control_ids', 'control_id'), ('review_types', 'review_type')):
+        value = tool_input.get(key, tool_input.get(single))
+        if isinstance(value, str):
+            value = [value]
+        if value is not None and not isinstance(value, list):
+            return {"error": f"'{key}' must be a list of strings."}
+        selectors[key] = value
+
+    store = result_store.get_result_store()
+    if not store.exists(result_id):
+        return {"error": f"Unknown or expired result_id '{result_id}'."}
+    # Whole reviews only, up to the token budget; the rest is named so it can be asked for next
+    reviews, skipped, used = [], [], 0
+    for record in store.iter_results(result_id, selectors['control_ids'], selectors['review_types']):
+        cost = paging.estimate_tokens(record)
+        if reviews and used + cost > FETCH_RESULT_TOKEN_BUDGET:
+            skipped.append({"control_id": record["control_id"], "review_type": record["review_type"]})
+            continue
+        reviews.append(record)
+        used += cost
+    if not reviews:
+        return {"error": f"No stored reviews in '{result_id}' match the given control_ids/review_types."}
+    response = {"result_id": result_id, "reviews": reviews}
+    if skipped:
+        response["not_returned"] = skipped
+        response["note"] = "Token budget reached; fetch the reviews in 'not_returned' by control_id/review_type."
+    return response
+
+fetch_results_tool = Tool(
+    name="FetchReviewResults",
+    func=fetch_review_results_func,
+    description=(
+        "Read the full text of stored reviews from BatchReviewControls. Only use this to answer a question about "
+        "the detail of a specific review; the user already sees the full reviews. "
+        "Args: JSON with 'result_id' and optional 'control_ids' and 'review_types' (lists) to narrow it down."
+    )
+)
+
+# Campaign tools: library-scale reviews that run in the background and are polled for status
+def start_campaign_func(tool_input_str: str) -> dict:
+    try:
+        tool_input = json.loads(tool_input_str)
+    except json.JSONDecodeError:
+        return {"error": f"Invalid JSON input to StartReviewCampaign: {tool_input_str}"}
+    if not isinstance(tool_input, dict):
+        return {"error": "Input must be a JSON object."}
+
+    review_types = tool_input.get('review_types')
+    if not isinstance(review_types, list) or not review_types:
+        return {"error": "'review_types' must be a non-empty list, e.g. ['5W','OE','DE']."}
+    unknown = [r for r in review_types if r not in ("5W", "OE", "DE")]
+    if unknown:
+        return {"error": f"Unknown review type(s): {unknown}. Use 5W, OE or DE."}
+
+    raw_ids = tool_input.get('control_ids', tool_input.get('control_id'))
+    if isinstance(raw_ids, str):
+        raw_ids = [raw_ids]
+    filters = tool_input.get('filters')
+    if raw_ids:
+        selection = {"control_ids": [str(cid) for cid in raw_ids]}
+    elif isinstance(filters, dict):
+        selection = {"filters": filters}
+    else:
+        return {"error": "Provide 'filters' (dict of attribute filters, {} for the whole library) or 'control_ids'."}
+
+    max_concurrency = tool_input.get('max_concurrency')
+    if max_concurrency is not None and (isinstance(max_concurrency, bool) or not isinstance(max_concurrency, int)
+                                        or max_concurrency < 1):
+        return {"error": "'max_concurrency' must be a positive integer."}
+
+    try:
+        return campaigns.start_campaign(
+            selection, review_types, single_review,
+            campaign_id=tool_input.get('campaign_id'),
+            max_concurrency=max_concurrency,
+        )
+    except Exception as e:
+        return {"error": f"Could not start campaign: {e}"}
+
+campaign_tool = Tool(
+    name="StartReviewCampaign",
+    func=start_campaign_func,
+    description=(
+        "Start a background review campaign over any number of controls (no 10-control cap). "
+        "Args: JSON with 'review_types' (e.g. ['5W','OE','DE']) and either 'filters' (FilterControls-style dict, {} for all controls) "
+        "or 'control_ids' (list). Pass an existing 'campaign_id' to resume an interrupted campaign. "
+        "Returns the campaign_id and initial progress; results are stored, not returned. Poll with ReviewCampaignStatus."
+    )
+)
+
+def campaign_status_func(campaign_id: str = "") -> dict | list:
+    campaign_id = (campaign_id or "").strip().strip('"')
+    if not campaign_id:
+        return campaigns.list_campaigns()
+    return campaigns.campaign_status(campaign_id)
+
+campaign_status_tool = Tool(
+    name="ReviewCampaignStatus",
+    func=campaign_status_func,
+    description=(
+        "Report progress of a review campaign: status, completed/total pairs, failures, throughput and ETA. "
+        "Args: the campaign_id string, or an empty string to list all campaigns."
     )
 )
 
 # Explain methods tool
 def explain_methods_func(_: str = None) -> str: # Added default for input
-    return chain_methods.run({}) # Pass empty dict if no input var in prompt
+    return _chain("METHODS").run({}) # Pass empty dict if no input var in prompt
 
 methods_tool = Tool(
     name="ExplainMethods",
@@ -148,18 +609,31 @@ def update_prompt_tool(prompt_key: str, new_template_string: str) -> str:
         prompt_key (str): The key of the prompt to update (e.g., '5W', 'OE', 'DE', 'METHODS').
         new_template_string (str): The new template string. Must include required input variables like '{control}'.
     """
+    overrides = prompts.active_overrides()
+    if overrides is not None:
+        # Inside a service session: the change applies to this session only. Cached reviews
+        # stay valid, as review cache keys include the template.
+        error = prompts.validate_template(prompt_key, new_template_string)
+        if error:
+            return f"Failed to update prompt '{prompt_key}': {error}"
+        overrides[prompt_key] = new_template_string
+        return f"Prompt '{prompt_key}' updated successfully for this session."
     success = prompts.update_prompt(prompt_key, new_template_string)
     if success:
         updated_prompt_template = prompts.get_prompt(prompt_key)
-        if updated_prompt_template and prompt_key in ANALYSIS_CHAINS:
-            ANALYSIS_CHAINS[prompt_key].prompt = updated_prompt_template
+        if updated_prompt_template and prompt_key in analysis_chains():
+            analysis_chains()[prompt_key].prompt = updated_prompt_template
+            # Cached reviews of this type were produced by the old template
+            cache = get_review_cache()
+            if cache is not None:
+                cache.invalidate(prompt_key)
             # Also update the global prompt variables in prompts.py if they are directly used (handled in prompts.update_prompt)
             return f"Prompt '{prompt_key}' updated successfully."
         elif not updated_prompt_template:
             return f"Error: Prompt '{prompt_key}' template object not found after update."
-        else: # prompt_key not in ANALYSIS_CHAINS (e.g. if it was some other prompt)
+        else: # prompt_key not in analysis_chains() (e.g. if it was some other prompt)
             return f"Prompt template for '{prompt_key}' updated in prompts module, but no corresponding chain found in tools.py to update."
     return f"Failed to update prompt '{prompt_key}'. Key not found or error during update."
 
 # Export all tools
-TOOLS = [filter_tool, review_tool, methods_tool, update_prompt_tool] 
\ No newline at end of file
+TOOLS = [filter_tool, aggregate_tool, similar_tool, duplicates_tool, review_tool, fetch_results_tool, campaign_tool, campaign_status_tool, methods_tool, update_prompt_tool] 
\ No newline at end of file
@@ -0,0 +1,409 @@
+"""
+Spans and Prometheus metrics for agent turns, tools, chains and LLM calls.
+
+TracingHandler is a LangChain callback handler. It is attached to every agent
+turn and to every client from llm_clients.get_llm(). It turns callbacks into a
+span tree per turn:
+
+    turn         AgentExecutor.invoke (or any chain run outside an agent)
+    agent_step   one planning call of the agent (prompt + LLM + output parser)
+    tool         a tool call, with input/output payload sizes and review cache hits/misses
+    chain        an LLMChain such as review_5W, with its LLM calls below it
+    llm          one model call, with input/output tokens, prompt size and throttle retries/wait
+
+Finished turns are appended to TRACE_PATH as JSON lines, one span per line,
+sampled per turn with TRACE_SAMPLE_RATE. Every span also feeds counters and
+histograms that metrics_text() renders in the Prometheus text format. The same
+text is served from /metrics if TRACE_METRICS_PORT is set.
+
+Overhead is a few microseconds per span. Chain runs that are only plumbing
+(prompt formatting, parsers, lambdas) are not recorded; their children are
+attached to the nearest recorded ancestor. Set TRACE_ENABLED=0 to turn all of
+it off.
+"""
+import atexit
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from .config import cache_path
+
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "1").lower() not in ("0", "false", "no")
+TRACE_PATH = os.environ.get("TRACE_PATH") or cache_path("traces", "spans.jsonl")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", 1.0))
+# The span file is rotated to <path>.1 beyond this size
+TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", 50 * 1024 * 1024))
+TRACE_METRICS_PORT = int(os.environ.get("TRACE_METRICS_PORT", 0))
+
+TRACE_EVENT = "trace_attributes"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Attributes of the LLM call running in this context, filled in by the client (retries, throttle wait)
+_llm_call_attrs: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("llm_call_attrs", default=None)
+
+
+def annotate_llm_call(**attrs: Any) -> None:
+    """Add attributes to the span of the LLM call in progress in this context, if any."""
+    current = _llm_call_attrs.get()
+    if current is not None:
+        current.update(attrs)
+
+
+def annotate_run(**attrs: Any) -> None:
+    """
+    Add numeric attributes to the span of the enclosing run (e.g. the tool call), summed
+    if recorded several times. Outside a traced run this does nothing.
+    """
+    if not TRACE_ENABLED:
+        return
+    # Imported here: the callback manager pulls in langsmith, which is only worth loading inside a run
+    from langchain_core.callbacks import dispatch_custom_event
+
+    try:
+        dispatch_custom_event(TRACE_EVENT, attrs)
+    except RuntimeError:
+        # Not inside a run
+        pass
+
+
+class _Metrics:
+    """Counters and histograms keyed by (name, sorted labels), rendered in the Prometheus text format."""
+
+    _HELP = {
+        "agent_spans_total": ("counter", "Finished spans by kind, name and status."),
+        "agent_span_duration_seconds": ("histogram", "Wall time of spans by kind and name."),
+        "llm_tokens_total": ("counter", "LLM tokens by model and direction (input/output)."),
+        "llm_retries_total": ("counter", "Retried LLM requests by model."),
+        "review_cache_lookups_total": ("counter", "Review cache lookups by result (hit/miss)."),
+        "review_prompts_total": ("counter", "Review prompts sent by review type (FUSED for fused calls)."),
+        "review_prompt_tokens_total": ("counter", "Estimated review prompt input tokens by review type and layout "
+                                                  "(sent, or baseline: what the repr() layout would have cost)."),
+        "tool_payload_bytes_total": ("counter", "Tool input/output payload bytes by tool and direction."),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List[float]] = {}  # bucket counts..., sum, count
+
+    def inc(self, metric: str, value: float = 1.0, **labels: str) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, metric: str, value: float, **labels: str) -> None:
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0.0] * (len(DURATION_BUCKETS) + 2)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += value
+            h[-1] += 1
+
+    def render(self) -> str:
+        def _labels(pairs, extra=()):
+            items = list(pairs) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                                  for k, v in items) + "}"
+
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+        lines = []
+        for name in sorted({k[0] for k in counters} | {k[0] for k in histograms}):
+            kind, help_text = self._HELP.get(name, ("counter", ""))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {value:g}")
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for bound, count in zip(DURATION_BUCKETS, h):
+                    lines.append(f"{name}_bucket{_labels(labels, [('le', f'{bound:g}')])} {count:g}")
+                lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {h[-1]:g}")
+                lines.append(f"{name}_sum{_labels(labels)} {h[-2]:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {h[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = _Metrics()
+
+
+class _SpanSink:
+    """Appends finished traces to a JSONL file, rotating it past TRACE_MAX_BYTES."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._file = None
+
+    def write(self, spans: List[Dict[str, Any]]) -> None:
+        lines = "".join(json.dumps(s, default=str, separators=(",", ":")) + "\n" for s in spans)
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._file = open(self.path, "a", buffering=1 << 16)
+                self._file.write(lines)
+                self._file.flush()
+                if self._file.tell() > self.max_bytes:
+                    self._file.close()
+                    os.replace(self.path, self.path + ".1")
+                    self._file = None
+            except OSError as e:
+                print(f"Warning: could not write traces to {self.path} ({e}).")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class TracingHandler(BaseCallbackHandler):
+    """Records turn, agent step, tool, chain and LLM spans from LangChain callbacks."""
+
+    # Run in the calling thread so annotate_llm_call() sees the context of the model call
+    run_inline = True
+
+    def __init__(self, sink: Optional[_SpanSink] = None, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._spans: Dict[UUID, Dict[str, Any]] = {}    # open spans by run_id
+        self._alias: Dict[UUID, Optional[UUID]] = {}    # unrecorded run -> nearest recorded ancestor
+        self._traces: Dict[str, List[Dict[str, Any]]] = {}  # trace_id -> finished spans, until the root ends
+        self._llm_tokens: Dict[UUID, contextvars.Token] = {}
+
+    # -- span bookkeeping ------------------------------------------------------------------------
+
+    def _parent(self, parent_run_id: Optional[UUID]) -> Optional[Dict[str, Any]]:
+        # Caller holds the lock
+        while parent_run_id is not None and parent_run_id not in self._spans:
+            parent_run_id = self._alias.get(parent_run_id)
+        return self._spans.get(parent_run_id) if parent_run_id is not None else None
+
+    def _open(self, run_id: UUID, parent_run_id: Optional[UUID], kind: str, name: str, **attrs: Any) -> None:
+        with self._lock:
+            parent = self._parent(parent_run_id)
+            trace_id = parent["trace_id"] if parent else uuid.uuid4().hex
+            if parent is None:
+                self._traces[trace_id] = []
+            self._spans[run_id] = {
+                "trace_id": trace_id, "span_id": run_id.hex, "parent_id": parent["span_id"] if parent else None,
+                "kind": kind, "name": name, "start": time.time(), "_t0": time.perf_counter(),
+                "status": "ok", "attrs": attrs,
+                "_sampled": parent["_sampled"] if parent else random.random() < self.sample_rate,
+            }
+
+    def _skip(self, run_id: UUID, parent_run_id: Optional[UUID]) -> None:
+        with self._lock:
+            self._alias[run_id] = parent_run_id
+
+    def _close(self, run_id: UUID, error: Optional[BaseException] = None, **attrs: Any) -> None:
+        with self._lock:
+            if self._alias.pop(run_id, None) is not None or run_id not in self._spans:
+                return
+            span = self._spans.pop(run_id)
+            span["duration_ms"] = round((time.perf_counter() - span.pop("_t0")) * 1e3, 3)
+            span["attrs"].update(attrs)
+            if error is not None:
+                span["status"] = "error"
+                span["error"] = f"{type(error).__name__}: {error}"[:500]
+            sampled = span.pop("_sampled")
+            trace = self._traces.get(span["trace_id"])
+            if trace is not None and sampled:
+                trace.append(span)
+            finished = None
+            if span["parent_id"] is None:
+                finished = self._traces.pop(span["trace_id"], None)
+        metrics.inc("agent_spans_total", kind=span["kind"], name=span["name"], status=span["status"])
+        metrics.observe("agent_span_duration_seconds", span["duration_ms"] / 1e3, kind=span["kind"], name=span["name"])
+        if finished and self.sink is not None:
+            self.sink.write(finished)
+
+    # -- chains, agent steps and turns -----------------------------------------------------------
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+        with self._lock:
+            parent = self._parent(parent_run_id)
+        if parent is None:
+            self._open(run_id, None, "turn", name)
+        elif parent["kind"] == "turn" and parent["name"] == "AgentExecutor":
+            self._open(run_id, parent_run_id, "agent_step", "plan")
+        elif name == "LLMChain" or name.startswith("review_"):
+            self._open(run_id, parent_run_id, "chain", name)
+        else:
+            self._skip(run_id, parent_run_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._close(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._close(run_id, error)
+
+    # -- tools -----------------------------------------------------------------------------------
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "tool"
+        size = len(input_str.encode("utf-8")) if isinstance(input_str, str) else 0
+        self._open(run_id, parent_run_id, "tool", name, input_bytes=size)
+        metrics.inc("tool_payload_bytes_total", size, tool=name, direction="input")
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        content = getattr(output, "content", output)
+        text = content if isinstance(content, str) else json.dumps(content, default=str)
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            span = self._spans.get(run_id)
+        if span is not None:
+            metrics.inc("tool_payload_bytes_total", size, tool=span["name"], direction="output")
+        self._close(run_id, output_bytes=size)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._close(run_id, error)
+
+    # -- LLM calls -------------------------------------------------------------------------------
+
+    def _llm_start(self, run_id: UUID, parent_run_id: Optional[UUID], prompt_chars: int, kwargs: Dict[str, Any]) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = ((kwargs.get("metadata") or {}).get("ls_model_name") or params.get("model")
+                 or params.get("model_name") or params.get("_type") or "llm")
+        self._open(run_id, parent_run_id, "llm", str(model), prompt_chars=prompt_chars)
+        self._llm_tokens[run_id] = _llm_call_attrs.set({})
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        chars = sum(len(m.content) if isinstance(m.content, str) else len(str(m.content)) for batch in messages for m in batch)
+        self._llm_start(run_id, parent_run_id, chars, kwargs)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any) -> None:
+        self._llm_start(run_id, parent_run_id, sum(len(p) for p in prompts), kwargs)
+
+    def _llm_attrs(self, run_id: UUID) -> Dict[str, Any]:
+        token = self._llm_tokens.pop(run_id, None)
+        attrs = dict(_llm_call_attrs.get() or {})
+        if token is not None:
+            try:
+                _llm_call_attrs.reset(token)
+            except ValueError:
+                # Ended in a different context than it started in
+                pass
+        return attrs
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        attrs = self._llm_attrs(run_id)
+        usage = {}
+        try:
+            message = response.generations[0][0].message
+            usage = getattr(message, "usage_metadata", None) or {}
+        except (AttributeError, IndexError):
+            pass
+        if not usage and isinstance(getattr(response, "llm_output", None), dict):
+            raw = response.llm_output.get("usage") or {}
+            usage = {"input_tokens": raw.get("input_tokens"), "output_tokens": raw.get("output_tokens")}
+        with self._lock:
+            span = self._spans.get(run_id)
+        model = span["name"] if span else "llm"
+        for direction in ("input", "output"):
+            tokens = usage.get(f"{direction}_tokens")
+            if tokens:
+                attrs[f"{direction}_tokens"] = tokens
+                metrics.inc("llm_tokens_total", tokens, model=model, direction=direction)
+        if attrs.get("retries"):
+            metrics.inc("llm_retries_total", attrs["retries"], model=model)
+        self._close(run_id, **attrs)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        attrs = self._llm_attrs(run_id)
+        self._close(run_id, error, **attrs)
+
+    # -- attributes reported from inside a run ---------------------------------------------------
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if name != TRACE_EVENT or not isinstance(data, dict):
+            return
+        with self._lock:
+            span = self._spans.get(run_id) or self._parent(run_id)
+            if span is None:
+                return
+            for key, value in data.items():
+                span["attrs"][key] = span["attrs"].get(key, 0) + value if isinstance(value, (int, float)) else value
+
+
+def record_prompt_tokens(review_type: str, prompt_tokens: int, baseline_tokens: int) -> None:
+    """Count a review prompt's estimated input tokens, and its repr()-layout baseline, in the metrics."""
+    if not TRACE_ENABLED:
+        return
+    metrics.inc("review_prompts_total", review_type=review_type)
+    metrics.inc("review_prompt_tokens_total", prompt_tokens, review_type=review_type, layout="sent")
+    metrics.inc("review_prompt_tokens_total", baseline_tokens, review_type=review_type, layout="baseline")
+
+
+def record_cache_lookup(hit: bool) -> None:
+    """Count a review cache lookup, in the metrics and on the enclosing span."""
+    if not TRACE_ENABLED:
+        return
+    metrics.inc("review_cache_lookups_total", result="hit" if hit else "miss")
+    annotate_run(**{"cache_hits" if hit else "cache_misses": 1})
+
+
+def metrics_text() -> str:
+    """Current counters and histograms in the Prometheus text exposition format."""
+    return metrics.render()
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int = TRACE_METRICS_PORT, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve metrics_text() at http://host:port/metrics from a daemon thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_sink = _SpanSink(TRACE_PATH, TRACE_MAX_BYTES) if TRACE_ENABLED else None
+atexit.register(lambda: _sink and _sink.close())
+handler: Optional[TracingHandler] = TracingHandler(_sink) if TRACE_ENABLED else None
+
+
+def callbacks() -> List[BaseCallbackHandler]:
+    """The handlers to attach to a run or a model: [handler], or [] with tracing off."""
+    return [handler] if handler is not None else []
+
+
+if TRACE_ENABLED and TRACE_METRICS_PORT:
+    start_metrics_server(TRACE_METRICS_PORT)